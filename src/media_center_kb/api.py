@@ -0,0 +1,204 @@
+"""
+Local control API: JSON lines over a Unix domain socket.
+
+Every request is a single line, every response is a single line:
+
+    {"cmd": "tv_on"}                           -> {"ok": true}
+    {"cmd": "volume_set", "args": [30]}        -> {"ok": true}
+    {"cmd": "state"}                           -> {"ok": true, "state": {"tv": true, ...}}
+    {"batch": [{"cmd": "printer_off"}, {"cmd": "tv_on"}]}
+                                               -> {"ok": true, "results": [{"ok": true}, ...]}
+
+    {"cmd": "timer", "run": "turntable_off", "after": 1800}
+                                               -> {"ok": true, "timer": 1}
+    {"cmd": "timer", "run": "printer_off", "daily": "23:30"}
+    {"cmd": "timers"}                          -> {"ok": true, "timers": [{"id": 1, ...}]}
+    {"cmd": "timer_cancel", "timer": 1}        -> {"ok": true}
+
+The socket is created readable and writable by the daemon user and group only.
+
+An optional "id" field is copied into the response, it is sent once the command is done.
+Batch commands run in order, a failed one does not stop the rest.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+import tempfile
+from typing import Any, Dict, Mapping, Optional, Union
+
+from media_center_kb.control import Controller
+from media_center_kb.rooms import Rooms
+from media_center_kb.timers import TimerService
+
+logger = logging.getLogger("api")
+
+STATE_CMD = "state"
+TIMER_CMD = "timer"
+TIMERS_CMD = "timers"
+TIMER_CANCEL_CMD = "timer_cancel"
+TIMER_CMDS = (TIMER_CMD, TIMERS_CMD, TIMER_CANCEL_CMD)
+SOCKET_MODE = 0o660
+
+
+class ControlServer:
+    """Unix socket server executing Controller commands"""
+
+    def __init__(
+        self,
+        controller: Union[Controller, Rooms],
+        path: str,
+        timers: Optional[TimerService] = None,
+    ):
+        """
+        controller: a single controller or rooms with prefixed commands
+        timers: sleep timers and schedules managed over the API
+        """
+        self._controller = controller
+        self._commands = controller.async_commands_map()
+        self._path = path
+        self._timers = timers
+
+    def _timer_request(self, timers: TimerService, request: Mapping[str, Any]):
+        cmd = request["cmd"]
+        if cmd == TIMERS_CMD:
+            return {"ok": True, "timers": timers.timers()}
+        if cmd == TIMER_CANCEL_CMD:
+            timer = request.get("timer")
+            if not isinstance(timer, int) or not timers.cancel(timer):
+                return {"ok": False, "error": f"no timer {timer}"}
+            return {"ok": True}
+        return self._add_timer(timers, request)
+
+    @staticmethod
+    def _add_timer(timers: TimerService, request: Mapping[str, Any]):
+        command, args = request.get("run"), request.get("args", [])
+        if not isinstance(command, str):
+            return {"ok": False, "error": "run must be a command name"}
+        if not isinstance(args, list):
+            return {"ok": False, "error": "args must be a list"}
+        try:
+            timer = timers.add(
+                command,
+                args,
+                delay=request.get("after"),
+                daily=request.get("daily"),
+            )
+        except ValueError as ex:
+            return {"ok": False, "error": str(ex)}
+        return {"ok": True, "timer": timer}
+
+    async def _execute_one(self, request: Mapping[str, Any]) -> Dict[str, Any]:
+        cmd = request.get("cmd")
+        if cmd == STATE_CMD:
+            return {"ok": True, "state": self._controller.state()}
+        if cmd in TIMER_CMDS and self._timers is not None:
+            return self._timer_request(self._timers, request)
+
+        handler = self._commands.get(cmd) if isinstance(cmd, str) else None
+        if handler is None:
+            return {"ok": False, "error": f"unknown command: {cmd}"}
+        args = request.get("args", [])
+        if not isinstance(args, list):
+            return {"ok": False, "error": "args must be a list"}
+        try:
+            await handler(*args)
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            logger.error("command %s failed: %s", cmd, ex)
+            return {"ok": False, "error": str(ex)}
+        return {"ok": True}
+
+    async def execute(self, request: Any) -> Dict[str, Any]:
+        """Execute a single or batch request and return a response"""
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "request must be an object"}
+
+        batch = request.get("batch")
+        if batch is not None:
+            if not isinstance(batch, list):
+                response = {"ok": False, "error": "batch must be a list"}
+            else:
+                results = [
+                    (
+                        await self._execute_one(item)
+                        if isinstance(item, dict)
+                        else {"ok": False, "error": "request must be an object"}
+                    )
+                    for item in batch
+                ]
+                response = {
+                    "ok": all(result["ok"] for result in results),
+                    "results": results,
+                }
+        else:
+            response = await self._execute_one(request)
+
+        if "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    async def handle_line(self, line: bytes) -> bytes:
+        """Parse a request line and return an encoded response line"""
+        try:
+            request = json.loads(line)
+        except ValueError as ex:
+            response = {"ok": False, "error": f"bad json: {ex}"}
+        else:
+            logger.debug("api request: %s", request)
+            response = await self.execute(request)
+        return json.dumps(response, separators=(",", ":")).encode() + b"\n"
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                writer.write(await self.handle_line(line))
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as ex:
+            logger.debug("api client error: %s", ex)
+        finally:
+            writer.close()
+
+    def _remove_stale_socket(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self._path).st_mode):
+                os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _bind(self) -> socket.socket:
+        """Socket bound in a private 0700 directory, chmod-ed and moved into place,
+        so it is never accessible by others. The process umask is left alone,
+        other threads may be creating files meanwhile"""
+        private = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(self._path)))
+        bound = os.path.join(private, "sock")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(bound)
+            os.chmod(bound, SOCKET_MODE)
+            os.replace(bound, self._path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            if os.path.exists(bound):
+                os.unlink(bound)
+            os.rmdir(private)
+        return sock
+
+    async def serve(self):
+        """Serve until cancelled"""
+        self._remove_stale_socket()
+        server = await asyncio.start_unix_server(self._handle_client, sock=self._bind())
+        logger.info("control API listening on %s", self._path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._remove_stale_socket()
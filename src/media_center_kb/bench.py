@@ -0,0 +1,301 @@
+"""
+Dispatch benchmark to compare event loop implementations.
+
+Key presses are written to a pipe as raw input_event records and go through
+the evdev async read path and kb dispatch, MQTT commands are called from
+another thread and wait for the result on the loop like paho callbacks do.
+Devices are no-op, so the numbers are dispatch and event loop overhead.
+
+    python -m media_center_kb.bench --loop asyncio uvloop -n 2000
+
+burst: events are sent back to back, measures throughput
+paced: next event is sent after the previous one is handled, measures latency
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+from evdev import ecodes
+from evdev.eventio_async import EventIO
+
+import media_center_kb.control
+from media_center_kb.config import Config, load_config
+from media_center_kb.control import Controller
+from media_center_kb.gpio import GPioNoOp
+from media_center_kb.kb import dispatch_events
+from media_center_kb.loops import LOOPS, use_event_loop
+from media_center_kb.relays import RelayModule
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+_INPUT_EVENT = struct.Struct("llHHi")
+
+# pylint: disable=no-member
+_KEY_CODES = {name: code for code, name in ecodes.KEY.items() if isinstance(name, str)}
+
+
+def _noop(*_, **__):
+    pass
+
+
+async def _async_noop(*_, **__):
+    pass
+
+
+def when_done(result: Any, callback: Callable[[], None]) -> Optional[asyncio.Future]:
+    """Call back once a command handler result is done: commands started on the
+    event loop return a task, the callback runs when it finishes.
+    Returns the task"""
+    if isinstance(result, asyncio.Future):
+        result.add_done_callback(lambda _: callback())
+        return result
+    callback()
+    return None
+
+
+class NullYsp:  # pylint: disable=too-few-public-methods
+    """Soundbar stand-in accepting any command"""
+
+    def __getattr__(self, _: str) -> Callable:
+        return _noop
+
+
+class PipeInput(EventIO):
+    """evdev reader over a pipe instead of an input device"""
+
+    def __init__(self, fd: int):  # pylint: disable=invalid-name
+        self.fd = fd  # pylint: disable=invalid-name
+
+
+class LatencyStats:  # pylint: disable=too-few-public-methods
+    """Latency samples summary"""
+
+    def __init__(self, samples: Sequence[float], elapsed: float):
+        ordered = sorted(samples)
+        self.count = len(ordered)
+        self.mean = statistics.fmean(ordered) if ordered else 0.0
+        self.p50 = ordered[self.count // 2] if ordered else 0.0
+        self.p99 = (
+            ordered[min(int(self.count * 0.99), self.count - 1)] if ordered else 0.0
+        )
+        self.max = ordered[-1] if ordered else 0.0
+        self.throughput = self.count / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        """Stats as a dict, latencies in microseconds"""
+        return {
+            "count": self.count,
+            "throughput": round(self.throughput, 1),
+            "mean_us": round(self.mean * 1e6, 1),
+            "p50_us": round(self.p50 * 1e6, 1),
+            "p99_us": round(self.p99 * 1e6, 1),
+            "max_us": round(self.max * 1e6, 1),
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.throughput:10.0f}/s  mean {self.mean * 1e6:8.1f}us  "
+            f"p50 {self.p50 * 1e6:8.1f}us  p99 {self.p99 * 1e6:8.1f}us  "
+            f"max {self.max * 1e6:8.1f}us"
+        )
+
+
+def make_controller(config: Optional[Config] = None) -> Controller:
+    """Controller with no-op hardware, the built-in configuration by default"""
+    if config is None:
+        config = load_config(None)
+    relays = RelayModule(GPioNoOp(config.pins), logging.getLogger("rly"), config.pins)
+    return Controller(relays, NullYsp(), config=config)  # type: ignore[arg-type]
+
+
+def _key_press(code: int, stamp: float) -> bytes:
+    sec = int(stamp)
+    usec = int((stamp - sec) * 1e6)
+    return b"".join(
+        _INPUT_EVENT.pack(sec, usec, evt_type, evt_code, value)
+        for evt_type, evt_code, value in (
+            (ecodes.EV_KEY, code, 1),
+            (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+            (ecodes.EV_KEY, code, 0),
+            (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        )
+    )
+
+
+class _Recorder:  # pylint: disable=too-few-public-methods
+    """Wraps handlers to record latency and signal progress"""
+
+    def __init__(self, count: int, loop: asyncio.AbstractEventLoop):
+        self.count = count
+        self.latencies: List[float] = []
+        # send times by event index
+        self.sent: List[float] = []
+        self.handled = threading.Event()
+        self.done = loop.create_future()
+        self._loop = loop
+        self._started = 0
+
+    def wrap(self, handler: Callable) -> Callable:
+        """Handler recording time since the event was sent"""
+
+        def inner(*args):
+            # events reach handlers in the order they were sent, but commands
+            # on different devices or superseded ones finish in any order
+            idx = self._started
+            self._started += 1
+            when_done(handler(*args), lambda: self._record(idx))
+
+        return inner
+
+    def _record(self, idx: int):
+        self.latencies.append(time.perf_counter() - self.sent[idx])
+        self.handled.set()
+        if len(self.latencies) == self.count:
+            # MQTT commands are recorded on the producer thread
+            self._loop.call_soon_threadsafe(self._finish)
+
+    def _finish(self):
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+def _producer(
+    recorder: _Recorder, send: Callable[[int], None], paced: bool, count: int
+):
+    for i in range(count):
+        recorder.handled.clear()
+        recorder.sent.append(time.perf_counter())
+        send(i)
+        if paced and not recorder.handled.wait(5):
+            return
+
+
+async def bench_keyboard(
+    handlers: Mapping[str, Callable], count: int, paced: bool
+) -> LatencyStats:
+    """Key presses through the evdev read path and kb dispatch"""
+    loop = asyncio.get_running_loop()
+    recorder = _Recorder(count, loop)
+    wrapped = {key: recorder.wrap(handler) for key, handler in handlers.items()}
+    codes = [_KEY_CODES[key] for key in handlers]
+
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    reader = asyncio.create_task(
+        dispatch_events(PipeInput(read_fd).async_read_loop(), wrapped)
+    )
+
+    def send(i: int):
+        os.write(write_fd, _key_press(codes[i % len(codes)], recorder.sent[i]))
+
+    started = time.perf_counter()
+    producer = threading.Thread(
+        target=_producer, args=(recorder, send, paced, count), daemon=True
+    )
+    producer.start()
+    try:
+        await asyncio.wait_for(recorder.done, 60)
+    finally:
+        elapsed = time.perf_counter() - started
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        # cancelled evdev read leaves the fd reader registered
+        loop.remove_reader(read_fd)
+        producer.join()
+        os.close(read_fd)
+        os.close(write_fd)
+    return LatencyStats(recorder.latencies, elapsed)
+
+
+async def bench_mqtt(
+    commands: Mapping[str, Callable], count: int, paced: bool
+) -> LatencyStats:
+    """Sync commands (Controller.commands_map()) called from a foreign thread
+    the way MQTT callbacks are: each one waits for its coroutine on the loop"""
+    loop = asyncio.get_running_loop()
+    recorder = _Recorder(count, loop)
+    names = sorted(commands)
+
+    def on_message(payload: bytes):
+        command = commands.get(payload.decode())
+        return command() if command is not None else None
+
+    handle = recorder.wrap(on_message)
+
+    def send(i: int):
+        # like the paho network thread, the producer handles its own messages
+        handle(names[i % len(names)].encode())
+
+    runner = media_center_kb.control.runner
+    runner.bind(loop)
+    started = time.perf_counter()
+    producer = threading.Thread(
+        target=_producer, args=(recorder, send, paced, count), daemon=True
+    )
+    producer.start()
+    try:
+        await asyncio.wait_for(recorder.done, 60)
+    finally:
+        elapsed = time.perf_counter() - started
+        await loop.run_in_executor(None, producer.join)
+        runner.bind(None)
+    return LatencyStats(recorder.latencies, elapsed)
+
+
+async def run_suite(count: int) -> Dict[str, LatencyStats]:
+    """All benchmarks on the current event loop"""
+    controller = make_controller()
+    handlers = controller.kb_handlers()
+    commands = {
+        name: cmd
+        for name, cmd in controller.commands_map().items()
+        if name not in ("volume_set", "shutdown")
+    }
+    results = {}
+    for paced in (False, True):
+        mode = "paced" if paced else "burst"
+        results[f"keyboard {mode}"] = await bench_keyboard(handlers, count, paced)
+        results[f"mqtt {mode}"] = await bench_mqtt(commands, count, paced)
+    return results
+
+
+def run(loops: Sequence[str], count: int) -> Dict[str, Dict[str, LatencyStats]]:
+    """Run the suite under every requested loop"""
+    # the graceful 1s soundbar power off sleep is not what is measured
+    orig_sleeper = media_center_kb.control.sleeper
+    media_center_kb.control.sleeper = _async_noop
+    try:
+        results = {}
+        for name in loops:
+            used = use_event_loop(name)
+            results[used] = asyncio.run(run_suite(count))
+        return results
+    finally:
+        media_center_kb.control.sleeper = orig_sleeper
+        use_event_loop("asyncio")
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """Run benchmark and print results"""
+    parser = argparse.ArgumentParser(description="Dispatch benchmark")
+    parser.add_argument(
+        "--loop", nargs="+", choices=LOOPS, default=list(LOOPS), help="Event loops"
+    )
+    parser.add_argument(
+        "-n", dest="count", type=int, default=2000, help="Events per benchmark"
+    )
+    args = parser.parse_args(argv)
+
+    for loop_name, results in run(args.loop, args.count).items():
+        for bench_name, stats in results.items():
+            print(f"{loop_name:8} {bench_name:16} {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Circuit breaker: stop calling a device after repeated failures"""
+
+import logging
+import threading
+from enum import Enum
+
+logger = logging.getLogger("brk")
+
+
+class BreakerState(Enum):
+    """Closed: calls go through, open: calls fail fast, half open: probing"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Opens after threshold consecutive failures, closes on the next success"""
+
+    def __init__(self, name: str, threshold: int = 3):
+        self.name = name
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._state = BreakerState.CLOSED
+        self.opened = 0
+
+    @property
+    def state(self) -> BreakerState:
+        """Current state"""
+        return self._state
+
+    @property
+    def closed(self) -> bool:
+        """Calls go through"""
+        return self._state == BreakerState.CLOSED
+
+    def success(self) -> bool:
+        """Record a success, returns True if the breaker was closed by it"""
+        with self._lock:
+            self._failures = 0
+            if self._state == BreakerState.CLOSED:
+                return False
+            self._state = BreakerState.CLOSED
+        logger.warning("%s responds again, circuit closed", self.name)
+        return True
+
+    def failure(self) -> bool:
+        """Record a failure, returns True if the breaker was opened by it"""
+        with self._lock:
+            self._failures += 1
+            if self._state == BreakerState.HALF_OPEN:
+                self._state = BreakerState.OPEN
+                return False
+            if self._state == BreakerState.OPEN or self._failures < self._threshold:
+                return False
+            self._state = BreakerState.OPEN
+            self.opened += 1
+        logger.error(
+            "%s failed %d times in a row, circuit open", self.name, self._threshold
+        )
+        return True
+
+    def try_probe(self) -> bool:
+        """Move from open to half open, True if the caller should probe now"""
+        with self._lock:
+            if self._state != BreakerState.OPEN:
+                return False
+            self._state = BreakerState.HALF_OPEN
+            return True
@@ -0,0 +1,368 @@
+"""
+Declarative configuration: relays, devices, scenes and key bindings.
+
+JSON or TOML (by .toml suffix) file, every section is optional and defaults
+to the media center this project was built for:
+
+    {
+      "relays": {"soundbar": 6, "spare": 13, "turntable": 19, "printer": 26},
+      "devices": {
+        "tv": {
+          "relays": ["soundbar"],
+          "soundbar": ["set_input_tv", "set_5beam", "set_dsp_cinema"]
+        },
+        "printer": {"relays": ["printer"]}
+      },
+      "scenes": {"movie_night": ["printer_off", "tv_on"]},
+      "keymap": {"KEY_KP7": "tv_on", "KEY_KP5": "movie_night"}
+    }
+
+relays: relay name -> GPIO pin, relays are numbered 1, 2, ... in this order.
+devices: relays switched on in order (off in reverse), soundbar commands sent after
+    the soundbar is powered on, a device without "soundbar" is a plain outlet.
+    "volume" is faded in to after power on, the volume before the last power off
+    by default.
+    Each device has <name>_on and <name>_off commands, "command" overrides the name.
+    "cups" is the printer URI (ipp://localhost/printers/<name>) of a printer powered on
+    when CUPS has jobs for it and off after "idle_off" seconds without jobs.
+scenes: command lists, the scene name becomes a command. Steps using different
+    hardware (relays, the soundbar) run at the same time, a step waits for the earlier
+    steps sharing hardware with it.
+keymap: key code -> command name.
+serial_port, keypad: soundbar serial port and keypad input device, the defaults if not set.
+
+Several rooms, each with its own relay board, soundbar and keypad, are described in
+a "rooms" object of such configurations. The room name then prefixes its commands,
+subsystems and metric labels: "bedroom/tv_on". Rooms must not share GPIO pins,
+serial ports or keypads.
+
+The file is validated and compiled once at startup into a Config with relay numbers
+instead of names, the Controller turns it into a flat command table.
+"""
+
+import json
+from typing import Any, Dict, FrozenSet, NamedTuple, Optional, Set, Tuple
+
+from media_center_kb.ysp_scheduler import COMMANDS, PRIORITY_MODE
+
+# commands of the controller itself, not tied to configured devices
+BUILTIN_COMMANDS = ("off", "shutdown", "volume_up", "volume_down", "volume_set")
+# builtin commands switching everything off
+BOARD_COMMANDS = ("off", "shutdown")
+# commands taking an argument, cannot be scene steps
+ARG_COMMANDS = ("volume_set",)
+
+# soundbar commands a device can send after power on
+SOUNDBAR_COMMANDS = tuple(
+    name for name, (priority, _) in COMMANDS.items() if priority == PRIORITY_MODE
+)
+
+DEFAULT_KEYMAP = {
+    "KEY_KP7": "tv_on",
+    "KEY_KP4": "tv_off",
+    "KEY_KP8": "turntable_on",
+    "KEY_KP5": "turntable_off",
+    "KEY_KP9": "streaming_on",
+    "KEY_KP6": "streaming_off",
+    "KEY_KPMINUS": "printer_on",
+    "KEY_KPPLUS": "printer_off",
+    "KEY_KPENTER": "off",
+    "KEY_KP1": "volume_up",
+    "KEY_KP0": "volume_down",
+    "KEY_ESC": "shutdown",
+}
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "relays": {"soundbar": 6, "spare": 13, "turntable": 19, "printer": 26},
+    "devices": {
+        "tv": {
+            "relays": ["soundbar"],
+            "soundbar": ["set_input_tv", "set_5beam", "set_dsp_cinema"],
+        },
+        "bt": {
+            "relays": ["soundbar"],
+            "soundbar": ["set_input_tv", "set_dsp_off", "set_stereo"],
+            "command": "streaming",
+        },
+        "turntable": {
+            "relays": ["soundbar", "turntable"],
+            "soundbar": ["set_input_aux1", "set_dsp_off", "set_stereo"],
+        },
+        "printer": {"relays": ["printer"]},
+    },
+    "scenes": {},
+    "keymap": DEFAULT_KEYMAP,
+}
+
+
+class DeviceConfig(NamedTuple):
+    """Compiled device"""
+
+    # relay numbers
+    relays: Tuple[int, ...]
+    # soundbar commands after power on, None if the device does not use the soundbar
+    soundbar: Optional[Tuple[str, ...]]
+    # <command>_on and <command>_off
+    command: str
+    # volume to fade in to after power on
+    volume: Optional[int] = None
+    # CUPS printer URI driving the power, seconds without jobs before power off
+    cups: Optional[str] = None
+    idle_off: Optional[float] = None
+
+
+class Config(NamedTuple):
+    """Compiled configuration"""
+
+    # GPIO pin of relay 1, 2, ...
+    pins: Tuple[int, ...]
+    devices: Dict[str, DeviceConfig]
+    scenes: Dict[str, Tuple[str, ...]]
+    keymap: Dict[str, str]
+    serial_port: Optional[str] = None
+    keypad: Optional[str] = None
+
+    def device_commands(self) -> Dict[str, Tuple[str, bool]]:
+        """Command name -> device name and on (True) or off"""
+        result = {}
+        for name, device in self.devices.items():
+            result[f"{device.command}_on"] = (name, True)
+            result[f"{device.command}_off"] = (name, False)
+        return result
+
+    def resources(self, command: str) -> FrozenSet[str]:
+        """Hardware a command uses: relay<N> and soundbar"""
+        if command in self.scenes:
+            return frozenset().union(*(self.resources(s) for s in self.scenes[command]))
+        if command in BOARD_COMMANDS:
+            relays: Tuple[int, ...] = tuple(range(1, len(self.pins) + 1))
+            soundbar = True
+        elif command in BUILTIN_COMMANDS:
+            relays, soundbar = (), True
+        else:
+            device = self.devices[self.device_commands()[command][0]]
+            relays, soundbar = device.relays, device.soundbar is not None
+        result = {f"relay{relay}" for relay in relays}
+        if soundbar:
+            result.add("soundbar")
+        return frozenset(result)
+
+
+def read_config(path: str) -> Any:
+    """Read JSON or TOML file"""
+    if path.endswith(".toml"):
+        try:
+            import tomllib  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise ValueError(f"{path}: TOML config needs Python 3.11") from ex
+        with open(path, "rb") as toml_file:
+            try:
+                return tomllib.load(toml_file)
+            except tomllib.TOMLDecodeError as ex:
+                raise ValueError(f"{path}: {ex}") from ex
+    with open(path, "rt", encoding="utf8") as json_file:
+        return json.load(json_file)
+
+
+def _names(value: Any, what: str) -> Tuple[str, ...]:
+    if not isinstance(value, list) or not all(isinstance(i, str) for i in value):
+        raise ValueError(f"{what} must be a list of names")
+    return tuple(value)
+
+
+def _relays(config: Dict[str, Any]) -> Dict[str, int]:
+    relays = config.get("relays", DEFAULT_CONFIG["relays"])
+    if (
+        not isinstance(relays, dict)
+        or not relays
+        or not all(isinstance(pin, int) for pin in relays.values())
+    ):
+        raise ValueError("relays must map relay names to GPIO pins")
+    if len(set(relays.values())) != len(relays):
+        raise ValueError("relays must use different GPIO pins")
+    return relays
+
+
+def _device(name: str, device: Any, relay_numbers: Dict[str, int]) -> DeviceConfig:
+    if not isinstance(device, dict):
+        raise ValueError(f"device {name} must be an object")
+    unknown = set(device) - {
+        "relays",
+        "soundbar",
+        "command",
+        "volume",
+        "cups",
+        "idle_off",
+    }
+    if unknown:
+        raise ValueError(f"device {name}: unknown settings {sorted(unknown)}")
+
+    relays = _names(device.get("relays", []), f"device {name} relays")
+    for relay in relays:
+        if relay not in relay_numbers:
+            raise ValueError(f"device {name}: unknown relay {relay}")
+
+    soundbar = None
+    if "soundbar" in device:
+        soundbar = _names(device["soundbar"], f"device {name} soundbar")
+        for command in soundbar:
+            if command not in SOUNDBAR_COMMANDS:
+                raise ValueError(f"device {name}: unknown soundbar command {command}")
+
+    command = device.get("command", name)
+    if not isinstance(command, str) or not command:
+        raise ValueError(f"device {name}: command must be a name")
+
+    volume = device.get("volume")
+    if volume is not None and (
+        soundbar is None or not isinstance(volume, int) or not 0 <= volume <= 100
+    ):
+        raise ValueError(f"device {name}: volume must be 0-100 on a soundbar device")
+
+    cups = device.get("cups")
+    if cups is not None and (
+        not isinstance(cups, str) or not cups.startswith(("ipp://", "http://"))
+    ):
+        raise ValueError(f"device {name}: cups must be an ipp:// printer URI")
+    idle_off = device.get("idle_off")
+    if idle_off is not None and (
+        cups is None or not isinstance(idle_off, (int, float)) or idle_off <= 0
+    ):
+        raise ValueError(f"device {name}: idle_off must be seconds on a cups device")
+    return DeviceConfig(
+        tuple(relay_numbers[r] for r in relays),
+        soundbar,
+        command,
+        volume,
+        cups,
+        idle_off,
+    )
+
+
+def _scenes(scenes: Any, commands: Set[str]) -> Dict[str, Tuple[str, ...]]:
+    if not isinstance(scenes, dict):
+        raise ValueError("scenes must be an object")
+    result = {}
+    for name, steps in scenes.items():
+        steps = _names(steps, f"scene {name}")
+        if name in commands:
+            raise ValueError(f"scene {name} has the name of a command")
+        for step in steps:
+            if step not in commands or step in ARG_COMMANDS:
+                raise ValueError(f"scene {name}: unknown command {step}")
+        result[name] = steps
+    return result
+
+
+def _keymap(keymap: Any, commands: Set[str]) -> Dict[str, str]:
+    if not isinstance(keymap, dict) or not all(
+        isinstance(key, str) and isinstance(cmd, str) for key, cmd in keymap.items()
+    ):
+        raise ValueError("keymap must map key codes to command names")
+    for key, command in keymap.items():
+        if command not in commands:
+            raise ValueError(f"unknown command for {key}: {command}")
+    return dict(keymap)
+
+
+def _path(config: Dict[str, Any], name: str) -> Optional[str]:
+    path = config.get(name)
+    if path is not None and (not isinstance(path, str) or not path):
+        raise ValueError(f"{name} must be a device path")
+    return path
+
+
+def parse_config(config: Any, source: str = "config") -> Config:
+    """Validate and compile configuration.
+    Raises ValueError prefixed with source on the first problem found
+    """
+    try:
+        if not isinstance(config, dict):
+            raise ValueError("config must be an object")
+        relays = _relays(config)
+        relay_numbers = {name: number for number, name in enumerate(relays, 1)}
+
+        devices = config.get("devices", DEFAULT_CONFIG["devices"])
+        if not isinstance(devices, dict):
+            raise ValueError("devices must be an object")
+        compiled = Config(
+            tuple(relays.values()),
+            {
+                name: _device(name, device, relay_numbers)
+                for name, device in devices.items()
+            },
+            {},
+            {},
+            _path(config, "serial_port"),
+            _path(config, "keypad"),
+        )
+
+        commands = set(BUILTIN_COMMANDS)
+        device_commands = compiled.device_commands()
+        if len(device_commands) < 2 * len(compiled.devices) or commands.intersection(
+            device_commands
+        ):
+            raise ValueError("device commands must have different names")
+        commands.update(device_commands)
+
+        compiled.scenes.update(_scenes(config.get("scenes", {}), commands))
+        commands.update(compiled.scenes)
+        compiled.keymap.update(_keymap(config.get("keymap", DEFAULT_KEYMAP), commands))
+    except ValueError as ex:
+        raise ValueError(f"{source}: {ex}") from ex
+    return compiled
+
+
+def scoped(room: str, name: str) -> str:
+    """Command, subsystem or label name within a room, as is for the only room"""
+    return f"{room}/{name}" if room else name
+
+
+def _check_shared(rooms: Dict[str, Config]):
+    for what, values in (
+        ("GPIO pins", [pin for room in rooms.values() for pin in room.pins]),
+        ("serial ports", [room.serial_port or "" for room in rooms.values()]),
+        ("keypads", [room.keypad or "" for room in rooms.values()]),
+    ):
+        if len(set(values)) != len(values):
+            raise ValueError(f"rooms must use different {what}")
+
+
+def parse_rooms(config: Any, source: str = "config") -> Dict[str, Config]:
+    """Validate and compile configuration of every room,
+    a configuration without "rooms" is one room named ""
+    """
+    if not isinstance(config, dict) or "rooms" not in config:
+        return {"": parse_config(config, source)}
+    rooms = config["rooms"]
+    if not isinstance(rooms, dict) or not rooms:
+        raise ValueError(f"{source}: rooms must be an object")
+    compiled = {}
+    for name, room in rooms.items():
+        if not name or "/" in name:
+            raise ValueError(f"{source}: bad room name {name!r}")
+        compiled[name] = parse_config(room, f"{source}: room {name}")
+    try:
+        _check_shared(compiled)
+    except ValueError as ex:
+        raise ValueError(f"{source}: {ex}") from ex
+    return compiled
+
+
+def load_rooms(path: Optional[str]) -> Dict[str, Config]:
+    """Read and compile the config file, the default room if no file"""
+    if not path:
+        return {"": parse_config(DEFAULT_CONFIG, "default config")}
+    return parse_rooms(read_config(path), path)
+
+
+def load_config(path: Optional[str], room: Optional[str] = None) -> Config:
+    """Read and compile the config file, default configuration if no file.
+    room: room to return, the first one by default
+    """
+    rooms = load_rooms(path)
+    if room is None:
+        return next(iter(rooms.values()))
+    if room not in rooms:
+        raise ValueError(f"{path}: no room {room}")
+    return rooms[room]
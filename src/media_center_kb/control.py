@@ -1,30 +1,96 @@
 """
 Control action for each key
+
+Devices are async: soundbar waits do not block the event loop and independent
+devices run concurrently. Their sync on()/off()/volume and the sync commands
+from commands_map() are adapters that run the coroutines through the runner.
 """
 
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
-from enum import Enum
+import asyncio
+import inspect
+import logging
 import time
-from typing import Callable, Dict, Iterable, Optional, Union, no_type_check
-
-from ysp4000.ysp import Ysp4000
-from media_center_kb.relays import RelayModuleIf, RelayIf
-
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from media_center_kb.config import Config, DeviceConfig, load_config
+from media_center_kb.events import CommandExecuted, EventBus, KeyPressed, StateChanged
+from media_center_kb.fade import VOLUME_STEP, VolumeFader
+from media_center_kb.relays import RelayLease, RelayModuleIf, RelayIf
+from media_center_kb.shell import POWEROFF, RestrictedShell
+
+if TYPE_CHECKING:
+    # only used for annotations, the serial stack is imported by main when needed
+    from ysp4000.ysp import Ysp4000
+
+logger = logging.getLogger("ctl")
+
+AsyncCommand = Callable[..., Awaitable[Any]]
+
+
+class DeviceRunner:
+    """Runs device coroutines for sync callers"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def bind(self, loop: Optional[asyncio.AbstractEventLoop]):
+        """Event loop the devices run on, used by calls from other threads"""
+        self._loop = loop
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and (ex := task.exception()) is not None:
+            logger.error("device command failed: %r", ex)
+
+    def __call__(self, coro: Coroutine) -> Any:
+        """On the event loop thread the coroutine runs in a background task
+        which is returned, other threads wait for the result on the bound loop,
+        without a loop the coroutine runs in a new one"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            task = loop.create_task(coro)
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+            return task
+        if self._loop is not None and self._loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        return asyncio.run(coro)
 
-class RelayMap(Enum):
-    """Maps symbol names to relay numbers"""
 
-    YSP = 1
-    _TDB = 2
-    TURNTABLE = 3
-    PRINTER = 4
+# define here so can be redefined in tests
+runner = DeviceRunner()
 
 
 class YspVolumeTracker:
     """YSP4000 volume pct (numeric value) tracker"""
 
-    def __init__(self, ysp: Ysp4000):
+    def __init__(self, ysp: Ysp4000, bus: Optional[EventBus] = None):
+        """bus: StateChanged("volume") is published when the reported volume changes"""
         self._ysp = ysp
+        self._bus = bus
 
         self._ysp.register_state_update_cb(self._ysp_state_update_cb)
         self._ysp_volume = 0
@@ -32,7 +98,11 @@ class YspVolumeTracker:
     def _ysp_state_update_cb(self, **kwargs):
         if (vol := kwargs.get("volume")) is not None:
             # volume returned as a string '0' - '100'
-            self._ysp_volume = int(vol)
+            volume = int(vol)
+            if volume != self._ysp_volume:
+                self._ysp_volume = volume
+                if self._bus is not None:
+                    self._bus.publish(StateChanged("volume", volume))
 
     @property
     def volume(self) -> int:
@@ -48,22 +118,96 @@ class YspVolumeTracker:
 
 
 class PoweredDevice(ABC):
-    """Device that can be powered on and off"""
+    """Device that can be powered on and off.
+
+    Only the latest requested state matters: a request for the opposite state
+    cancels the change in flight, a request for the same state joins it.
+    """
+
+    # power change in flight and its target, set on first use
+    _switching: Optional[asyncio.Task] = None
+    _switching_to: Optional[bool] = None
+    # changes cancelled by an opposite request
+    cancelled = 0
+    # requests joined to the change in flight for the same state
+    superseded = 0
+    # called after every completed change, set by the owner
+    on_change: Optional[Callable[[], None]] = None
 
     @abstractmethod
-    def on(self):  # pylint: disable=invalid-name
-        """Switch ON"""
+    async def switch_on(self):
+        """Switch ON sequence"""
 
     @abstractmethod
-    def off(self):
-        """Switch OFF"""
+    async def switch_off(self):
+        """Switch OFF sequence"""
 
     @abstractmethod
     def state(self) -> bool:
         """Get power state"""
 
+    @abstractmethod
+    def _powered_off(self):
+        """Forget the power state, the hardware was switched off"""
+
+    def reset(self):
+        """Switched off behind the device's back (board reset):
+        cancel the change in flight and report the device off"""
+        current = self._switching
+        if current is not None and not current.done():
+            current.cancel()
+            self.cancelled += 1
+        self._powered_off()
+        if self.on_change is not None:
+            self.on_change()
+
+    async def _switch_after(self, previous: Optional[asyncio.Task], on: bool):
+        if previous is not None:
+            # let the cancelled sequence unwind before the new one starts
+            await asyncio.wait({previous})
+        await (self.switch_on() if on else self.switch_off())
+
+    async def _request(self, on: bool) -> bool:
+        current = self._switching
+        if current is not None and not current.done():
+            if self._switching_to == on:
+                self.superseded += 1
+                task = current
+            else:
+                current.cancel()
+                self.cancelled += 1
+                task = asyncio.ensure_future(self._switch_after(current, on))
+        else:
+            task = asyncio.ensure_future(self._switch_after(None, on))
+        self._switching, self._switching_to = task, on
+
+        # the request is not cancelled with the task, only by its own caller
+        await asyncio.wait({task})
+        if task.cancelled():
+            return False
+        task.result()
+        if self.on_change is not None:
+            self.on_change()
+        return True
+
+    async def turn_on(self) -> bool:
+        """Switch ON, False if an OFF request came before it was done"""
+        return await self._request(True)
+
+    async def turn_off(self) -> bool:
+        """Switch OFF, False if an ON request came before it was done"""
+        return await self._request(False)
+
+    def on(self):  # pylint: disable=invalid-name
+        """Switch ON from sync code"""
+        return runner(self.turn_on())
+
+    def off(self):
+        """Switch OFF from sync code"""
+        return runner(self.turn_off())
+
 
-class SoundDevice(ABC):  # pylint: disable=too-few-public-methods
+class SoundDevice(ABC):
     """Device that have adjustable volume"""
 
     @property
@@ -72,17 +216,30 @@ class SoundDevice(ABC):  # pylint: disable=too-few-public-methods
         """Get volume level"""
 
     @volume.setter
-    @abstractmethod
     def volume(self, value: int):
+        """Set volume level from sync code"""
+        runner(self.set_volume(value))
+
+    @abstractmethod
+    async def set_volume(self, value: int):
         """Set volume level"""
 
 
 class YspSoundDevice(SoundDevice):
     """YSP4000 device with volume control"""
 
-    def __init__(self, ysp: Ysp4000):
+    def __init__(
+        self,
+        ysp: Ysp4000,
+        tracker: Optional[YspVolumeTracker] = None,
+        fader: Optional[VolumeFader] = None,
+    ):
+        """tracker: shared soundbar volume, a private one is created if not given
+        fader: volume is set through it so it does not lose track during a ramp"""
         self._ysp = ysp
-        self._volume_tracker = YspVolumeTracker(ysp)
+        self._fader = fader
+        self._owns_tracker = tracker is None
+        self._volume_tracker = tracker if tracker is not None else YspVolumeTracker(ysp)
 
     @property
     def volume(self) -> int:
@@ -90,210 +247,244 @@ class YspSoundDevice(SoundDevice):
 
     @volume.setter
     def volume(self, value: int):
-        self._ysp.set_volume_pct(value)
+        runner(self.set_volume(value))
+
+    async def set_volume(self, value: int):
+        if self._fader is not None:
+            await self._fader.ramp(value, 0)
+        else:
+            self._ysp.set_volume_pct(value)
 
     def __del__(self):
-        self._volume_tracker.close()
+        if self._owns_tracker:
+            self._volume_tracker.close()
 
 
 # define here so can be redefined in tests
-sleeper = time.sleep
+sleeper = asyncio.sleep
 
 
 class YspPoweredDevice(PoweredDevice):
     """Ysp4000 device with power on/off capability"""
 
-    def __init__(self, ysp: Ysp4000):
+    def __init__(self, ysp: Ysp4000, fader: Optional[VolumeFader] = None):
+        """fader: fade volume out before power off"""
         self._ysp = ysp
+        self._fader = fader
         self._state = False
 
-    def on(self):
+    async def switch_on(self):
         self._ysp.power_on()
         self._state = True
 
-    def off(self):
+    async def switch_off(self):
+        # No need to wait if the soundbar does not respond (scheduler circuit breaker is open)
+        online = getattr(self._ysp, "online", True)
+        if self._fader is not None and online:
+            await self._fader.fade_out()
+            # power off drops queued commands, the volume sent back has to go out first
+            drain = getattr(self._ysp, "drain", None)
+            if inspect.iscoroutinefunction(drain):
+                await drain()
         self._ysp.power_off()
         self._state = False
-        # give YSP change to power off. 1s looks a lot but who cares, it is being switched off
-        sleeper(1)
+        # give YSP change to power off. 1s looks a lot but who cares, it is being switched off.
+        if online:
+            await sleeper(1)
 
     def state(self) -> bool:
         return self._state
 
+    def _powered_off(self):
+        self._state = False
 
-class TV(YspPoweredDevice, YspSoundDevice):
-    """TV Device"""
-
-    def __init__(self, relay: RelayIf, ysp: Ysp4000):
-        YspPoweredDevice.__init__(self, ysp)
-        YspSoundDevice.__init__(self, ysp)
-
-        self._relay = relay
-        self._ysp = ysp
-        self._powered = False
-
-    def on(self):
-        """
-        power on soundbar
-        turn on soundbar
-        select TV/STB channel
-        select 5 beam
-        select cinema mode
-        IR/radio to switch on projector?
-        """
-        self._relay.on()
-        YspPoweredDevice.on(self)
 
-        self._ysp.set_input_tv()
-        self._ysp.set_5beam()
-        self._ysp.set_dsp_cinema()
-        self._powered = True
+class SoundbarSource(YspPoweredDevice, YspSoundDevice):
+    """Device played through the soundbar"""
 
-    def off(self):
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        relays: Sequence[RelayIf],
+        ysp: Ysp4000,
+        commands: Sequence[str],
+        fader: Optional[VolumeFader] = None,
+        volume: Optional[int] = None,
+        tracker: Optional[YspVolumeTracker] = None,
+    ):
         """
-        turn off soundbar
-        power off soundbar
+        relays: switched on in order before the soundbar is powered on, off in reverse
+        commands: soundbar commands selecting input and sound mode after power on
+        fader: fade in after power on to volume, or the volume before the last fade out
+        tracker: soundbar volume shared by the devices
         """
-        YspPoweredDevice.off(self)
-        self._relay.off()
-        self._powered = False
-
-    def state(self):
-        return self._powered
-
-
-class BluetoothStreamer(YspPoweredDevice, YspSoundDevice):
-    """Bluetooth Streaming Device"""
-
-    def __init__(self, relay: RelayIf, ysp: Ysp4000):
-        YspPoweredDevice.__init__(self, ysp)
-        YspSoundDevice.__init__(self, ysp)
+        YspPoweredDevice.__init__(self, ysp, fader)
+        YspSoundDevice.__init__(self, ysp, tracker, fader)
 
-        self._relay = relay
-        self._ysp = ysp
+        self._relays = tuple(relays)
+        # resolved once, not on every key press
+        self._commands = tuple(getattr(ysp, name) for name in commands)
+        self._volume = volume
         self._powered = False
 
-    def on(self):
+    async def switch_on(self):
         """
-        power on soundbar
+        power on relays
         turn on soundbar
-        select TV/STB channel
-        select stereo mode
+        select input and sound mode
         """
-        self._relay.on()
-        YspPoweredDevice.on(self)
-
-        self._ysp.set_input_tv()
-        self._ysp.set_dsp_off()
-        self._ysp.set_stereo()
+        for relay in self._relays:
+            relay.on()
+        await YspPoweredDevice.switch_on(self)
+        for command in self._commands:
+            command()
+        if self._fader is not None:
+            self._fader.fade_in(self._volume)
         self._powered = True
 
-    def off(self):
+    async def switch_off(self):
         """
-        turn off soundbar
-        power off soundbar
+        turn off soundbar unless another device still holds one of the relays
+        power off relays
         """
-        YspPoweredDevice.off(self)
-        self._relay.off()
+        if not any(
+            isinstance(relay, RelayLease) and relay.shared() for relay in self._relays
+        ):
+            await YspPoweredDevice.switch_off(self)
+        for relay in reversed(self._relays):
+            relay.off()
         self._powered = False
 
     def state(self):
         return self._powered
 
+    def _powered_off(self):
+        YspPoweredDevice._powered_off(self)
+        self._powered = False
 
-class Turntable(YspPoweredDevice, YspSoundDevice):
-    """Turntable Device"""
 
-    def __init__(self, relay1: RelayIf, relay2: RelayIf, ysp: Ysp4000):
-        YspPoweredDevice.__init__(self, ysp)
-        YspSoundDevice.__init__(self, ysp)
+class Outlet(PoweredDevice):
+    """Device powered by relays only, like the printer"""
 
-        self._relay1 = relay1
-        self._relay2 = relay2
-        self._ysp = ysp
+    def __init__(self, relays: Sequence[RelayIf]):
+        self._relays = tuple(relays)
         self._powered = False
 
-    def on(self):
-        """
-        power on soundbar (relay 1)
-        turn on soundbar
-        select AUX1 channel
-        select stereo mode
-        power on turntable (relay 2)
-        """
-        self._relay1.on()
-        self._relay2.on()
-        YspPoweredDevice.on(self)
-        self._ysp.set_input_aux1()
-        self._ysp.set_dsp_off()
-        self._ysp.set_stereo()
+    async def switch_on(self):
+        for relay in self._relays:
+            relay.on()
         self._powered = True
 
-    def off(self):
-        """
-        turn off soundbar
-        power off soundbar
-        """
-        YspPoweredDevice.off(self)
-        self._relay2.off()
-        self._relay1.off()
+    async def switch_off(self):
+        for relay in reversed(self._relays):
+            relay.off()
         self._powered = False
 
     def state(self):
         return self._powered
 
-
-class Printer(PoweredDevice):
-    """Printer Device"""
-
-    def __init__(self, relay: RelayIf):
-        self._relay = relay
+    def _powered_off(self):
         self._powered = False
 
-    def on(self):
-        self._relay.on()
-        self._powered = True
-
-    def off(self):
-        self._relay.off()
-        self._powered = False
-
-    def state(self):
-        return self._powered
-
 
 class VolumeControl(YspSoundDevice):
     """Volume control"""
 
-    def __init__(self, ysp: Ysp4000):
-        YspSoundDevice.__init__(self, ysp)
+    def __init__(
+        self,
+        ysp: Ysp4000,
+        fader: Optional[VolumeFader] = None,
+        tracker: Optional[YspVolumeTracker] = None,
+    ):
+        """fader: volume keys move the fader target instead of sending a command each"""
+        YspSoundDevice.__init__(self, ysp, tracker, fader)
 
-    def inc(self):
+    async def inc(self):
         """Increase volume"""
-        self._ysp.volume_up()
+        if self._fader is not None:
+            self._fader.nudge(VOLUME_STEP)
+        else:
+            self._ysp.volume_up()
 
-    def dec(self):
+    async def dec(self):
         """Decrease volume"""
-        self._ysp.volume_down()
+        if self._fader is not None:
+            self._fader.nudge(-VOLUME_STEP)
+        else:
+            self._ysp.volume_down()
+
+    async def set(self, value: int):
+        """Set volume level"""
+        await self.set_volume(value)
 
 
 class BoardControl:
     """Board control"""
 
-    def __init__(self, relays: RelayModuleIf, ysp: Ysp4000, shell: Callable):
+    def __init__(
+        self,
+        relays: RelayModuleIf,
+        ysp: Ysp4000,
+        shell: RestrictedShell,
+        fader: Optional[VolumeFader] = None,
+        devices: Sequence[PoweredDevice] = (),
+    ):
+        """devices: outlets are switched off while the soundbar powers off,
+        soundbar sources go off with the soundbar and their relays"""
         self._relays = relays
-        self._ypd = YspPoweredDevice(ysp)
+        self._ypd = YspPoweredDevice(ysp, fader)
         self._shell = shell
-
-    def reset(self):
+        self._outlets = tuple(
+            device for device in devices if isinstance(device, Outlet)
+        )
+        self._sources = tuple(
+            device for device in devices if not isinstance(device, Outlet)
+        )
+
+    async def reset(self):
         """Reset all relays"""
-        self._ypd.off()
+        # a source being switched on would switch its relays back on after the reset
+        for source in self._sources:
+            source.reset()
+        # outlets do not wait for the soundbar, the rest of relays is switched off after it
+        await asyncio.gather(
+            self._ypd.turn_off(), *(outlet.turn_off() for outlet in self._outlets)
+        )
         self._relays.reset()
 
-    def shutdown(self):
+    async def shutdown(self):
         """Shutdown the board"""
-        self.reset()
-        self._shell("sudo poweroff")
+        await self.reset()
+        if not self._shell.allowed(POWEROFF):
+            logger.warning("system: %s is not allowed", POWEROFF)
+            return
+        await self._shell.run(POWEROFF)
+
+
+def _scene(steps: Sequence[Tuple[AsyncCommand, FrozenSet[str]]]) -> AsyncCommand:
+    """Scene command running steps concurrently,
+    a step waits for the earlier steps sharing hardware with it"""
+    after = tuple(
+        tuple(j for j in range(i) if steps[j][1] & resources)
+        for i, (_, resources) in enumerate(steps)
+    )
+
+    async def scene():
+        tasks: List[asyncio.Future] = []
+
+        async def step(i: int):
+            if after[i]:
+                await asyncio.gather(*(tasks[j] for j in after[i]))
+            await steps[i][0]()
+
+        for i in range(len(steps)):
+            tasks.append(asyncio.ensure_future(step(i)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return scene
 
 
 class Controller:  # pylint: disable=too-many-instance-attributes
@@ -303,28 +494,122 @@ class Controller:  # pylint: disable=too-many-instance-attributes
         self,
         relays: RelayModuleIf,
         ysp: Ysp4000,
-        shell: Optional[Callable[[str], None]] = None,
+        shell: Optional[RestrictedShell] = None,
+        config: Optional[Config] = None,
+        bus: Optional[EventBus] = None,
     ):
-        def noop(_):
-            pass
-
+        """
+        shell: runs the power off command, nothing is allowed if not given
+        config: devices, scenes and keymap, the built-in ones if not given
+        bus: key, command and state events are published to, a new one if not given
+        """
         self._relays = relays
         self._ysp = ysp
-        self._shell: Callable = noop if not shell else shell
-
-        self._named_devices: Dict[str, Union[PoweredDevice, SoundDevice]] = {
-            "tv": TV(self._relays.relay(RelayMap.YSP.value), self._ysp),
-            "bt": BluetoothStreamer(self._relays.relay(RelayMap.YSP.value), self._ysp),
-            "turntable": Turntable(
-                self._relays.relay(RelayMap.YSP.value),
-                self._relays.relay(RelayMap.TURNTABLE.value),
-                self._ysp,
-            ),
-            "printer": Printer(self._relays.relay(RelayMap.PRINTER.value)),
+        self._shell = shell if shell is not None else RestrictedShell(allowed_cmds=[])
+        self._config = config if config is not None else load_config(None)
+        self.bus = bus if bus is not None else EventBus()
+        # the only soundbar state callback, devices and the fader read the volume from it
+        self._volume_tracker = YspVolumeTracker(self._ysp, self.bus)
+        # volume ramps, run() is started by the daemon
+        self.fader = VolumeFader(
+            self._ysp, bus=self.bus, reported=lambda: self._volume_tracker.volume
+        )
+
+        devices = {
+            name: self._make_device(name, device)
+            for name, device in self._config.devices.items()
+        }
+        self._named_devices: Dict[str, Union[PoweredDevice, SoundDevice]] = dict(
+            devices
+        )
+
+        self._volume_control = VolumeControl(
+            self._ysp, self.fader, self._volume_tracker
+        )
+        self._board_control = BoardControl(
+            self._relays,
+            self._ysp,
+            self._shell,
+            self.fader,
+            list(devices.values()),
+        )
+        # last published power states
+        self._states = {
+            name: device.state() for name, device in self.powered_devices().items()
+        }
+        for device in devices.values():
+            device.on_change = self._publish_states
+        # flat command tables, compiled once
+        self._async_commands = self._compile_commands(devices)
+        self._commands = {
+            name: self._sync(cmd) for name, cmd in self._async_commands.items()
         }
 
-        self._volume_control = VolumeControl(self._ysp)
-        self._board_control = BoardControl(self._relays, self._ysp, self._shell)
+    def _make_device(self, name: str, device: DeviceConfig) -> PoweredDevice:
+        # shared relays are leased, devices do not switch each other off
+        device_relays = [self._relays.lease(relay, name) for relay in device.relays]
+        if device.soundbar is None:
+            return Outlet(device_relays)
+        return SoundbarSource(
+            device_relays,
+            self._ysp,
+            device.soundbar,
+            self.fader,
+            device.volume,
+            self._volume_tracker,
+        )
+
+    def _compile_commands(
+        self, devices: Mapping[str, PoweredDevice]
+    ) -> Dict[str, AsyncCommand]:
+        commands: Dict[str, AsyncCommand] = {
+            # board control functions
+            "off": self._board_control.reset,
+            "shutdown": self._board_control.shutdown,
+            # YSP volume
+            "volume_down": self._volume_control.dec,
+            "volume_up": self._volume_control.inc,
+            "volume_set": self._volume_control.set,
+        }
+        for command, (name, on) in self._config.device_commands().items():
+            commands[command] = devices[name].turn_on if on else devices[name].turn_off
+        for name, steps in self._config.scenes.items():
+            commands[name] = _scene(
+                tuple((commands[step], self._config.resources(step)) for step in steps)
+            )
+        return {name: self._observed(name, cmd) for name, cmd in commands.items()}
+
+    def add_observer(self, observer: Callable[[str, float], None]):
+        """Call observer(command name, duration) after every command"""
+        self.bus.subscribe(
+            CommandExecuted, lambda event: observer(event.command, event.duration)
+        )
+
+    def _observed(self, name: str, command: AsyncCommand) -> AsyncCommand:
+        async def inner(*args):
+            started = time.perf_counter()
+            try:
+                return await command(*args)
+            finally:
+                duration = time.perf_counter() - started
+                self.bus.publish(CommandExecuted(name, duration))
+
+        return inner
+
+    def _publish_states(self):
+        """Publish StateChanged for devices switched since the last call"""
+        for name, device in self.powered_devices().items():
+            state = device.state()
+            if self._states.get(name) != state:
+                self._states[name] = state
+                self.bus.publish(StateChanged(name, state))
+
+    @staticmethod
+    def _sync(command: AsyncCommand) -> Callable:
+        def inner(*args):
+            return runner(command(*args))
+
+        return inner
 
     def devices(
         self, wanted: Iterable[str]
@@ -340,46 +625,55 @@ class Controller:  # pylint: disable=too-many-instance-attributes
             result[name] = device
         return result
 
+    def powered_devices(self) -> Dict[str, PoweredDevice]:
+        """Devices that can be switched on and off by name"""
+        return {
+            name: device
+            for name, device in self._named_devices.items()
+            if isinstance(device, PoweredDevice)
+        }
+
     def shutdown(self):
         """Power off the controller"""
-        self._board_control.shutdown()
+        return runner(self._board_control.shutdown())
 
-    @no_type_check
-    def commands_map(self) -> Dict[str, Callable]:
-        """Returns dict of handlers by keycode"""
-        return {
-            "tv_on": self._named_devices["tv"].on,
-            "tv_off": self._named_devices["tv"].off,
-            "turntable_on": self._named_devices["turntable"].on,
-            "turntable_off": self._named_devices["turntable"].off,
-            "streaming_on": self._named_devices["bt"].on,
-            "streaming_off": self._named_devices["bt"].off,
-            "printer_on": self._named_devices["printer"].on,
-            "printer_off": self._named_devices["printer"].off,
-            # board control functions
-            "off": self._board_control.reset,
-            "shutdown": self._board_control.shutdown,
-            # YSP volume
-            "volume_down": self._volume_control.dec,
-            "volume_up": self._volume_control.inc,
-            "volume_set": self._volume_control.volume,
+    def state(self) -> Dict[str, Union[bool, int]]:
+        """Return power state of every device and the volume level"""
+        result: Dict[str, Union[bool, int]] = {
+            name: device.state() for name, device in self.powered_devices().items()
         }
+        result["volume"] = self._volume_control.volume
+        return result
 
-    def kb_handlers(self) -> Dict[str, Callable]:
-        """Return keys to commands mapping"""
-        cmds = self.commands_map()
+    def async_commands_map(self) -> Dict[str, AsyncCommand]:
+        """Returns dict of coroutine functions by command name"""
+        return dict(self._async_commands)
 
-        return {
-            "KEY_KP7": cmds["tv_on"],
-            "KEY_KP4": cmds["tv_off"],
-            "KEY_KP8": cmds["turntable_on"],
-            "KEY_KP5": cmds["turntable_off"],
-            "KEY_KP9": cmds["streaming_on"],
-            "KEY_KP6": cmds["streaming_off"],
-            "KEY_KPMINUS": cmds["printer_on"],
-            "KEY_KPPLUS": cmds["printer_off"],
-            "KEY_KPENTER": cmds["off"],
-            "KEY_KP1": cmds["volume_up"],
-            "KEY_KP0": cmds["volume_down"],
-            "KEY_ESC": cmds["shutdown"],
-        }
+    def commands_map(self) -> Dict[str, Callable]:
+        """Returns dict of handlers by command name, on the event loop they start
+        the command in a task and return it"""
+        return dict(self._commands)
+
+    def kb_handlers(
+        self, keymap: Optional[Mapping[str, str]] = None
+    ) -> Dict[str, Callable]:
+        """Return keys to commands mapping, the configured keymap by default.
+        Raises ValueError if keymap refers unknown command
+        """
+        if keymap is None:
+            keymap = self._config.keymap
+
+        result = {}
+        for key, name in keymap.items():
+            cmd = self._commands.get(name)
+            if cmd is None:
+                raise ValueError(f"unknown command for {key}: {name}")
+            result[key] = self._key_handler(key, name, cmd)
+        return result
+
+    def _key_handler(self, key: str, name: str, command: Callable) -> Callable:
+        def inner():
+            self.bus.publish(KeyPressed(key, name))
+            return command()
+
+        return inner
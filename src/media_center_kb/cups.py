@@ -0,0 +1,312 @@
+"""
+Printer power driven by the CUPS queue.
+
+The watcher polls the printer queue over IPP (Get-Printer-Attributes, queued-job-count)
+and switches the printer on as soon as a job is queued, so it warms up while the job
+is still being rendered. After idle_off seconds without jobs the printer is switched
+off again. A printer switched on by hand is left alone until it gets a job.
+
+Only the few IPP bits needed for that are implemented, over plain HTTP/1.0 so there is
+no chunked encoding to deal with. IppStandIn answers the same request with a settable
+job count, for tests and for trying the daemon without CUPS:
+
+    python -m media_center_kb.cups --port 8631 --jobs 1
+    # device config
+    "printer": {"relays": ["printer"], "cups": "ipp://localhost:8631/printers/test"}
+"""
+
+import argparse
+import asyncio
+import logging
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from media_center_kb.control import PoweredDevice
+
+logger = logging.getLogger("cup")
+
+IPP_PORT = 631
+IDLE_OFF = 600.0
+POLL_INTERVAL = 2.0
+TIMEOUT = 5.0
+
+GET_PRINTER_ATTRIBUTES = 0x000B
+STATUS_OK = 0x0000
+
+# delimiter tags
+OPERATION_ATTRIBUTES = 0x01
+PRINTER_ATTRIBUTES = 0x04
+END_OF_ATTRIBUTES = 0x03
+# value tags
+INTEGER = 0x21
+ENUM = 0x23
+KEYWORD = 0x44
+URI = 0x45
+CHARSET = 0x47
+NATURAL_LANGUAGE = 0x48
+
+# printer-state: idle, processing, stopped
+PRINTER_IDLE = 3
+PRINTER_PROCESSING = 4
+
+
+def _attribute(tag: int, name: str, value: bytes) -> bytes:
+    encoded = name.encode()
+    return (
+        struct.pack(">BH", tag, len(encoded))
+        + encoded
+        + struct.pack(">H", len(value))
+        + value
+    )
+
+
+def encode_message(
+    code: int, request_id: int, groups: List[Tuple[int, List[Tuple[int, str, bytes]]]]
+) -> bytes:
+    """IPP 1.1 message: operation or status code and attribute groups"""
+    body = [struct.pack(">BBHI", 1, 1, code, request_id)]
+    for delimiter, attributes in groups:
+        body.append(bytes([delimiter]))
+        body.extend(_attribute(tag, name, value) for tag, name, value in attributes)
+    body.append(bytes([END_OF_ATTRIBUTES]))
+    return b"".join(body)
+
+
+def decode_message(data: bytes) -> Tuple[int, int, Dict[str, Tuple[int, bytes]]]:
+    """Operation or status code, request id and attributes by name (first value).
+    Raises ValueError on malformed messages
+    """
+    try:
+        _, _, code, request_id = struct.unpack_from(">BBHI", data)
+        attributes: Dict[str, Tuple[int, bytes]] = {}
+        pos = 8
+        while True:
+            tag = data[pos]
+            pos += 1
+            if tag == END_OF_ATTRIBUTES:
+                return code, request_id, attributes
+            if tag < 0x10:
+                continue
+            (name_length,) = struct.unpack_from(">H", data, pos)
+            name = data[pos + 2 : pos + 2 + name_length].decode()
+            pos += 2 + name_length
+            (value_length,) = struct.unpack_from(">H", data, pos)
+            value = data[pos + 2 : pos + 2 + value_length]
+            pos += 2 + value_length
+            # an empty name is another value of the previous attribute
+            if name:
+                attributes.setdefault(name, (tag, value))
+    except (IndexError, struct.error, UnicodeDecodeError) as ex:
+        raise ValueError(f"bad IPP message: {ex}") from ex
+
+
+def _integer(attributes: Dict[str, Tuple[int, bytes]], name: str) -> int:
+    tag, value = attributes.get(name, (0, b""))
+    if tag not in (INTEGER, ENUM) or len(value) != 4:
+        raise ValueError(f"no {name} in IPP response")
+    return struct.unpack(">i", value)[0]
+
+
+class IppClient:  # pylint: disable=too-few-public-methods
+    """Printer queue state over IPP"""
+
+    def __init__(self, uri: str, timeout: float = TIMEOUT):
+        """uri: ipp://host[:port]/printers/<name>"""
+        parts = urlsplit(uri)
+        if parts.scheme not in ("ipp", "http") or not parts.hostname:
+            raise ValueError(f"printer URI must be ipp://host/printers/name: {uri}")
+        self._uri = uri
+        self._host = parts.hostname
+        self._port = parts.port or IPP_PORT
+        self._path = parts.path or "/"
+        self._timeout = timeout
+        self._request_id = 0
+
+    def _request(self) -> bytes:
+        self._request_id += 1
+        return encode_message(
+            GET_PRINTER_ATTRIBUTES,
+            self._request_id,
+            [
+                (
+                    OPERATION_ATTRIBUTES,
+                    [
+                        (CHARSET, "attributes-charset", b"utf-8"),
+                        (NATURAL_LANGUAGE, "attributes-natural-language", b"en"),
+                        (URI, "printer-uri", self._uri.encode()),
+                        (KEYWORD, "requested-attributes", b"queued-job-count"),
+                    ],
+                )
+            ],
+        )
+
+    async def _post(self, body: bytes) -> bytes:
+        reader, writer = await asyncio.open_connection(self._host, self._port)
+        try:
+            writer.write(
+                (
+                    f"POST {self._path} HTTP/1.0\r\n"
+                    f"Host: {self._host}:{self._port}\r\n"
+                    "Content-Type: application/ipp\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, content = response.partition(b"\r\n\r\n")
+        status = head.split(b"\r\n", 1)[0].split()
+        if len(status) < 2 or status[1] != b"200":
+            raise ValueError(f"IPP HTTP error: {head[:80]!r}")
+        return content
+
+    async def queued_jobs(self) -> int:
+        """Jobs pending or printing.
+        Raises OSError if CUPS is not reachable, ValueError on bad responses
+        """
+        content = await asyncio.wait_for(self._post(self._request()), self._timeout)
+        status, _, attributes = decode_message(content)
+        if status != STATUS_OK:
+            raise ValueError(f"IPP status 0x{status:04x}")
+        return _integer(attributes, "queued-job-count")
+
+
+class PrinterWatcher:  # pylint: disable=too-many-instance-attributes
+    """Switches the printer on while CUPS has jobs for it, off after idle_off"""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        device: PoweredDevice,
+        client: IppClient,
+        idle_off: float = IDLE_OFF,
+        interval: float = POLL_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._device = device
+        self._client = client
+        self._idle_off = idle_off
+        self._interval = interval
+        self._clock = clock
+        self._last_job = 0.0
+        # the printer had jobs since it was switched on, it is switched off when idle
+        self._armed = False
+        self._reachable = True
+        self.powered_on = 0
+        self.powered_off = 0
+
+    async def check(self):
+        """Poll the queue once and switch the printer"""
+        jobs = await self._client.queued_jobs()
+        now = self._clock()
+        if jobs:
+            self._last_job = now
+            self._armed = True
+            if not self._device.state():
+                logger.info("%d print jobs queued, printer on", jobs)
+                self.powered_on += 1
+                await self._device.turn_on()
+        elif not self._device.state():
+            # switched off by hand
+            self._armed = False
+        elif self._armed and now - self._last_job >= self._idle_off:
+            logger.info("no print jobs for %.0fs, printer off", now - self._last_job)
+            self._armed = False
+            self.powered_off += 1
+            await self._device.turn_off()
+
+    async def run(self):
+        """Poll until cancelled, CUPS being down is not an error"""
+        while True:
+            try:
+                await self.check()
+                self._reachable = True
+            except (OSError, ValueError, asyncio.TimeoutError) as ex:
+                if self._reachable:
+                    logger.warning("CUPS queue not available: %s", ex)
+                self._reachable = False
+            await asyncio.sleep(self._interval)
+
+
+class IppStandIn:
+    """Minimal IPP printer answering Get-Printer-Attributes with a settable job count"""
+
+    def __init__(self, jobs: int = 0):
+        self.jobs = jobs
+        self.requests = 0
+        self.port: Optional[int] = None
+
+    def response(self, request: bytes) -> bytes:
+        """IPP response to a request"""
+        code, request_id, _ = decode_message(request)
+        self.requests += 1
+        operation = [
+            (CHARSET, "attributes-charset", b"utf-8"),
+            (NATURAL_LANGUAGE, "attributes-natural-language", b"en"),
+        ]
+        if code != GET_PRINTER_ATTRIBUTES:
+            # server-error-operation-not-supported
+            return encode_message(
+                0x0501, request_id, [(OPERATION_ATTRIBUTES, operation)]
+            )
+        state = PRINTER_PROCESSING if self.jobs else PRINTER_IDLE
+        printer = [
+            (INTEGER, "queued-job-count", struct.pack(">i", self.jobs)),
+            (ENUM, "printer-state", struct.pack(">i", state)),
+        ]
+        return encode_message(
+            STATUS_OK,
+            request_id,
+            [(OPERATION_ATTRIBUTES, operation), (PRINTER_ATTRIBUTES, printer)],
+        )
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            try:
+                body = self.response(await reader.readexactly(length))
+                head = b"HTTP/1.0 200 OK\r\nContent-Type: application/ipp\r\n"
+            except ValueError:
+                body = b""
+                head = b"HTTP/1.0 400 Bad Request\r\n"
+            writer.write(head + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as ex:
+            logger.debug("IPP client error: %s", ex)
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 0):
+        """Serve until cancelled, the bound port is in self.port"""
+        server = await asyncio.start_server(self._handle_client, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info("IPP stand-in on %s:%d, %d jobs", host, self.port, self.jobs)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    """Run the IPP stand-in"""
+    parser = argparse.ArgumentParser(description="IPP printer stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8631)
+    parser.add_argument("--jobs", type=int, default=0, help="Queued job count")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(IppStandIn(args.jobs).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
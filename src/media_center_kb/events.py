@@ -0,0 +1,85 @@
+"""
+In-process event bus.
+
+Keyboard, devices, relays and the soundbar publish typed events, integrations
+(metrics, MQTT, ...) subscribe to the event types they need instead of polling
+the controller or registering their own soundbar callbacks.
+
+Subscribers are kept per event type in tuples replaced on (un)subscribe, so
+publishing is one dict lookup and a loop without locking or copying.
+Subscribers are called synchronously by the publisher and must not block,
+a failing subscriber is logged and does not affect the others.
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Tuple, Type, TypeVar, Union
+
+logger = logging.getLogger("evt")
+
+
+class KeyPressed(NamedTuple):
+    """Key mapped to a command pressed"""
+
+    key: str
+    command: str
+
+
+class CommandExecuted(NamedTuple):
+    """Command finished (or failed) after duration seconds"""
+
+    command: str
+    duration: float
+
+
+class StateChanged(NamedTuple):
+    """Device power state or volume changed, names are the Controller.state() keys"""
+
+    name: str
+    value: Union[bool, int]
+
+
+class RelayToggled(NamedTuple):
+    """Relay GPIO switched"""
+
+    relay: int
+    on: bool  # pylint: disable=invalid-name
+
+
+EventT = TypeVar("EventT")
+
+
+class EventBus:
+    """Publish/subscribe by event type"""
+
+    def __init__(self):
+        self._subscribers: Dict[type, Tuple[Callable[[Any], None], ...]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(
+        self, event_type: Type[EventT], callback: Callable[[EventT], None]
+    ) -> Callable[[], None]:
+        """Call callback(event) for every published event of the type,
+        returns a function that unsubscribes it"""
+        with self._lock:
+            callbacks = self._subscribers.get(event_type, ())
+            self._subscribers[event_type] = callbacks + (callback,)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = list(self._subscribers.get(event_type, ()))
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                    self._subscribers[event_type] = tuple(callbacks)
+
+        return unsubscribe
+
+    def publish(self, event: Any):
+        """Call subscribers of the event type"""
+        self.published += 1
+        for callback in self._subscribers.get(type(event), ()):
+            try:
+                callback(event)
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                logger.error("%s subscriber failed: %r", type(event).__name__, ex)
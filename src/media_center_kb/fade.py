@@ -0,0 +1,218 @@
+"""
+Soundbar volume fades and ramps.
+
+One task (run()) drives the current ramp: every min_interval it sends the volume
+the ramp should be at by now with a single set_volume_pct, so the serial link
+gets at most one volume command per interval. When the loop falls behind the
+intermediate levels are skipped, volume key presses arriving within an interval
+are merged into one command. A new ramp replaces the running one.
+
+The soundbar keeps its volume over power off, so a fade out sends the level it
+faded from back once silent: the next power on does not start muted even
+after a daemon restart.
+
+Until run() is started targets are set right away.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from media_center_kb.events import EventBus, StateChanged
+
+logger = logging.getLogger("fde")
+
+# volume key step, percent
+VOLUME_STEP = 2
+FADE_IN = 2.0
+FADE_OUT = 1.0
+
+
+class _Ramp:  # pylint: disable=too-few-public-methods
+    """Linear volume change"""
+
+    __slots__ = ("start", "target", "started", "duration", "done", "sent")
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        start: int,
+        target: int,
+        started: float,
+        duration: float,
+        done: Optional[asyncio.Future],
+        sent: bool,
+    ):
+        """sent: start level is in effect, False sends it even if the volume looks the same"""
+        self.start = start
+        self.target = target
+        self.started = started
+        self.duration = duration
+        self.done = done
+        self.sent = sent
+
+    def level(self, now: float) -> int:
+        """Volume at the time"""
+        if self.duration <= 0 or now >= self.started + self.duration:
+            return self.target
+        part = (now - self.started) / self.duration
+        return round(self.start + (self.target - self.start) * part)
+
+    def finished(self, now: float) -> bool:
+        """Target time reached"""
+        return now >= self.started + self.duration
+
+
+class VolumeFader:  # pylint: disable=too-many-instance-attributes
+    """Rate limited volume ramps over Ysp4000 set_volume_pct"""
+
+    def __init__(
+        self,
+        ysp: Any,
+        min_interval: float = 0.1,
+        bus: Optional[EventBus] = None,
+        reported: Optional[Callable[[], int]] = None,
+    ):
+        """
+        min_interval: pause between volume commands the serial link can sustain
+        bus: reported volume changes come from it instead of a soundbar callback
+        reported: volume last reported by the soundbar, the starting volume
+            when run() starts, reports before it are not seen otherwise
+        """
+        self._ysp = ysp
+        self._bus = bus
+        self._min_interval = min_interval
+        self._ramp: Optional[_Ramp] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_sent = 0.0
+        # volume before the last fade out, restored by a fade in without target
+        self._restore: Optional[int] = None
+        self._nudges = 0
+        self._reported = reported
+        # last sent or reported volume
+        self.volume = reported() if reported is not None else 0
+        self.sent = 0
+        self.coalesced = 0
+
+    @property
+    def target(self) -> int:
+        """Volume being ramped to, the current one if idle"""
+        return self._ramp.target if self._ramp is not None else self.volume
+
+    def _send(self, level: int):
+        self._ysp.set_volume_pct(level)
+        self.volume = level
+        self.sent += 1
+        self._last_sent = time.monotonic()
+        if self._nudges > 1:
+            self.coalesced += self._nudges - 1
+        self._nudges = 0
+
+    def _on_report(self, **kwargs):
+        """Soundbar state report, the volume is believed when not ramping"""
+        if (vol := kwargs.get("volume")) is not None and self._ramp is None:
+            self.volume = int(vol)
+
+    def _on_state(self, event: StateChanged):
+        if event.name == "volume":
+            self._on_report(volume=event.value)
+
+    def _watch_volume(self) -> Callable[[], None]:
+        """Follow reported volume, returns the function to stop it"""
+        if self._bus is not None:
+            return self._bus.subscribe(StateChanged, self._on_state)
+        self._ysp.register_state_update_cb(self._on_report)
+        return lambda: self._ysp.unregister_state_update_cb(self._on_report)
+
+    def _finish(self, reached: bool):
+        ramp, self._ramp = self._ramp, None
+        if ramp is not None and ramp.done is not None and not ramp.done.done():
+            ramp.done.set_result(reached)
+
+    def set_ramp(
+        self, target: int, duration: float, start: Optional[int] = None
+    ) -> Optional[asyncio.Future]:
+        """Ramp from start (current volume by default) to target in duration seconds,
+        returns a future set to True when the target is reached, False if replaced.
+        Sets target right away and returns None when not running"""
+        target = min(max(target, 0), 100)
+        if self._wakeup is None:
+            self._send(target)
+            return None
+        self._finish(False)
+        done = asyncio.get_running_loop().create_future()
+        self._ramp = _Ramp(
+            self.volume if start is None else start,
+            target,
+            time.monotonic(),
+            duration,
+            done,
+            start is None,
+        )
+        self._wakeup.set()
+        return done
+
+    async def ramp(
+        self, target: int, duration: float, start: Optional[int] = None
+    ) -> bool:
+        """Ramp and wait, False if replaced by another ramp before the target"""
+        done = self.set_ramp(target, duration, start)
+        return True if done is None else await done
+
+    def nudge(self, delta: int):
+        """Volume key: move the target, presses within an interval are one command"""
+        self._nudges += 1
+        self.set_ramp(self.target + delta, 0)
+
+    def fade_in(self, target: Optional[int] = None, duration: float = FADE_IN):
+        """Start ramp up from silence to target, the volume before the last fade out
+        or the current one"""
+        if target is None:
+            target = self._restore if self._restore is not None else self.volume
+        if target:
+            self.set_ramp(target, duration, start=0)
+
+    async def fade_out(self, duration: float = FADE_OUT):
+        """Ramp down to silence, then send the volume back and remember it
+        for the next fade in. Call before power off"""
+        level = self.target
+        if level <= 0:
+            return
+        self._restore = level
+        if await self.ramp(0, duration):
+            await self.ramp(level, 0)
+
+    async def run(self):
+        """Drive ramps until cancelled"""
+        self._wakeup = asyncio.Event()
+        if self._reported is not None and self._ramp is None:
+            self.volume = self._reported()
+        unsubscribe = self._watch_volume()
+        try:
+            while True:
+                ramp = self._ramp
+                if ramp is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                wait = self._last_sent + self._min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                now = time.monotonic()
+                level = ramp.level(now)
+                if level != self.volume or not ramp.sent:
+                    self._send(level)
+                    ramp.sent = True
+                if ramp.finished(now):
+                    self._finish(True)
+                else:
+                    await asyncio.sleep(self._min_interval)
+        finally:
+            unsubscribe()
+            self._wakeup = None
+            ramp = self._ramp
+            if ramp is not None:
+                # keep the soundbar consistent with what was asked for
+                self._send(ramp.target)
+                self._finish(True)
@@ -3,7 +3,7 @@
 from abc import abstractmethod
 import asyncio
 import logging
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional
 import uuid
 
 from ha_mqtt_discoverable import Settings, DeviceInfo
@@ -16,8 +16,7 @@ from ha_mqtt_discoverable.sensors import (
 from paho.mqtt.client import Client, MQTTMessage
 
 from media_center_kb.control import PoweredDevice
-
-REFRESH_INTERVAL = 5
+from media_center_kb.events import EventBus, StateChanged
 
 
 def get_mac_address() -> str:
@@ -28,17 +27,15 @@ def get_mac_address() -> str:
     return mac_address
 
 
-class ControllerIf:
+class ControllerIf:  # pylint: disable=too-few-public-methods
     """Controller interface"""
 
+    bus: EventBus
+
     @abstractmethod
     def devices(self, _: Iterable[str]) -> Dict[str, PoweredDevice]:
         """Get devices by name"""
 
-    @abstractmethod
-    def shutdown(self):
-        """Shutdown the controller"""
-
 
 class CachedNumber(Number):
     """Number that remember its state"""
@@ -66,49 +63,63 @@ class CachedSwitch(Switch):
             super().update_state(state=state)
 
 
-class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
-    """Smart outlet HA device with MQTT auto discovery"""
+class RoomsIf:  # pylint: disable=too-few-public-methods
+    """Controllers of the rooms sharing the board"""
+
+    controllers: Mapping[str, ControllerIf]
+
+    @abstractmethod
+    def shutdown(self):
+        """Switch every room off and power off the board"""
+
+
+class RoomHaDevices:  # pylint: disable=too-many-instance-attributes
+    """TV, turntable and printer of a room, children of the board device"""
 
     def __init__(
         self,
         controller: ControllerIf,
-        mqtt_settings: Dict[str, Any],
+        mqtt_settings: Settings.MQTT,
+        board_id: str,
+        room: str = "",
     ):
-        self._controller = controller
+        """
+        board_id: board device the room devices are connected via
+        room: prefix of the room devices, empty for a single room
+        """
+        self.controller = controller
+        self._room = room
         self._devices = controller.devices(["tv", "turntable", "printer"])
-        self._mqtt_settings = Settings.MQTT(**mqtt_settings)
+        self._mqtt_settings = mqtt_settings
 
-        self._initialize_ha_devices()
+        self._initialize_ha_devices(board_id)
 
-    def _initialize_ha_devices(self):  # pylint: disable=too-many-locals
+    def _initialize_ha_devices(
+        self, rpi_device_id: str
+    ):  # pylint: disable=too-many-locals
         """Add sensors/switches/devices"""
-        # add all devices
-        rpi_device_id = get_mac_address()
-        self._rpi_device_info = DeviceInfo(
-            name="Media Controller",
-            model="Very Smart Outlet v2",
-            manufacturer="Straight hands, Ltd",
-            identifiers=rpi_device_id,
-        )
-        tv_device_id = rpi_device_id + "-tv"
+        # devices of other rooms on the same board get their own ids
+        room_id = rpi_device_id + (f"-{self._room}" if self._room else "")
+        room_name = f"{self._room} " if self._room else ""
+        tv_device_id = room_id + "-tv"
         self._tv_device_info = DeviceInfo(
-            name="TV",
+            name=room_name + "TV",
             model="-",
             manufacturer="-",
             identifiers=tv_device_id,
             via_device=rpi_device_id,
         )
-        turntable_device_id = rpi_device_id + "-turntable"
+        turntable_device_id = room_id + "-turntable"
         self._turntable_device_info = DeviceInfo(
-            name="Turntable",
+            name=room_name + "Turntable",
             model="-",
             manufacturer="-",
             identifiers=turntable_device_id,
             via_device=rpi_device_id,
         )
-        printer_device_id = rpi_device_id + "-printer"
+        printer_device_id = room_id + "-printer"
         self._printer_device_info = DeviceInfo(
-            name="Printer",
+            name=room_name + "Printer",
             model="1700n",
             manufacturer="Dell",
             identifiers=printer_device_id,
@@ -116,15 +127,6 @@ class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
         )
 
         # add switches
-        rpi_switch_info = SwitchInfo(
-            name="Power",
-            device_class="outlet",
-            unique_id=rpi_device_id + "-outlet",
-            device=self._rpi_device_info,
-        )
-        rpi_switch_settings = Settings(mqtt=self._mqtt_settings, entity=rpi_switch_info)
-        self._rpi_switch = CachedSwitch(rpi_switch_settings, self.rpi_switch_mqtt)
-
         tv_switch_info = SwitchInfo(
             name="Power",
             device_class="switch",
@@ -192,33 +194,18 @@ class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
         )
 
     def announce(self):
-        """Publish devices over MQTT"""
-        self._rpi_switch.on()
-
+        """Publish room devices over MQTT"""
         self._printer_switch.off()
         self._tv_switch.off()
         self._turntable_switch.off()
 
+        self.zero_volume()
+
+    def zero_volume(self):
+        """Soundbar is off"""
         self._tv_volume.set_value(0)
         self._turntable_volume.set_value(0)
 
-    def rpi_switch_mqtt(
-        self, client: Client, user_data, message: MQTTMessage
-    ):  # pylint: disable=unused-argument
-        """MQTT callback for rpi switch"""
-        payload = message.payload.decode()
-        logging.debug("rpi_switch_mqtt: %s", payload)
-        if payload == "OFF":
-            # Let HA know that the switch was successfully deactivated
-            self._rpi_switch.off()
-            self._controller.shutdown()
-            self._tv_volume.set_value(0)
-            self._turntable_volume.set_value(0)
-
-        elif payload == "ON":
-            # cannot power on itself
-            pass
-
     def printer_switch_mqtt(
         self, client: Client, user_data, message: MQTTMessage
     ):  # pylint: disable=unused-argument
@@ -241,8 +228,7 @@ class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
         if payload == "OFF":
             self._devices["tv"].off()
             self._tv_switch.off()
-            self._tv_volume.set_value(0)
-            self._turntable_volume.set_value(0)
+            self.zero_volume()
         elif payload == "ON":
             self._devices["tv"].on()
             self._tv_switch.on()
@@ -256,8 +242,7 @@ class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
         if payload == "OFF":
             self._devices["turntable"].off()
             self._turntable_switch.off()
-            self._tv_volume.set_value(0)
-            self._turntable_volume.set_value(0)
+            self.zero_volume()
         elif payload == "ON":
             self._devices["turntable"].on()
             self._turntable_switch.on()
@@ -276,6 +261,18 @@ class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
         vol = int(message.payload.decode())
         self._devices["turntable"].volume = vol  # type: ignore[attr-defined]
 
+    def close(self):
+        """Disconnect room entities from the broker"""
+        for entity in (
+            self._tv_switch,
+            self._turntable_switch,
+            self._printer_switch,
+            self._tv_volume,
+            self._turntable_volume,
+        ):
+            entity.mqtt_client.disconnect()
+            entity.mqtt_client.loop_stop()
+
     def update_all(self):
         """update all sensors"""
         self._tv_volume.set_value(self._devices["tv"].volume)
@@ -285,20 +282,132 @@ class SmartOutletHaDevice:  # pylint: disable=too-many-instance-attributes
         self._turntable_switch.update_state(self._devices["turntable"].state())
         self._printer_switch.update_state(self._devices["printer"].state())
 
+    def on_state(self, event: StateChanged):
+        """Update the sensor of a changed device"""
+        if event.name == "volume":
+            self._tv_volume.set_value(event.value)
+            self._turntable_volume.set_value(event.value)
+            return
+        switch = {
+            "tv": self._tv_switch,
+            "turntable": self._turntable_switch,
+            "printer": self._printer_switch,
+        }.get(event.name)
+        if switch is not None:
+            switch.update_state(bool(event.value))
+
+
+class SmartOutletHaDevice:
+    """Smart outlet HA device with MQTT auto discovery.
+    The board power switch is published once, devices of every room are its children
+    """
+
+    def __init__(
+        self,
+        rooms: RoomsIf,
+        mqtt_settings: Dict[str, Any],
+        published: Optional[Iterable[str]] = None,
+    ):
+        """
+        rooms: all rooms are switched off by the board power switch
+        published: rooms whose devices are published, all by default
+        """
+        self._rooms = rooms
+        self._mqtt_settings = Settings.MQTT(**mqtt_settings)
+
+        rpi_device_id = get_mac_address()
+        self._rpi_device_info = DeviceInfo(
+            name="Media Controller",
+            model="Very Smart Outlet v2",
+            manufacturer="Straight hands, Ltd",
+            identifiers=rpi_device_id,
+        )
+        rpi_switch_info = SwitchInfo(
+            name="Power",
+            device_class="outlet",
+            unique_id=rpi_device_id + "-outlet",
+            device=self._rpi_device_info,
+        )
+        rpi_switch_settings = Settings(mqtt=self._mqtt_settings, entity=rpi_switch_info)
+        self._rpi_switch = CachedSwitch(rpi_switch_settings, self.rpi_switch_mqtt)
+
+        names = rooms.controllers if published is None else published
+        self.rooms = {
+            room: RoomHaDevices(
+                rooms.controllers[room],
+                self._mqtt_settings,
+                rpi_device_id,
+                room,
+            )
+            for room in names
+        }
+
+    def announce(self):
+        """Publish devices over MQTT"""
+        self._rpi_switch.on()
+        for room in self.rooms.values():
+            room.announce()
+
+    def rpi_switch_mqtt(
+        self, client: Client, user_data, message: MQTTMessage
+    ):  # pylint: disable=unused-argument
+        """MQTT callback for rpi switch"""
+        payload = message.payload.decode()
+        logging.debug("rpi_switch_mqtt: %s", payload)
+        if payload == "OFF":
+            # Let HA know that the switch was successfully deactivated
+            self._rpi_switch.off()
+            # every room is switched off, the board is powered off once
+            self._rooms.shutdown()
+            for room in self.rooms.values():
+                room.zero_volume()
+
+        elif payload == "ON":
+            # cannot power on itself
+            pass
+
+    def watch(self) -> Callable[[], None]:
+        """Follow state changes of every room, returns the function to stop it"""
+        unsubscribers = [
+            room.controller.bus.subscribe(StateChanged, room.on_state)
+            for room in self.rooms.values()
+        ]
+
+        def unsubscribe():
+            for unsubscriber in unsubscribers:
+                unsubscriber()
+
+        return unsubscribe
+
+    def close(self):
+        """Disconnect all entities from the broker"""
+        self._rpi_switch.mqtt_client.disconnect()
+        self._rpi_switch.mqtt_client.loop_stop()
+        for room in self.rooms.values():
+            room.close()
+
+    def update_all(self):
+        """update all sensors"""
+        for room in self.rooms.values():
+            room.update_all()
+
 
 async def ha_loop(device: SmartOutletHaDevice):
-    """loop updating MQTT"""
+    """Publish the current state, then every state change from the rooms' buses"""
+    unsubscribe = None
     try:
         device.announce()
-        while True:
-            try:
-                device.update_all()
-            except Exception as ex:  # pylint: disable=broad-exception-caught
-                logging.error("Error updating sensors: %s", ex)
-
-            await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            device.update_all()
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            logging.error("Error updating sensors: %s", ex)
+        unsubscribe = device.watch()
+        await asyncio.Event().wait()
     except asyncio.CancelledError:
         logging.info("cancelled ha_loop")
+    finally:
+        if unsubscribe is not None:
+            unsubscribe()
 
 
 async def main():
@@ -48,29 +48,53 @@ ls -al /dev/input/keypad
 """
 
 import asyncio
-from typing import Dict, Callable
+from typing import AsyncIterable, Callable, Mapping, Optional
 import logging
 
-from evdev import InputDevice, ecodes, KeyEvent
+from evdev import InputDevice, InputEvent, ecodes, KeyEvent
 
 logger = logging.getLogger("kbb")
 
+KEYPAD = "/dev/input/keypad"
 
-async def kb_event_loop(handlers: Dict[str, Callable]):
+
+def handle_event(handlers: Mapping[str, Callable], evt: InputEvent):
+    """Call the handler if the event is a key press"""
+    if evt.type != ecodes.EV_KEY:  # pylint: disable=no-member
+        return
+    key_event = KeyEvent(evt)
+    if key_event.keystate != KeyEvent.key_down:
+        return
+    keycode: str = key_event.keycode  # type: ignore[assignment]
+    if keycode == "KEY_NUMLOCK":
+        return
+
+    logger.debug("scan: %d, key: %s", key_event.scancode, keycode)
+    handler = handlers.get(keycode)
+    if handler is not None:
+        handler()
+
+
+async def dispatch_events(
+    events: AsyncIterable[InputEvent], handlers: Mapping[str, Callable]
+):
+    """Call handlers for key presses from the events stream"""
+    async for evt in events:
+        handle_event(handlers, evt)
+
+
+async def kb_event_loop(
+    handlers: Mapping[str, Callable],
+    on_ready: Optional[Callable[[], None]] = None,
+    device: str = KEYPAD,
+):
     """Start keyboard reading loop and call handlers"""
-    keypad = InputDevice("/dev/input/keypad")
+    keypad = InputDevice(device)
+    if on_ready:
+        on_ready()
     try:
-        async for evt in keypad.async_read_loop():
-            if (evt.type == ecodes.EV_KEY) and (  # pylint: disable=no-member
-                KeyEvent(evt).keystate == 1
-            ):  # pylint: disable=no-member
-                if KeyEvent(evt).keycode == "KEY_NUMLOCK":
-                    continue
-
-                logger.debug(
-                    "scan: %d, key: %s", KeyEvent(evt).scancode, KeyEvent(evt).keycode
-                )
-                handler = handlers.get(KeyEvent(evt).keycode, lambda: None)
-                handler()
+        await dispatch_events(keypad.async_read_loop(), handlers)
     except asyncio.CancelledError:
         logger.info("cancelled kb_event_loop")
+    finally:
+        keypad.close()
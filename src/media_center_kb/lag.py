@@ -0,0 +1,121 @@
+"""
+Event loop lag sampling: how late scheduled wakeups fire.
+
+A stalled loop cannot report itself, so a watchdog thread checks the
+sampler heartbeat and logs the loop thread stack while the stall is going on.
+
+Metrics are optional and imported lazily, they subscribe with add_callback.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional
+
+logger = logging.getLogger("lag")
+
+
+class LoopLagSampler:
+    """Sleeps for a fixed interval and measures wakeup lateness"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._callbacks: List[Callable[[float], None]] = []
+        self.last = 0.0
+        self.max = 0.0
+
+    def add_callback(self, callback: Callable[[float], None]):
+        """Call callback(lag) on every sample"""
+        self._callbacks.append(callback)
+
+    def sample(self, lag: float):
+        """Record a lag sample"""
+        self.last = lag
+        self.max = max(self.max, lag)
+        for callback in self._callbacks:
+            callback(lag)
+
+    async def run(self):
+        """Sample until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.sample(max(loop.time() - expected, 0.0))
+
+
+class StallWatchdog:  # pylint: disable=too-many-instance-attributes
+    """Thread logging what the loop thread runs when heartbeats stop for too long"""
+
+    def __init__(
+        self,
+        interval: float,
+        threshold: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        interval: expected time between beats
+        threshold: lateness over the interval considered a stall
+        """
+        self._interval = interval
+        self._threshold = threshold
+        self._clock = clock
+        self._last_beat = clock()
+        self._stalled_since: Optional[float] = None
+        self._loop_thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stalls = 0
+
+    def beat(self, _: float = 0.0):
+        """Heartbeat from the loop thread, usable as a lag sampler callback"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = self._clock()
+        if self._stalled_since is not None:
+            logger.warning(
+                "event loop recovered after %.3fs stall",
+                self._last_beat - self._stalled_since,
+            )
+            self._stalled_since = None
+
+    def loop_stack(self) -> str:
+        """Current stack of the loop thread"""
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "<no frame>"
+        return "".join(traceback.format_stack(frame))
+
+    def check(self):
+        """Log the loop stack once per stall"""
+        last_beat = self._last_beat
+        if self._stalled_since is not None:
+            return
+        if self._clock() - last_beat > self._interval + self._threshold:
+            self._stalled_since = last_beat + self._interval
+            self.stalls += 1
+            logger.warning("event loop stalled, running:\n%s", self.loop_stack())
+
+    def _run(self):
+        while not self._stopped.wait(self._threshold / 2):
+            self.check()
+
+    def start(self):
+        """Start watchdog thread, call from the loop thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = self._clock()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stall-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop watchdog thread"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
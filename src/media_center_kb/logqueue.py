@@ -0,0 +1,185 @@
+"""
+Queue based logging: callers only format and enqueue a record,
+a background thread writes records in batches and flushes once per batch,
+so journald or SD card writes never block the event loop.
+
+Info and debug records are rate limited per logger, warnings and errors always pass.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+LOG_FORMAT = "%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """Stream handler that leaves flushing to the caller"""
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handleError(record)
+
+
+class RateLimitFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Token bucket per logger name for records below WARNING.
+    The number of suppressed records is appended to the next passed one"""
+
+    def __init__(
+        self,
+        rate: float = 50.0,
+        burst: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        # logger name -> (tokens, last update)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self.suppressed: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        now = self._clock()
+        tokens, last = self._buckets.get(record.name, (float(self._burst), now))
+        tokens = min(float(self._burst), tokens + (now - last) * self._rate)
+        if tokens < 1:
+            self._buckets[record.name] = (tokens, now)
+            self.suppressed[record.name] = self.suppressed.get(record.name, 0) + 1
+            return False
+
+        self._buckets[record.name] = (tokens - 1, now)
+        suppressed = self.suppressed.pop(record.name, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} messages suppressed)"
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter:
+    """Background thread writing queued records in batches"""
+
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        handler: logging.Handler,
+        batch_size: int = 64,
+    ):
+        self._queue = log_queue
+        self._handler = handler
+        self._batch_size = batch_size
+        self._thread: Optional[threading.Thread] = None
+        self._stop = object()
+
+    def start(self):
+        """Start writer thread"""
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write remaining records and stop the thread"""
+        if self._thread is None:
+            return
+        # do not hang the exit if the writer is stuck on the stream
+        try:
+            self._queue.put(self._stop, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _get_batch(self) -> Tuple[List[logging.LogRecord], bool]:
+        batch: List[logging.LogRecord] = []
+        item = self._queue.get()
+        try:
+            while True:
+                if item is self._stop:
+                    return batch, True
+                batch.append(item)
+                if len(batch) >= self._batch_size:
+                    break
+                item = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        return batch, False
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._get_batch()
+            for record in batch:
+                self._handler.handle(record)
+            if batch:
+                self._handler.flush()
+
+
+_writer: Optional[LogWriter] = None  # pylint: disable=invalid-name
+
+
+def _stop_writer():
+    global _writer  # pylint: disable=global-statement
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+atexit.register(_stop_writer)
+
+
+def configure(
+    level: int = logging.INFO,
+    handler: Optional[logging.Handler] = None,
+    rate_limit: Optional[RateLimitFilter] = None,
+    queue_size: int = 10000,
+) -> DroppingQueueHandler:
+    """Replace root logger handlers with a queue handler and start the writer.
+    Calling it again stops the previous writer after draining it"""
+    global _writer  # pylint: disable=global-statement
+
+    if handler is None:
+        handler = BatchStreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(rate_limit if rate_limit is not None else RateLimitFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    _stop_writer()
+
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _writer = LogWriter(log_queue, handler)
+    _writer.start()
+    return queue_handler
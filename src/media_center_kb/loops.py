@@ -0,0 +1,27 @@
+"""Event loop implementation selection"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger("lps")
+
+LOOPS = ("asyncio", "uvloop")
+
+
+def use_event_loop(name: str) -> str:
+    """Set event loop policy for the following asyncio.run.
+    Returns the name of the loop actually used: falls back to asyncio if uvloop is not installed
+    """
+    if name == "uvloop":
+        try:
+            import uvloop  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            logger.warning("uvloop is not installed, using asyncio event loop")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return name
+    elif name != "asyncio":
+        raise ValueError(f"unknown event loop: {name}")
+
+    asyncio.set_event_loop_policy(None)
+    return "asyncio"
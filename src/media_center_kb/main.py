@@ -4,60 +4,76 @@ Entry point module that starts infinite loop reading keyboard
 
 import argparse
 import asyncio
-import json
+import importlib
+import inspect
 import logging
 import os
 import signal
+import sys
+import tempfile
+from typing import TYPE_CHECKING, Callable, Dict, List, Mapping, Optional, Sequence
 
-from ysp4000.ysp import Ysp4000
+from media_center_kb.startup import StartupProfile
 
-from media_center_kb.control import Controller
-from media_center_kb.gpio import GPioNoOp
-from media_center_kb.ha import ha_loop, SmartOutletHaDevice
-from media_center_kb.kb import kb_event_loop
-from media_center_kb.relays import RelayModule, Pins
+# created before the rest of imports to account them
+startup = StartupProfile()
 
-try:
-    from media_center_kb.rpi import GPio
+# pylint: disable=wrong-import-position
+from media_center_kb import logqueue, systemd
+from media_center_kb.breaker import CircuitBreaker
+from media_center_kb.config import Config, load_rooms, scoped
+from media_center_kb.control import Controller, runner
+from media_center_kb.events import EventBus
+from media_center_kb.gpio import GPioIf, GPioNoOp
+from media_center_kb.loops import LOOPS, use_event_loop
+from media_center_kb.relays import RelayModule
+from media_center_kb.reload import Reloader
+from media_center_kb.rooms import Rooms
+from media_center_kb.shell import RestrictedShell
+from media_center_kb.supervisor import CoroFactory, Supervisor
+from media_center_kb.timers import TimerService
+from media_center_kb.ysp_scheduler import YspScheduler
+
+if TYPE_CHECKING:
+    from media_center_kb.lag import LoopLagSampler
+    from media_center_kb.metrics import DaemonMetrics
+
+startup.mark("imports")
+
+# Ysp4000 methods that do not send anything over serial
+YSP_NON_COMMANDS = (
+    "register_state_update_cb",
+    "unregister_state_update_cb",
+    "get_async_coro",
+    "close",
+)
 
-    RAISED = None
-except RuntimeError as ex:
-    RAISED = ex
+# devices the HA integration publishes, rooms without them have no HA entities
+HA_DEVICES = ("tv", "turntable", "printer")
+# Ysp4000.__init__ serial device argument, checked against the installed library
+# on use and by tests/test_ysp_emulator.py when yamaha-ysp-4000 is installed
+YSP_PORT_ARG = "port"
 
+# Subsystems (serial, keyboard, RPi GPIO, HA/MQTT) are imported in run() only when enabled:
+# pydantic and paho behind ha_mqtt_discoverable take seconds to import on RPi 2B.
+# pylint: disable=import-outside-toplevel
 
-def init_logging(level=None, **kwargs):
-    """init logging"""
+
+def init_logging(level=None):
+    """init logging, records are written by a background thread"""
     if not level:
         level = logging.INFO
-    logging.basicConfig(
-        level=level,
-        format="%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%dT%H:%M:%S",
-        **kwargs,
-    )
+    logqueue.configure(level)
 
 
 init_logging()
 logger = logging.getLogger("mcc")
 
 
-class RestrictedShell:  # pylint: disable=too-few-public-methods
-    """Callable shell cmd"""
-
-    _allowed_cmds = frozenset(
-        [
-            "sudo poweroff",
-        ]
-    )
-
-    def __init__(self, allowed_cmds=None):
-        if allowed_cmds is not None:
-            self._allowed_cmds = allowed_cmds
-
-    def __call__(self, cmd: str):
-        logger.info("system: %s", cmd)
-        if cmd in self._allowed_cmds:
-            os.system(cmd)
+def ready():
+    """Report startup time and notify systemd the service is up"""
+    startup.report()
+    systemd.notify("READY=1")
 
 
 def shutdown(loop):
@@ -67,8 +83,142 @@ def shutdown(loop):
         task.cancel()
 
 
-async def run():
-    """init dependencies and run kb read loop"""
+async def ha_subsystem(rooms: Rooms, mqtt_settings: dict, published: Sequence[str]):
+    """Import and start HA integration in a worker thread so that slow imports
+    and the broker connection do not delay the keyboard.
+    One board device for all rooms, with the devices of the published rooms"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    ha = await loop.run_in_executor(None, importlib.import_module, "media_center_kb.ha")
+    device = await loop.run_in_executor(
+        None, ha.SmartOutletHaDevice, rooms, mqtt_settings, published
+    )
+    if startup.enabled:
+        logger.info("HA integration started in %.1f ms", (loop.time() - started) * 1000)
+    try:
+        await ha.ha_loop(device)
+    finally:
+        await loop.run_in_executor(None, device.close)
+
+
+def make_ysp(ysp_class: Callable, verbose: bool, port: Optional[str] = None):
+    """Soundbar on the default serial port or the given one.
+    Raises ValueError if the installed yamaha-ysp-4000 cannot select a port
+    """
+    if not port:
+        return ysp_class(verbose=verbose)
+    params = inspect.signature(ysp_class).parameters.values()
+    if not any(
+        param.name == YSP_PORT_ARG or param.kind == param.VAR_KEYWORD
+        for param in params
+    ):
+        raise ValueError(
+            f"installed ysp4000 does not take a {YSP_PORT_ARG!r} argument, "
+            f"serial port {port} cannot be used"
+        )
+    return ysp_class(verbose=verbose, **{YSP_PORT_ARG: port})
+
+
+def make_gpio(no_gpio: bool, pins: Sequence[int]) -> GPioIf:
+    """RPi GPIO or no-op one if disabled"""
+    if no_gpio:
+        return GPioNoOp(pins)
+
+    from media_center_kb.rpi import GPio
+
+    return GPio(pins)
+
+
+def make_controller(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    args: argparse.Namespace,
+    config: Config,
+    relays: RelayModule,
+    ysp,
+    supervisor: Supervisor,
+    metrics: Optional["DaemonMetrics"],
+    room: str = "",
+) -> Controller:
+    """Controller sending soundbar commands through the priority scheduler"""
+    if args.no_gpio and args.no_keyboard and args.no_serial:
+        # looks like running in dev mode
+        shell = RestrictedShell(allowed_cmds=[])
+    else:
+        shell = RestrictedShell()
+
+    # serial commands are counted when actually sent, after scheduling
+    # soundbar state reports are expected only when the serial port is read
+    scheduler = YspScheduler(
+        metrics.count_serial(ysp, YSP_NON_COMMANDS, room) if metrics else ysp,
+        YSP_NON_COMMANDS,
+        breaker=(None if args.no_serial else CircuitBreaker(scoped(room, "soundbar"))),
+    )
+    supervisor.add(scoped(room, "ysp-queue"), scheduler.run)
+
+    controller = Controller(relays, scheduler, shell, config, relays.bus)
+    supervisor.add(scoped(room, "volume-fade"), controller.fader.run)
+    if metrics:
+        metrics.track_relays(relays, room)
+        metrics.track_soundbar(scheduler, room)
+        controller.add_observer(metrics.command_observer(room))
+        metrics.track_devices(controller.powered_devices(), room)
+    return controller
+
+
+def start_lag_monitor(supervisor: Supervisor, threshold: float):
+    """Add loop lag sampler subsystem, start stall watchdog thread
+    and systemd watchdog pings if the service has WatchdogSec set"""
+    from media_center_kb.lag import LoopLagSampler, StallWatchdog
+
+    sampler = LoopLagSampler()
+    stall_watchdog = StallWatchdog(sampler.interval, threshold)
+    sampler.add_callback(stall_watchdog.beat)
+
+    interval = systemd.watchdog_interval()
+    if interval:
+        logger.info("systemd watchdog enabled, interval %.1fs", interval)
+        sampler.add_callback(systemd.WatchdogPinger(interval, threshold))
+
+    supervisor.add("lag", sampler.run)
+    stall_watchdog.start()
+    return sampler, stall_watchdog
+
+
+def start_metrics(address: str, supervisor: Supervisor, sampler: "LoopLagSampler"):
+    """Create daemon metrics and add HTTP endpoint subsystem, rooms add their parts"""
+    from media_center_kb.metrics import DaemonMetrics, MetricsServer
+
+    host, _, port = address.rpartition(":")
+    metrics = DaemonMetrics()
+    metrics.track_restarts(supervisor)
+    metrics.track_lag(sampler)
+
+    server = MetricsServer(metrics.registry, host or "127.0.0.1", int(port))
+    supervisor.add("metrics", server.serve)
+    return metrics
+
+
+def add_profiling_signals(directory: str, trace_memory: bool = False):
+    """SIGUSR1 toggles cProfile, SIGUSR2 writes a tracemalloc snapshot"""
+    from media_center_kb.profiling import Profiler
+
+    loop = asyncio.get_running_loop()
+    profiler = Profiler(directory, trace_memory=trace_memory)
+
+    # cProfile captures the thread that enables it, so it is toggled on the loop thread,
+    # stats and snapshots take a while and are written in a worker thread
+    def toggle_profile():
+        profile = profiler.toggle_profile()
+        if profile is not None:
+            loop.run_in_executor(None, profiler.write_profile, profile)
+
+    loop.add_signal_handler(signal.SIGUSR1, toggle_profile)
+    loop.add_signal_handler(
+        signal.SIGUSR2, lambda: loop.run_in_executor(None, profiler.memory_snapshot)
+    )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """parse command line"""
     parser = argparse.ArgumentParser(description="App manager")
     parser.add_argument(
         "-d",
@@ -88,8 +238,16 @@ async def run():
         "-m",
         "--mqtt",
         dest="mqtt",
-        type=argparse.FileType("rt", encoding="utf8"),
-        help="Verbose output",
+        metavar="PATH",
+        help="MQTT settings JSON file, re-read on SIGHUP",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        dest="config",
+        metavar="PATH",
+        help="Relays, devices, scenes and keymap JSON or TOML file, "
+        "keymap is re-read on SIGHUP",
     )
     parser.add_argument(
         "--no-gpio",
@@ -115,55 +273,267 @@ async def run():
         action="store_true",
         help="No MQTT. Useful when tunning without MQTT+HA integration",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--serial-port",
+        dest="serial_port",
+        metavar="PATH",
+        help="Soundbar serial port instead of the default one, "
+        "for example a pty of media_center_kb.ysp_emulator",
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        metavar="PATH",
+        help="Serve JSON lines control API on this Unix socket",
+    )
+    parser.add_argument(
+        "--timers",
+        dest="timers",
+        metavar="PATH",
+        help="Keep sleep timers and daily schedules in this JSON file across restarts",
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        metavar="[HOST:]PORT",
+        help="Serve Prometheus metrics over HTTP, localhost if no host given",
+    )
+    parser.add_argument(
+        "--loop",
+        dest="loop",
+        choices=LOOPS,
+        default="asyncio",
+        help="Event loop implementation, uvloop falls back to asyncio if not installed",
+    )
+    parser.add_argument(
+        "--lag-threshold",
+        dest="lag_threshold",
+        metavar="SECONDS",
+        type=float,
+        default=0.5,
+        help="Log the event loop stack when it is stalled for longer, "
+        "no systemd watchdog pings while lag is over it",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        dest="profile_dir",
+        metavar="PATH",
+        default=os.path.join(tempfile.gettempdir(), "mediackb"),
+        help="Where SIGUSR1 cProfile stats and SIGUSR2 memory snapshots are written",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        dest="trace_memory",
+        action="store_true",
+        help="Trace allocations from startup for SIGUSR2 memory snapshots",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        dest="startup_profile",
+        action="store_true",
+        help="Log time spent in each startup phase. "
+        "Use with python -X importtime for per-module import details",
+    )
+    return parser.parse_args(argv)
+
+
+def add_printer_watchers(
+    supervisor: Supervisor, room: str, config: Config, controller: Controller
+):
+    """Power devices with a CUPS printer URI by the print queue"""
+    devices = controller.powered_devices()
+    for name, device in config.devices.items():
+        if device.cups is None:
+            continue
+        from media_center_kb.cups import IDLE_OFF, IppClient, PrinterWatcher
+
+        watcher = PrinterWatcher(
+            devices[name],
+            IppClient(device.cups),
+            IDLE_OFF if device.idle_off is None else device.idle_off,
+        )
+        supervisor.add(scoped(room, f"{name}-cups"), watcher.run)
+
+
+def add_room_subsystems(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    args: argparse.Namespace,
+    supervisor: Supervisor,
+    room: str,
+    config: Config,
+    controller: Controller,
+    ysp,
+    on_ready: Optional[Callable[[], None]],
+    ha_factory: Optional[Callable[[dict], CoroFactory]],
+) -> Reloader:
+    """Add keyboard and serial subsystems of a room, returns its config reloader.
+    ha_factory: HA subsystem restarted by this room's reloader on MQTT changes"""
+    reloader = Reloader(
+        controller, supervisor, args.config, args.mqtt, ha_factory, room
+    )
+    if not args.no_keyboard:
+        from media_center_kb.kb import KEYPAD, kb_event_loop
+
+        startup.mark("import kb")
+        keypad = config.keypad or KEYPAD
+        supervisor.add(
+            scoped(room, "keyboard"),
+            lambda: kb_event_loop(reloader.kb_handlers, on_ready, keypad),
+        )
+    if not args.no_serial:
+        supervisor.add(
+            scoped(room, "serial"),
+            lambda: ysp.get_async_coro(asyncio.get_running_loop()),
+        )
+    add_printer_watchers(supervisor, room, config, controller)
+    return reloader
+
+
+def ha_rooms(args: argparse.Namespace, rooms: Mapping[str, Config]) -> List[str]:
+    """Rooms published to HA, none if HA is disabled"""
+    if args.no_ha or not args.mqtt:
+        return []
+    published = []
+    for room, config in rooms.items():
+        if set(HA_DEVICES) <= set(config.devices):
+            published.append(room)
+        else:
+            logger.warning("room %s has no %s, not published to HA", room, HA_DEVICES)
+    return published
+
+
+def add_subsystems(
+    args: argparse.Namespace,
+    supervisor: Supervisor,
+    rooms: Rooms,
+    ha: Optional[CoroFactory] = None,
+):
+    """Add subsystems shared by rooms to the supervisor"""
+    if ha is not None:
+        supervisor.add("ha", ha)
+    timers = TimerService(rooms.async_commands_map(), args.timers)
+    supervisor.add("timers", timers.run)
+    if args.socket:
+        from media_center_kb.api import ControlServer
+
+        api_server = ControlServer(rooms, args.socket, timers)
+        supervisor.add("api", api_server.serve)
+    if args.no_keyboard:
+        ready()
+
+
+async def run(args: argparse.Namespace):  # pylint: disable=too-many-locals
+    """init dependencies and run kb read loop"""
+    startup.enabled = args.startup_profile
+    if args.trace_memory:
+        # allocations made while starting up are the baseline of the first snapshot
+        import tracemalloc
+
+        tracemalloc.start()
 
     verbose = False
     if args.verbose or args.debug:
         verbose = True
-        init_logging(level=logging.DEBUG, force=True)
-
-    mqtt_settings = None
-    if args.mqtt:
-        mqtt_settings = json.load(args.mqtt)
+        init_logging(level=logging.DEBUG)
 
     loop = asyncio.get_running_loop()
+    # MQTT callbacks wait for device commands on this loop
+    runner.bind(loop)
 
     # Handle shutdown signals
     for signame in ("SIGINT", "SIGTERM"):
         loop.add_signal_handler(getattr(signal, signame), lambda: shutdown(loop))
 
-    if not args.no_gpio and RAISED:
-        raise RAISED
+    startup.mark("args")
 
+    rooms = load_rooms(args.config)
+    startup.mark("config")
+
+    from ysp4000.ysp import Ysp4000
+
+    startup.mark("import ysp4000")
+
+    # each subsystem is restarted on failure without touching the others,
+    # controllers and relays are created once and keep their state
+    supervisor = Supervisor()
+    sampler, stall_watchdog = start_lag_monitor(supervisor, args.lag_threshold)
+    metrics = start_metrics(args.metrics, supervisor, sampler) if args.metrics else None
+
+    ysps: List[Ysp4000] = []
     try:
-        gpio = GPio(Pins) if not args.no_gpio else GPioNoOp(Pins)
-        relays = RelayModule(gpio, logging.getLogger("rly"))
-        ysp = Ysp4000(verbose=verbose)
-        if args.no_gpio and args.no_keyboard and args.no_serial:
-            # looks like running in dev mode
-            shell = RestrictedShell(allowed_cmds=[])
-        else:
-            shell = RestrictedShell()
-        controller = Controller(relays, ysp, shell)
-
-        coros = []
-        if not args.no_keyboard:
-            coros.append(kb_event_loop(controller.kb_handlers()))
-        if not args.no_serial:
-            coros.append(ysp.get_async_coro(loop))
-        if mqtt_settings and not args.no_ha:
-            coros.append(ha_loop(SmartOutletHaDevice(controller, mqtt_settings)))
-
-        await asyncio.gather(*coros)
+        controllers: Dict[str, Controller] = {}
+        reloaders: List[Reloader] = []
+        published = ha_rooms(args, rooms)
+
+        def ha_factory(mqtt: dict) -> CoroFactory:
+            # board shutdown switches off every room, published or not
+            return lambda: ha_subsystem(Rooms(controllers), mqtt, published)
+
+        for room, config in rooms.items():
+            # one event stream per room, relays publish to it too
+            relays = RelayModule(
+                make_gpio(args.no_gpio, config.pins),
+                logging.getLogger("rly"),
+                config.pins,
+                EventBus(),
+            )
+            port = config.serial_port or args.serial_port
+            ysp = make_ysp(Ysp4000, verbose, port)
+            ysps.append(ysp)
+            controller = make_controller(
+                args, config, relays, ysp, supervisor, metrics, room
+            )
+            controllers[room] = controller
+            # the service is ready once the first keypad is open
+            reloaders.append(
+                add_room_subsystems(
+                    args,
+                    supervisor,
+                    room,
+                    config,
+                    controller,
+                    ysp,
+                    None if reloaders else ready,
+                    # one HA subsystem, reloaded with the first room
+                    None if reloaders or not published else ha_factory,
+                )
+            )
+        startup.mark("rooms")
+
+        def reload_all():
+            for reloader in reloaders:
+                reloader.schedule()
+
+        loop.add_signal_handler(signal.SIGHUP, reload_all)
+        add_profiling_signals(args.profile_dir, args.trace_memory)
+
+        mqtt_settings = reloaders[0].mqtt_settings if reloaders else None
+        add_subsystems(
+            args,
+            supervisor,
+            Rooms(controllers),
+            ha_factory(mqtt_settings) if published and mqtt_settings else None,
+        )
+        await supervisor.run()
     except asyncio.CancelledError:
         logger.info("exiting main on cancel")
     finally:
-        ysp.close()
+        stall_watchdog.stop()
+        runner.bind(None)
+        for ysp in ysps:
+            ysp.close()
 
 
 def main():
     """main runs asyncio"""
-    asyncio.run(run())
+    if sys.argv[1:2] in (["record"], ["replay"]):
+        from media_center_kb.trace import main as trace_main
+
+        trace_main(sys.argv[1:])
+        return
+
+    args = parse_args()
+    use_event_loop(args.loop)
+    asyncio.run(run(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,429 @@
+"""
+Prometheus text format metrics and a tiny HTTP endpoint serving them
+from the event loop
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from media_center_kb.config import scoped
+from media_center_kb.control import PoweredDevice
+from media_center_kb.lag import LoopLagSampler
+from media_center_kb.relays import RelayModule
+from media_center_kb.supervisor import Supervisor
+from media_center_kb.ysp_scheduler import YspScheduler
+
+logger = logging.getLogger("mtr")
+
+LabelValues = Tuple[str, ...]
+MetricT = TypeVar("MetricT", bound="Metric")
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+# stalls of a few seconds are expected from blocking calls
+LAG_BUCKETS = LATENCY_BUCKETS + (5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    # an empty label is the same as no label for Prometheus
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"'
+        for name, value in zip(names, values)
+        if value != ""
+    )
+    return "{" + pairs + "}" if pairs else ""
+
+
+class Metric:
+    """Base metric family"""
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        collect: Optional[Callable[[], Iterable[Tuple[LabelValues, float]]]] = None,
+    ):
+        """
+        collect: optional callback returning (label values, value) pairs,
+        used to expose counters maintained elsewhere without double bookkeeping
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Sequence[Any]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float]]:
+        """(suffix, label values, value) for every sample"""
+        values = self._collect() if self._collect else self._values.items()
+        for labels, value in values:
+            yield "", tuple(str(label) for label in labels), value
+
+    def render(self) -> List[str]:
+        """Text format lines"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            names = self.labelnames
+            if len(labels) > len(names):
+                names = names + ("le",)
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(names, labels)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+
+    kind = "counter"
+
+    def inc(self, *labels: Any, amount: float = 1.0):
+        """Increment counter"""
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels: Any):
+        """Set gauge value"""
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *labels: Any):
+        """Record an observation"""
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self._buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, *labels: Any) -> int:
+        """Number of observations"""
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float]]:
+        for key, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(self._buckets + (math.inf,), counts):
+                total += count
+                yield "_bucket", key + (_format_value(bound),), total
+            yield "_sum", key, self._sums[key]
+            yield "_count", key, total
+
+
+class Registry:
+    """Metrics collection"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        """Add a metric"""
+        if metric.name in self._metrics:
+            raise ValueError(f"duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class CountingProxy:  # pylint: disable=too-few-public-methods
+    """Proxy counting calls to wrapped object methods, for example serial commands"""
+
+    def __init__(
+        self,
+        target: Any,
+        counter: Counter,
+        passthrough: Iterable[str] = (),
+        room: str = "",
+    ):
+        """room: prefix of the counted method names"""
+        self._target = target
+        self._counter = counter
+        self._passthrough = frozenset(passthrough)
+        self._room = room
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or name in self._passthrough or not callable(attr):
+            return attr
+
+        counter = self._counter
+        label = scoped(self._room, name)
+
+        def counted(*args, **kwargs):
+            counter.inc(label)
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+class MetricsServer:  # pylint: disable=too-few-public-methods
+    """Minimal HTTP server for GET /metrics"""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self._registry = registry
+        self._host = host
+        self._port = port
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            request = await reader.readline()
+            # skip headers
+            while await reader.readline() not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if (
+                len(parts) >= 2
+                and parts[0] == b"GET"
+                and parts[1]
+                in (
+                    b"/metrics",
+                    b"/",
+                )
+            ):
+                status = "200 OK"
+                body = self._registry.render().encode()
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+            writer.write(
+                (
+                    f"HTTP/1.0 {status}\r\n"
+                    "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError as ex:
+            logger.debug("metrics client error: %s", ex)
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Serve until cancelled"""
+        server = await asyncio.start_server(self._handle_client, self._host, self._port)
+        logger.info("metrics served on %s:%d", self._host, self._port)
+        async with server:
+            await server.serve_forever()
+
+
+class DaemonMetrics:
+    """Metrics exposed by the daemon.
+    Every room adds its relays, soundbar and devices, their labels are prefixed
+    with the room name when there are several rooms
+    """
+
+    def __init__(self):
+        self.registry = Registry()
+        # per-command counts are the histogram _count series
+        self.command_duration = self.registry.register(
+            Histogram(
+                "mediackb_command_duration_seconds",
+                "Command execution time",
+                ("command",),
+            )
+        )
+        self.serial_commands = self.registry.register(
+            Counter(
+                "mediackb_serial_commands_total",
+                "Commands sent to the soundbar",
+                ("command",),
+            )
+        )
+        self._relays: List[Tuple[str, RelayModule]] = []
+        self._soundbars: List[Tuple[str, YspScheduler]] = []
+        self._devices: List[Tuple[str, Mapping[str, PoweredDevice]]] = []
+
+    def observe_command(self, name: str, duration: float):
+        """Controller observer"""
+        self.command_duration.observe(duration, name)
+
+    def command_observer(self, room: str) -> Callable[[str, float], None]:
+        """Controller observer for a room"""
+        if not room:
+            return self.observe_command
+        return lambda name, duration: self.observe_command(scoped(room, name), duration)
+
+    def track_lag(self, sampler: LoopLagSampler) -> Histogram:
+        """Expose loop lag samples as a histogram"""
+        histogram = self.registry.register(
+            Histogram(
+                "mediackb_loop_lag_seconds",
+                "Event loop wakeup lateness",
+                buckets=LAG_BUCKETS,
+            )
+        )
+        sampler.add_callback(histogram.observe)
+        return histogram
+
+    def count_serial(
+        self, ysp: Any, passthrough: Iterable[str] = (), room: str = ""
+    ) -> Any:
+        """Wrap ysp to count sent commands"""
+        return CountingProxy(ysp, self.serial_commands, passthrough, room)
+
+    def track_relays(self, relays: RelayModule, room: str = ""):
+        """Expose relay toggle counters"""
+        if not self._relays:
+            self.registry.register(
+                Counter(
+                    "mediackb_relay_toggles_total",
+                    "Relay GPIO switches",
+                    ("relay",),
+                    collect=lambda: (
+                        ((scoped(scope, str(relay)),), count)
+                        for scope, module in self._relays
+                        for relay, count in module.toggles.items()
+                    ),
+                )
+            )
+        self._relays.append((room, relays))
+
+    def track_soundbar(self, scheduler: YspScheduler, room: str = ""):
+        """Expose soundbar availability and commands not sent while it was offline"""
+        if not self._soundbars:
+            self.registry.register(
+                Gauge(
+                    "mediackb_soundbar_online",
+                    "Soundbar responds, circuit breaker is closed",
+                    ("room",),
+                    collect=lambda: (
+                        ((scope,), 1.0 if soundbar.online else 0.0)
+                        for scope, soundbar in self._soundbars
+                    ),
+                )
+            )
+            self.registry.register(
+                Counter(
+                    "mediackb_soundbar_failed_fast_total",
+                    "Soundbar commands not sent because it did not respond",
+                    ("room",),
+                    collect=lambda: (
+                        ((scope,), soundbar.failed_fast)
+                        for scope, soundbar in self._soundbars
+                    ),
+                )
+            )
+        self._soundbars.append((room, scheduler))
+
+    def _device_counts(self, attr: str) -> Iterable[Tuple[Tuple[str], float]]:
+        for room, devices in self._devices:
+            for name, device in devices.items():
+                yield (scoped(room, name),), getattr(device, attr)
+
+    def track_devices(self, devices: Mapping[str, PoweredDevice], room: str = ""):
+        """Expose power changes cancelled or joined by a newer request"""
+        if not self._devices:
+            self.registry.register(
+                Counter(
+                    "mediackb_device_cancelled_total",
+                    "Power changes cancelled by a request for the opposite state",
+                    ("device",),
+                    collect=lambda: self._device_counts("cancelled"),
+                )
+            )
+            self.registry.register(
+                Counter(
+                    "mediackb_device_superseded_total",
+                    "Power requests joined to a change in flight for the same state",
+                    ("device",),
+                    collect=lambda: self._device_counts("superseded"),
+                )
+            )
+        self._devices.append((room, devices))
+
+    def track_restarts(self, supervisor: Supervisor):
+        """Expose subsystem restart counters"""
+        self.registry.register(
+            Counter(
+                "mediackb_subsystem_restarts_total",
+                "Subsystem restarts after failures",
+                ("subsystem",),
+                collect=lambda: (
+                    ((name,), count) for name, count in supervisor.restarts.items()
+                ),
+            )
+        )
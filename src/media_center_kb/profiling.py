@@ -0,0 +1,143 @@
+"""
+On-demand diagnostics of the running daemon:
+SIGUSR1 toggles cProfile capture of the event loop thread,
+SIGUSR2 writes tracemalloc top allocations. Allocations are traced from startup
+with --trace-memory (or PYTHONTRACEMALLOC=1), tracing costs memory and CPU so it is off
+by default.
+
+Files are written to a directory and only the newest ones of each kind are kept:
+
+    python3 -m pstats /tmp/mediackb/profile-20240101-120000.prof
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from typing import List, Optional
+
+logger = logging.getLogger("prf")
+
+PROFILE_PREFIX = "profile-"
+MEMORY_PREFIX = "memory-"
+
+
+class Profiler:
+    """cProfile and tracemalloc captures written to rotated files"""
+
+    def __init__(
+        self, directory: str, keep: int = 5, top: int = 25, trace_memory: bool = False
+    ):
+        """trace_memory: start tracing allocations now if not traced yet"""
+        self._directory = directory
+        self._keep = keep
+        self._top = top
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def profiling(self) -> bool:
+        """cProfile capture is on"""
+        return self._profile is not None
+
+    def _path(self, prefix: str, suffix: str) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self._directory, f"{prefix}{stamp}{suffix}")
+        # several captures within a second
+        idx = 1
+        while os.path.exists(path):
+            path = os.path.join(self._directory, f"{prefix}{stamp}.{idx}{suffix}")
+            idx += 1
+        return path
+
+    def _rotate(self, prefix: str, suffix: str):
+        files = sorted(
+            (
+                entry
+                for entry in os.scandir(self._directory)
+                if entry.name.startswith(prefix) and entry.name.endswith(suffix)
+            ),
+            key=lambda entry: entry.stat().st_mtime_ns,
+        )
+        for entry in files[: max(len(files) - self._keep, 0)]:
+            os.unlink(entry.path)
+
+    def files(self) -> List[str]:
+        """Written capture files"""
+        if not os.path.isdir(self._directory):
+            return []
+        return sorted(
+            entry.path
+            for entry in os.scandir(self._directory)
+            if entry.name.startswith((PROFILE_PREFIX, MEMORY_PREFIX))
+        )
+
+    def toggle_profile(self) -> Optional[cProfile.Profile]:
+        """Start capture or stop it, returns the stopped capture for write_profile.
+        Profiles the calling thread only, call from the event loop thread"""
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            logger.info("profiling started")
+            return None
+
+        profile, self._profile = self._profile, None
+        profile.disable()
+        return profile
+
+    def write_profile(self, profile: cProfile.Profile) -> str:
+        """Write stats and text summary of a stopped capture, returns the stats file.
+        Takes a while, meant for a worker thread"""
+        path = self._path(PROFILE_PREFIX, ".prof")
+        profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(
+            self._top
+        )
+        with open(path[: -len(".prof")] + ".txt", "w", encoding="utf-8") as out:
+            out.write(summary.getvalue())
+
+        self._rotate(PROFILE_PREFIX, ".prof")
+        self._rotate(PROFILE_PREFIX, ".txt")
+        logger.info("profiling stopped, stats written to %s", path)
+        return path
+
+    def memory_snapshot(self) -> Optional[str]:
+        """Write top allocations and growth since the previous snapshot,
+        returns the written file, None if allocations are not traced"""
+        if not tracemalloc.is_tracing():
+            logger.warning(
+                "allocations are not traced, start with --trace-memory "
+                "or PYTHONTRACEMALLOC=1"
+            )
+            return None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced: {current / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB", ""]
+        lines.append(f"top {self._top} by size:")
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[: self._top])
+        if self._snapshot is not None:
+            lines.append("")
+            lines.append(f"top {self._top} growth since previous snapshot:")
+            lines.extend(
+                str(stat)
+                for stat in snapshot.compare_to(self._snapshot, "lineno")[: self._top]
+            )
+        self._snapshot = snapshot
+
+        path = self._path(MEMORY_PREFIX, ".txt")
+        with open(path, "w", encoding="utf-8") as out:
+            out.write("\n".join(lines) + "\n")
+        self._rotate(MEMORY_PREFIX, ".txt")
+        logger.info("memory snapshot written to %s", path)
+        return path
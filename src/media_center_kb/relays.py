@@ -1,12 +1,16 @@
 """
 Relays related functionality:
  - Relays abstraction
+ - Relay leases: a relay shared by several devices is switched on by the first
+   device acquiring it and off when the last one releases it
 """
 
 from abc import ABC, abstractmethod
 from enum import Enum
 from types import SimpleNamespace
+from typing import Dict, FrozenSet, Optional, Protocol, Sequence, Set
 
+from media_center_kb.events import EventBus, RelayToggled
 from media_center_kb.gpio import GPioIf
 
 
@@ -17,16 +21,8 @@ class _RelayPins(Enum):
     RELAY4_PIN = 26
 
 
-_PIN_TO_RELAY = {
-    _RelayPins.RELAY1_PIN.value: 1,
-    _RelayPins.RELAY2_PIN.value: 2,
-    _RelayPins.RELAY3_PIN.value: 3,
-    _RelayPins.RELAY4_PIN.value: 4,
-}
-
-_RELAYS_TO_PIN = {v: k for k, v in _PIN_TO_RELAY.items()}
-
-Pins = _PIN_TO_RELAY.keys()
+# GPIO pin of relay 1, 2, ...
+Pins = tuple(pin.value for pin in _RelayPins)
 
 
 class RelayIf(ABC):
@@ -56,6 +52,44 @@ class RelayModuleIf(ABC):
     def relay(self, relay: int) -> RelayIf:
         """Return a specific relay"""
 
+    @abstractmethod
+    def acquire(self, relay: int, owner: str) -> bool:
+        """Hold relay for owner, True if it was switched on"""
+
+    @abstractmethod
+    def release(self, relay: int, owner: str) -> bool:
+        """Drop owner's hold, True if the relay was switched off"""
+
+    @abstractmethod
+    def holders(self, relay: int) -> FrozenSet[str]:
+        """Owners holding the relay"""
+
+    def lease(self, relay: int, owner: str) -> "RelayLease":
+        """Return the relay as seen by owner"""
+        return RelayLease(self, relay, owner)
+
+
+class RelayLease(RelayIf):
+    """Relay held by one owner, on() acquires and off() releases it"""
+
+    def __init__(self, module: RelayModuleIf, relay: int, owner: str):
+        self._module = module
+        self._relay = relay
+        self._owner = owner
+
+    def on(self):  # pylint: disable=invalid-name
+        self._module.acquire(self._relay, self._owner)
+
+    def off(self):
+        self._module.release(self._relay, self._owner)
+
+    def enabled(self) -> bool:
+        return self._module.relay(self._relay).enabled()
+
+    def shared(self) -> bool:
+        """Someone else holds the relay"""
+        return bool(self._module.holders(self._relay) - {self._owner})
+
 
 def _wrap(method, *args):
     """helper that wraps method"""
@@ -66,7 +100,7 @@ def _wrap(method, *args):
     return inner
 
 
-class Logger(ABC):
+class Logger(Protocol):
     """Logger interface to make mypy happier"""
 
     def debug(self, msg, *args, **kwargs):
@@ -83,27 +117,77 @@ class Logger(ABC):
 class RelayModule(RelayModuleIf):
     """Relay module class"""
 
-    def __init__(self, gpio: GPioIf, logger: Logger):
+    def __init__(
+        self,
+        gpio: GPioIf,
+        logger: Logger,
+        pins: Optional[Sequence[int]] = None,
+        bus: Optional[EventBus] = None,
+    ):
+        """
+        pins: GPIO pin of relay 1, 2, ... default is the 4 relay board
+        bus: RelayToggled is published on every actual GPIO switch
+        """
         self._gpio: GPioIf = gpio
         self._logger = logger
+        self.bus = bus
+        self._relay_to_pin = dict(enumerate(Pins if pins is None else pins, 1))
+        self._pin_to_relay = {v: k for k, v in self._relay_to_pin.items()}
+        # relay number -> number of actual GPIO switches
+        self.toggles = {relay: 0 for relay in self._relay_to_pin}
+        # relay number -> owners holding it on
+        self._holders: Dict[int, Set[str]] = {
+            relay: set() for relay in self._relay_to_pin
+        }
         self.reset()
 
     def reset(self):
-        """Switch off all relays"""
-        for pin in _PIN_TO_RELAY:
+        """Switch off all relays and drop all holds"""
+        for holders in self._holders.values():
+            holders.clear()
+        for pin in self._pin_to_relay:
             self._relay_off(pin)
 
+    def acquire(self, relay: int, owner: str) -> bool:
+        holders = self._holders[relay]
+        first = not holders
+        holders.add(owner)
+        if first:
+            self.relay(relay).on()
+        return first
+
+    def release(self, relay: int, owner: str) -> bool:
+        holders = self._holders[relay]
+        if owner not in holders:
+            return False
+        holders.discard(owner)
+        if holders:
+            self._logger.debug("relay %d kept on for %s", relay, ", ".join(holders))
+            return False
+        self.relay(relay).off()
+        return True
+
+    def holders(self, relay: int) -> FrozenSet[str]:
+        return frozenset(self._holders[relay])
+
+    def _toggled(self, pin: int, on: bool):  # pylint: disable=invalid-name
+        relay = self._pin_to_relay[pin]
+        self.toggles[relay] += 1
+        self._logger.debug("relay %d (%d) %s", relay, pin, "on" if on else "off")
+        if self.bus is not None:
+            self.bus.publish(RelayToggled(relay, on))
+
     def _relay_on(self, pin: int):
         state = self._gpio.input(pin)
         if not state:
             self._gpio.output(pin, self._gpio.HIGH)
-            self._logger.debug("relay %d (%d) on", _PIN_TO_RELAY[pin], pin)
+            self._toggled(pin, True)
 
     def _relay_off(self, pin: int):
         state = self._gpio.input(pin)
         if state:
             self._gpio.output(pin, self._gpio.LOW)
-            self._logger.debug("relay %d (%d) off", _PIN_TO_RELAY[pin], pin)
+            self._toggled(pin, False)
 
     def _get_state(self, pin: int) -> bool:
         state = self._gpio.input(pin)
@@ -111,10 +195,11 @@ class RelayModule(RelayModuleIf):
 
     def relay(self, relay: int) -> RelayIf:
         """Return a simplenamespace object with on/off methods for specific relay"""
+        pin = self._relay_to_pin[relay]
         return SimpleNamespace(  # type: ignore[return-value]
             **{
-                "on": _wrap(self._relay_on, _RELAYS_TO_PIN[relay]),
-                "off": _wrap(self._relay_off, _RELAYS_TO_PIN[relay]),
-                "enabled": _wrap(self._get_state, _RELAYS_TO_PIN[relay]),
+                "on": _wrap(self._relay_on, pin),
+                "off": _wrap(self._relay_off, pin),
+                "enabled": _wrap(self._get_state, pin),
             }
         )
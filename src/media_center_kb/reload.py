@@ -0,0 +1,116 @@
+"""
+Configuration hot reload on SIGHUP.
+
+Configuration is re-read and validated first, then only changed parts are swapped:
+the keymap table in place, HA/MQTT entities by restarting the HA subsystem.
+Controller, devices and relays are kept as is so they do not lose their state,
+changes to relays, devices and scenes take effect on restart.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, Mapping, Optional, Set
+
+from media_center_kb.config import load_config
+from media_center_kb.control import Controller
+from media_center_kb.supervisor import CoroFactory, Supervisor
+
+logger = logging.getLogger("cfg")
+
+
+def read_json(path: str) -> Any:
+    """Read JSON file"""
+    with open(path, "rt", encoding="utf8") as json_file:
+        return json.load(json_file)
+
+
+def load_keymap(
+    config_path: Optional[str], room: Optional[str] = None
+) -> Dict[str, str]:
+    """Key code to command name mapping of the room from the config file, default if no file.
+    The whole file is validated, only the keymap is applied on reload
+    """
+    return dict(load_config(config_path, room).keymap)
+
+
+def load_mqtt(mqtt_path: Optional[str]) -> Optional[Dict[str, Any]]:
+    """MQTT settings"""
+    if not mqtt_path:
+        return None
+    settings = read_json(mqtt_path)
+    if not isinstance(settings, dict):
+        raise ValueError(f"{mqtt_path}: MQTT settings must be an object")
+    return settings
+
+
+class Reloader:  # pylint: disable=too-many-instance-attributes
+    """Re-reads configuration and applies the difference"""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        controller: Controller,
+        supervisor: Supervisor,
+        config_path: Optional[str],
+        mqtt_path: Optional[str],
+        ha_factory: Optional[Callable[[Dict[str, Any]], CoroFactory]],
+        room: str = "",
+    ):
+        """
+        ha_factory: builds HA subsystem for MQTT settings, None if HA disabled
+            or reloaded by another room, the subsystem is shared by rooms
+        room: room of the controller in the config file
+        """
+        self._controller = controller
+        self._supervisor = supervisor
+        self._config_path = config_path
+        self._mqtt_path = mqtt_path
+        self._ha_factory = ha_factory
+
+        self._room = room
+        self._keymap: Mapping[str, str] = load_keymap(config_path, room or None)
+        self._mqtt = load_mqtt(mqtt_path)
+        self._tasks: Set[asyncio.Task] = set()
+        # the table used by the keyboard loop, updated in place
+        self.kb_handlers = controller.kb_handlers(self._keymap)
+
+    @property
+    def keymap(self) -> Mapping[str, str]:
+        """Current keymap"""
+        return self._keymap
+
+    @property
+    def mqtt_settings(self) -> Optional[Dict[str, Any]]:
+        """Current MQTT settings"""
+        return self._mqtt
+
+    def schedule(self):
+        """Signal handler: start reload in a task"""
+        task = asyncio.get_running_loop().create_task(self.reload())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def reload(self):
+        """Re-read configuration, keep current one on errors"""
+        logger.info("reloading configuration")
+        try:
+            keymap = load_keymap(self._config_path, self._room or None)
+            handlers = self._controller.kb_handlers(keymap)
+            mqtt = load_mqtt(self._mqtt_path)
+        except (OSError, ValueError) as ex:
+            logger.error("reload failed, keeping current configuration: %s", ex)
+            return
+
+        if keymap != self._keymap:
+            # no awaits here: the keyboard loop never sees a partial table
+            self.kb_handlers.clear()
+            self.kb_handlers.update(handlers)
+            self._keymap = keymap
+            logger.info("keymap updated")
+
+        if mqtt != self._mqtt and self._ha_factory:
+            self._mqtt = mqtt
+            await self._supervisor.restart(
+                "ha", self._ha_factory(mqtt) if mqtt else None
+            )
+            logger.info("MQTT settings updated")
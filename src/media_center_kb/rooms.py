@@ -0,0 +1,49 @@
+"""
+Several rooms served by one daemon.
+
+Every room has its own relay board, soundbar and keypad driven by its own Controller,
+the control API, timers, metrics and the HA integration are shared. They see the rooms
+as one controller with commands and state prefixed with the room name: "bedroom/tv_on".
+The board power off switches every room off first.
+"""
+
+import asyncio
+from typing import Dict, Mapping, Union
+
+from media_center_kb.config import scoped
+from media_center_kb.control import AsyncCommand, Controller, runner
+
+
+class Rooms:
+    """Controllers of all rooms as one"""
+
+    def __init__(self, controllers: Mapping[str, Controller]):
+        self.controllers = dict(controllers)
+
+    def async_commands_map(self) -> Dict[str, AsyncCommand]:
+        """Commands of every room"""
+        return {
+            scoped(room, name): command
+            for room, controller in self.controllers.items()
+            for name, command in controller.async_commands_map().items()
+        }
+
+    async def power_off(self):
+        """Switch every room off, then power off the board once"""
+        *others, last = self.controllers.values()
+        await asyncio.gather(
+            *(controller.async_commands_map()["off"]() for controller in others)
+        )
+        await last.async_commands_map()["shutdown"]()
+
+    def shutdown(self):
+        """Power off the board from sync code"""
+        return runner(self.power_off())
+
+    def state(self) -> Dict[str, Union[bool, int]]:
+        """Devices state of every room"""
+        return {
+            scoped(room, name): value
+            for room, controller in self.controllers.items()
+            for name, value in controller.state().items()
+        }
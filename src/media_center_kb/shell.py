@@ -0,0 +1,147 @@
+"""
+Allow-listed shell commands run as asyncio subprocesses
+so that a slow or hanging command does not block input handling
+"""
+
+import asyncio
+import logging
+import shlex
+import subprocess
+from typing import Iterable, NamedTuple, Optional, Set
+
+logger = logging.getLogger("shl")
+
+POWEROFF = "sudo poweroff"
+
+
+class ShellResult(NamedTuple):
+    """Finished command outcome, returncode is None if it was killed on timeout"""
+
+    cmd: str
+    returncode: Optional[int]
+    stdout: str
+    stderr: str
+
+    @property
+    def ok(self) -> bool:  # pylint: disable=invalid-name
+        """Command exited with zero code"""
+        return self.returncode == 0
+
+
+class RestrictedShell:
+    """Callable shell cmd"""
+
+    _allowed_cmds: Iterable[str] = frozenset(
+        [
+            POWEROFF,
+        ]
+    )
+
+    def __init__(self, allowed_cmds: Optional[Iterable[str]] = None, timeout=30.0):
+        if allowed_cmds is not None:
+            self._allowed_cmds = allowed_cmds
+        self._timeout = timeout
+        # strong references to commands started with __call__
+        self._tasks: Set[asyncio.Task] = set()
+
+    def allowed(self, cmd: str) -> bool:
+        """Check the command is in the allow-list"""
+        return cmd in self._allowed_cmds
+
+    async def run(self, cmd: str, timeout: Optional[float] = None) -> ShellResult:
+        """Run allowed command, capture output, kill it on timeout"""
+        if not self.allowed(cmd):
+            raise PermissionError(f"command not allowed: {cmd}")
+        if timeout is None:
+            timeout = self._timeout
+
+        logger.info("system: %s", cmd)
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(cmd),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("system: %s timed out after %.1fs, killing", cmd, timeout)
+            proc.kill()
+            stdout, stderr = await proc.communicate()
+            returncode = None
+        else:
+            returncode = proc.returncode
+
+        result = ShellResult(
+            cmd,
+            returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+        )
+        self._log_result(result)
+        return result
+
+    def run_sync(self, cmd: str, timeout: Optional[float] = None) -> ShellResult:
+        """Blocking version for use outside of the event loop"""
+        if not self.allowed(cmd):
+            raise PermissionError(f"command not allowed: {cmd}")
+        if timeout is None:
+            timeout = self._timeout
+        logger.info("system: %s", cmd)
+        try:
+            proc = subprocess.run(
+                shlex.split(cmd),
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                timeout=timeout,
+                check=False,
+            )
+            result = ShellResult(
+                cmd,
+                proc.returncode,
+                proc.stdout.decode(errors="replace"),
+                proc.stderr.decode(errors="replace"),
+            )
+        except subprocess.TimeoutExpired as ex:
+            logger.error("system: %s timed out after %.1fs, killed", cmd, timeout)
+            result = ShellResult(
+                cmd,
+                None,
+                (ex.stdout or b"").decode(errors="replace"),
+                (ex.stderr or b"").decode(errors="replace"),
+            )
+        self._log_result(result)
+        return result
+
+    @staticmethod
+    def _log_result(result: ShellResult):
+        if result.returncode is not None and not result.ok:
+            logger.error(
+                "system: %s exited with %d: %s",
+                result.cmd,
+                result.returncode,
+                result.stderr.strip(),
+            )
+        logger.debug("system: %s output: %s", result.cmd, result.stdout.strip())
+
+    def __call__(self, cmd: str):
+        """Start the command without waiting for it.
+        Runs in background on the event loop if there is one, blocks otherwise"""
+        if not self.allowed(cmd):
+            logger.warning("system: %s is not allowed", cmd)
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.run_sync(cmd)
+            return
+
+        task = loop.create_task(self.run(cmd))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and (ex := task.exception()) is not None:
+            logger.error("system: command failed: %r", ex)
@@ -0,0 +1,71 @@
+"""
+Startup time accounting: where the time goes between process start
+and the moment the daemon is ready to handle the first key press
+"""
+
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("stp")
+
+
+def process_age() -> Optional[float]:
+    """Seconds since the current process was started (Linux only)"""
+    try:
+        with open("/proc/self/stat", "rt", encoding="ascii") as stat_file:
+            # comm field may contain spaces, fields after it are fixed
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "rt", encoding="ascii") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    # starttime is field 22 overall, 20th after the comm field
+    started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    return max(uptime - started, 0.0)
+
+
+class StartupProfile:
+    """Records named startup phases relative to the process start"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        now = time.monotonic()
+        age = process_age()
+        self._origin = now - age if age is not None else now
+        self._last = self._origin
+        self._phases: List[Tuple[str, float]] = []
+        self._reported = False
+        self.mark("interpreter")
+
+    def mark(self, phase: str):
+        """Close the current phase under the given name"""
+        now = time.monotonic()
+        self._phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def phases(self) -> List[Tuple[str, float]]:
+        """Recorded (phase, duration in seconds) pairs"""
+        return list(self._phases)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from the process start to the last mark"""
+        return self._last - self._origin
+
+    def report(self, final: str = "ready"):
+        """Mark the final phase and log the report once"""
+        if self._reported:
+            return
+        self._reported = True
+        self.mark(final)
+        if not self.enabled:
+            return
+
+        logger.info("startup profile (ms):")
+        total = 0.0
+        for phase, duration in self._phases:
+            total += duration
+            logger.info("  %-20s %8.1f %8.1f", phase, duration * 1000.0, total * 1000.0)
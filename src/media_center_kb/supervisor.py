@@ -0,0 +1,114 @@
+"""
+Subsystems supervisor: runs keyboard, serial, HA, etc coroutines
+and restarts each of them independently on failure
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("sup")
+
+CoroFactory = Callable[[], Awaitable]
+
+
+class Supervisor:  # pylint: disable=too-many-instance-attributes
+    """Runs named coroutines, restarts failed ones with exponential backoff"""
+
+    def __init__(
+        self,
+        initial_delay: float = 1.0,
+        max_delay: float = 60.0,
+        stable_after: float = 60.0,
+    ):
+        """
+        initial_delay: delay before the first restart
+        max_delay: restart delay upper bound
+        stable_after: running that long resets delay back to initial_delay
+        """
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._stable_after = stable_after
+
+        self._factories: Dict[str, CoroFactory] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._changed = asyncio.Event()
+        self._running = False
+        self.restarts: Dict[str, int] = {}
+
+    def add(self, name: str, factory: CoroFactory):
+        """Add a subsystem. factory is called on every (re)start to get a new coroutine"""
+        if name in self._factories:
+            raise ValueError(f"subsystem already exists: {name}")
+        self._factories[name] = factory
+        self.restarts[name] = 0
+        if self._running:
+            self._start(name)
+
+    async def restart(self, name: str, factory: Optional[CoroFactory]):
+        """Stop a subsystem and start it again with a new factory.
+        No factory just stops it, unknown name is added"""
+        task = self._tasks.pop(name, None)
+        if task:
+            task.cancel()
+
+        # replacement is started before awaiting the old one so run() always sees it
+        if factory is None:
+            self._factories.pop(name, None)
+            logger.info("%s stopped", name)
+        else:
+            self._factories[name] = factory
+            self.restarts.setdefault(name, 0)
+            if self._running:
+                self._start(name)
+            logger.info("%s restarted", name)
+
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _start(self, name: str):
+        self._tasks[name] = asyncio.create_task(self._supervise(name), name=name)
+        self._changed.set()
+
+    async def _supervise(self, name: str):
+        loop = asyncio.get_running_loop()
+        delay = self._initial_delay
+        while True:
+            started = loop.time()
+            try:
+                await self._factories[name]()
+                logger.info("%s finished", name)
+                return
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                if loop.time() - started >= self._stable_after:
+                    delay = self._initial_delay
+                self.restarts[name] += 1
+                logger.error(
+                    "%s failed: %r, restart #%d in %.1fs",
+                    name,
+                    ex,
+                    self.restarts[name],
+                    delay,
+                    exc_info=ex,
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._max_delay)
+
+    async def run(self):
+        """Run all subsystems until all of them finished or cancelled"""
+        self._running = True
+        for name in self._factories:
+            self._start(name)
+        try:
+            while pending := [task for task in self._tasks.values() if not task.done()]:
+                self._changed.clear()
+                changed = asyncio.create_task(self._changed.wait())
+                await asyncio.wait(
+                    pending + [changed], return_when=asyncio.FIRST_COMPLETED
+                )
+                changed.cancel()
+        finally:
+            self._running = False
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
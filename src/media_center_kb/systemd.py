@@ -0,0 +1,65 @@
+"""
+Minimal sd_notify(3) client: readiness and watchdog notifications
+over the NOTIFY_SOCKET datagram socket, no libsystemd needed
+"""
+
+import logging
+import os
+import socket
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger("sdn")
+
+
+def notify(state: str) -> bool:
+    """Send state like READY=1 or WATCHDOG=1, False if not run by systemd"""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address[0] == "@":
+        # abstract namespace socket
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+    except OSError as ex:
+        logger.error("sd_notify %s failed: %s", state, ex)
+        return False
+    return True
+
+
+def watchdog_interval() -> Optional[float]:
+    """WatchdogSec of the service in seconds if the watchdog is enabled for this process"""
+    usec = os.environ.get("WATCHDOG_USEC")
+    pid = os.environ.get("WATCHDOG_PID")
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1e6
+
+
+class WatchdogPinger:  # pylint: disable=too-few-public-methods
+    """Loop lag sampler callback sending WATCHDOG=1 only while the loop is responsive.
+    Pings twice per watchdog interval as sd_watchdog_enabled(3) recommends"""
+
+    def __init__(
+        self,
+        interval: float,
+        max_lag: float,
+        send: Callable[[str], bool] = notify,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._period = interval / 2
+        self._max_lag = max_lag
+        self._send = send
+        self._clock = clock
+        self._last_ping: Optional[float] = None
+
+    def __call__(self, lag: float):
+        if lag > self._max_lag:
+            return
+        now = self._clock()
+        if self._last_ping is None or now - self._last_ping >= self._period:
+            self._send("WATCHDOG=1")
+            self._last_ping = now
@@ -0,0 +1,304 @@
+"""
+Sleep timers and daily schedules.
+
+All timers are kept in one heap ordered by due time, a single loop.call_at handle
+is armed for the earliest one: waiting timers cost no tasks. Due times are wall
+clock, which jumps when NTP syncs after boot on a Pi without RTC, so the handle
+wakes up at least every MAX_WAIT seconds to compare with the clock again.
+A due timer runs its command through the controller command table like a key press,
+a daily timer is then pushed back for the next day.
+
+Timers are saved to a JSON file on every change and loaded on start. While running
+the file is written by the default executor, not to stall the loop on SD card I/O,
+changes made meanwhile are written together once the write is done. One-shot timers
+that became due while the daemon was down run right away, daily ones skip to their
+next time. Used from the event loop only.
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence
+
+logger = logging.getLogger("tmr")
+
+# due timers are run when the loop wakes up slightly early
+TOLERANCE = 0.01
+# longest loop timer, the wall clock is checked again after it
+MAX_WAIT = 60.0
+
+
+def parse_daily(daily: str) -> datetime.time:
+    """HH:MM local time"""
+    try:
+        return datetime.datetime.strptime(daily, "%H:%M").time()
+    except ValueError as ex:
+        raise ValueError(f"daily time must be HH:MM: {daily}") from ex
+
+
+def next_daily(daily: str, now: float) -> float:
+    """Next HH:MM local time after now, epoch seconds"""
+    today = datetime.datetime.fromtimestamp(now)
+    due = datetime.datetime.combine(today.date(), parse_daily(daily))
+    if due.timestamp() <= now:
+        due = datetime.datetime.combine(
+            today.date() + datetime.timedelta(days=1), due.time()
+        )
+    return due.timestamp()
+
+
+class _Timer:  # pylint: disable=too-few-public-methods
+    """Scheduled command"""
+
+    __slots__ = ("due", "seq", "id", "command", "args", "daily", "cancelled")
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        due: float,
+        seq: int,
+        timer_id: int,
+        command: str,
+        args: Sequence[Any],
+        daily: Optional[str],
+    ):
+        self.due = due
+        self.seq = seq
+        self.id = timer_id  # pylint: disable=invalid-name
+        self.command = command
+        self.args = tuple(args)
+        self.daily = daily
+        self.cancelled = False
+
+    def __lt__(self, other: "_Timer") -> bool:
+        return (self.due, self.seq) < (other.due, other.seq)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Saved and reported form"""
+        return {
+            "id": self.id,
+            "cmd": self.command,
+            "args": list(self.args),
+            "due": self.due,
+            "daily": self.daily,
+        }
+
+
+class TimerService:  # pylint: disable=too-many-instance-attributes
+    """Heap of timers under one event loop timer handle"""
+
+    def __init__(
+        self,
+        commands: Mapping[str, Callable[..., Awaitable[Any]]],
+        path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        commands: controller command table timers run commands from
+        path: JSON file timers are kept in, not saved if None
+        clock: wall clock, epoch seconds
+        """
+        self._commands = commands
+        self._path = path
+        self._clock = clock
+        self._heap: List[_Timer] = []
+        self._timers: Dict[int, _Timer] = {}
+        self._seq = itertools.count()
+        self._next_id = 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        # commands started by timers, kept until done
+        self._running: set = set()
+        # latest state not written yet and the write in progress
+        self._unsaved: Optional[Dict[str, Any]] = None
+        self._writer: Optional[asyncio.Task] = None
+        self.fired = 0
+        self.saves = 0
+        if path:
+            self._load(path)
+
+    def _push(self, timer: _Timer):
+        self._timers[timer.id] = timer
+        heapq.heappush(self._heap, timer)
+
+    def add(
+        self,
+        command: str,
+        args: Sequence[Any] = (),
+        delay: Optional[float] = None,
+        daily: Optional[str] = None,
+    ) -> int:
+        """Run command once in delay seconds or every day at HH:MM, returns timer id.
+        Raises ValueError for unknown commands and bad times
+        """
+        if command not in self._commands:
+            raise ValueError(f"unknown command: {command}")
+        if (delay is None) == (daily is None):
+            raise ValueError("timer needs either a delay or a daily time")
+        if delay is not None:
+            if not isinstance(delay, (int, float)) or delay < 0:
+                raise ValueError("delay must be a positive number of seconds")
+            due = self._clock() + delay
+        else:
+            due = next_daily(str(daily), self._clock())
+        timer = _Timer(due, next(self._seq), self._next_id, command, args, daily)
+        self._next_id += 1
+        self._push(timer)
+        logger.info("timer %d: %s at %s", timer.id, command, time.ctime(due))
+        self._changed()
+        return timer.id
+
+    def cancel(self, timer_id: int) -> bool:
+        """Cancel a timer, False if there is no such timer"""
+        timer = self._timers.pop(timer_id, None)
+        if timer is None:
+            return False
+        # removed from the heap lazily
+        timer.cancelled = True
+        self._changed()
+        return True
+
+    def timers(self) -> List[Dict[str, Any]]:
+        """Pending timers, earliest first"""
+        return [timer.as_dict() for timer in sorted(self._timers.values())]
+
+    def _changed(self):
+        self._save()
+        self._arm()
+
+    def _arm(self):
+        """Point the single loop timer at the earliest timer"""
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        if self._loop is None:
+            return
+        if not self._heap:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            return
+        delay = min(max(self._heap[0].due - self._clock(), 0), MAX_WAIT)
+        when = self._loop.time() + delay
+        if self._handle is not None:
+            if abs(self._handle.when() - when) < TOLERANCE:
+                return
+            self._handle.cancel()
+        self._handle = self._loop.call_at(when, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        now = self._clock()
+        fired = False
+        while self._heap and self._heap[0].due <= now + TOLERANCE:
+            timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                continue
+            fired = True
+            self._start(timer)
+            if timer.daily is not None:
+                timer.due = next_daily(timer.daily, now)
+                timer.seq = next(self._seq)
+                heapq.heappush(self._heap, timer)
+            else:
+                del self._timers[timer.id]
+        if fired:
+            self._changed()
+        else:
+            # woke up to check the clock, nothing is due yet
+            self._arm()
+
+    def _start(self, timer: _Timer):
+        logger.info("timer %d: %s", timer.id, timer.command)
+        self.fired += 1
+        task = asyncio.ensure_future(self._commands[timer.command](*timer.args))
+        self._running.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Future):
+        self._running.discard(task)
+        if not task.cancelled() and (ex := task.exception()) is not None:
+            logger.error("timer command failed: %s", ex)
+
+    def _load(self, path: str):
+        try:
+            with open(path, "rt", encoding="utf8") as timers_file:
+                saved = json.load(timers_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            logger.error("%s: timers not loaded: %s", path, ex)
+            return
+        now = self._clock()
+        for item in saved.get("timers", []) if isinstance(saved, dict) else []:
+            try:
+                command, daily = item["cmd"], item.get("daily")
+                if command not in self._commands:
+                    raise ValueError(f"unknown command {command}")
+                due = float(item["due"])
+                if daily is not None and due <= now:
+                    due = next_daily(daily, now)
+                timer = _Timer(
+                    due, next(self._seq), int(item["id"]), command, item["args"], daily
+                )
+            except (KeyError, TypeError, ValueError) as ex:
+                logger.error("%s: timer %s dropped: %s", path, item, ex)
+                continue
+            self._push(timer)
+        # ids of cancelled timers are not reused
+        next_id = saved.get("next_id", 1) if isinstance(saved, dict) else 1
+        self._next_id = max(self._timers, default=0) + 1
+        if isinstance(next_id, int):
+            self._next_id = max(self._next_id, next_id)
+
+    def _save(self):
+        if not self._path:
+            return
+        self._unsaved = {"next_id": self._next_id, "timers": self.timers()}
+        if self._loop is None:
+            self._write_unsaved()
+        elif self._writer is None:
+            self._writer = self._loop.create_task(self._write_batches())
+
+    def _write_unsaved(self):
+        data, self._unsaved = self._unsaved, None
+        if data is not None:
+            self._write(data)
+
+    async def _write_batches(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while (data := self._unsaved) is not None:
+                self._unsaved = None
+                await loop.run_in_executor(None, self._write, data)
+        finally:
+            self._writer = None
+
+    def _write(self, data: Dict[str, Any]):
+        assert self._path is not None
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "wt", encoding="utf8") as timers_file:
+                json.dump(data, timers_file)
+            os.replace(tmp_path, self._path)
+            self.saves += 1
+        except OSError as ex:
+            logger.error("%s: timers not saved: %s", self._path, ex)
+
+    async def run(self):
+        """Fire timers until cancelled"""
+        self._loop = asyncio.get_running_loop()
+        self._arm()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            if self._writer is not None:
+                await asyncio.gather(self._writer, return_exceptions=True)
+            self._loop = None
+            self._write_unsaved()
@@ -0,0 +1,194 @@
+"""
+Input event traces: record raw evdev events from the keypad and replay them
+into the keyboard dispatcher to reproduce real usage under load.
+
+    mediackb record -o evening.trace
+    mediackb replay evening.trace --speed 4
+
+Trace format: b"MCKT" magic, version byte, then 12 byte little-endian records:
+microseconds since the previous event (u32), type (u16), code (u16), value (s32).
+
+Replay runs the controller on no-op hardware, blocking waits like the soundbar
+graceful power off are kept, and reports how late each key press was handled
+compared to its place in the trace.
+"""
+
+import argparse
+import asyncio
+import logging
+import struct
+import time
+from typing import (
+    BinaryIO,
+    Callable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from evdev import InputDevice, InputEvent
+
+from media_center_kb.bench import LatencyStats, make_controller, when_done
+from media_center_kb.config import load_config
+from media_center_kb.kb import dispatch_events
+
+logger = logging.getLogger("trc")
+
+MAGIC = b"MCKT"
+VERSION = 1
+_RECORD = struct.Struct("<IHHi")
+_MAX_DELTA_US = 0xFFFFFFFF
+
+# delay since the previous event in seconds, type, code, value
+TraceRecord = Tuple[float, int, int, int]
+
+
+class TraceWriter:  # pylint: disable=too-few-public-methods
+    """Writes events to a trace file"""
+
+    def __init__(self, out: BinaryIO):
+        self._out = out
+        self._last: Optional[float] = None
+        self.count = 0
+        out.write(MAGIC + bytes([VERSION]))
+
+    def write(self, evt: InputEvent):
+        """Append an event, delay is taken from the event timestamp"""
+        stamp = evt.timestamp()
+        delta = 0 if self._last is None else max(stamp - self._last, 0.0)
+        self._last = stamp
+        self._out.write(
+            _RECORD.pack(
+                min(round(delta * 1e6), _MAX_DELTA_US), evt.type, evt.code, evt.value
+            )
+        )
+        self.count += 1
+
+
+def read_trace(inp: BinaryIO) -> Iterator[TraceRecord]:
+    """Records of a trace file"""
+    header = inp.read(len(MAGIC) + 1)
+    if header[: len(MAGIC)] != MAGIC:
+        raise ValueError("not an input event trace")
+    if header[len(MAGIC)] != VERSION:
+        raise ValueError(f"unsupported trace version {header[len(MAGIC)]}")
+    while chunk := inp.read(_RECORD.size):
+        if len(chunk) != _RECORD.size:
+            raise ValueError("truncated trace")
+        delta_us, evt_type, code, value = _RECORD.unpack(chunk)
+        yield delta_us / 1e6, evt_type, code, value
+
+
+async def record(device: str, out: BinaryIO, duration: Optional[float] = None) -> int:
+    """Record raw events from the device until cancelled or duration passed"""
+    keypad = InputDevice(device)
+    writer = TraceWriter(out)
+    logger.info("recording %s, Ctrl+C to stop", device)
+
+    async def read():
+        async for evt in keypad.async_read_loop():
+            writer.write(evt)
+
+    try:
+        await asyncio.wait_for(read(), duration)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+    finally:
+        keypad.close()
+        out.flush()
+    logger.info("recorded %d events", writer.count)
+    return writer.count
+
+
+class TraceSource:  # pylint: disable=too-few-public-methods
+    """Async events iterable replaying trace records with their original timing.
+    speed 2 replays twice as fast, 0 sends events back to back"""
+
+    def __init__(self, records: Sequence[TraceRecord], speed: float = 1.0):
+        self._records = records
+        self._speed = speed
+        # when the event being dispatched was due
+        self.due = 0.0
+
+    async def __aiter__(self):
+        due = time.perf_counter()
+        for delay, evt_type, code, value in self._records:
+            if self._speed > 0:
+                due += delay / self._speed
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            else:
+                due = time.perf_counter()
+            self.due = due
+            sec, usec = divmod(round(time.time() * 1e6), 1_000_000)
+            yield InputEvent(sec, usec, evt_type, code, value)
+
+
+async def replay(
+    records: Sequence[TraceRecord], handlers: Mapping[str, Callable], speed: float
+) -> LatencyStats:
+    """Dispatch trace events, latency is the time from when a key press was due
+    to its handler finishing, so it grows when handlers queue up"""
+    source = TraceSource(records, speed)
+    latencies: List[float] = []
+    tasks: List[asyncio.Future] = []
+
+    def timed(handler: Callable) -> Callable:
+        def inner():
+            due = source.due
+
+            task = when_done(
+                handler(), lambda: latencies.append(time.perf_counter() - due)
+            )
+            if task is not None:
+                tasks.append(task)
+
+        return inner
+
+    started = time.perf_counter()
+    await dispatch_events(source, {key: timed(cmd) for key, cmd in handlers.items()})
+    await asyncio.gather(*tasks)
+    return LatencyStats(latencies, time.perf_counter() - started)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """mediackb record|replay"""
+    parser = argparse.ArgumentParser(prog="mediackb", description="Input event traces")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    rec = sub.add_parser("record", help="Record keypad events")
+    rec.add_argument("-o", "--output", default="keypad.trace", help="Trace file")
+    rec.add_argument("--device", default="/dev/input/keypad", help="Input device")
+    rec.add_argument("--duration", type=float, help="Stop after seconds")
+
+    rep = sub.add_parser("replay", help="Replay trace into the dispatcher")
+    rep.add_argument("trace", help="Trace file")
+    rep.add_argument(
+        "--speed", type=float, default=1.0, help="Speed factor, 0 for no delays"
+    )
+    rep.add_argument(
+        "-c",
+        "--config",
+        dest="config",
+        help="Configuration file with devices and keymap",
+    )
+    args = parser.parse_args(argv)
+
+    if args.mode == "record":
+        with open(args.output, "wb") as out:
+            try:
+                asyncio.run(record(args.device, out, args.duration))
+            except KeyboardInterrupt:
+                pass
+        return
+
+    with open(args.trace, "rb") as inp:
+        records = list(read_trace(inp))
+    handlers = make_controller(load_config(args.config)).kb_handlers()
+    stats = asyncio.run(replay(records, handlers, args.speed))
+    print(f"{len(records)} events, {stats.count} key presses handled")
+    print(stats)
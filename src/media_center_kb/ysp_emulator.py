@@ -0,0 +1,313 @@
+"""
+YSP-4000 soundbar emulator on a pseudo-terminal, to run the daemon with real
+serial I/O on a dev box and measure serial throughput and command round trips.
+
+    python -m media_center_kb.ysp_emulator --baud 9600 --report-interval 5
+    mediackb --no-gpio --no-kb --serial-port /dev/pts/5
+
+    # emulator with an in-process client measuring round trip time
+    python -m media_center_kb.ysp_emulator --probe 200
+
+Framing follows the Yamaha RS-232C protocol: commands are STX (or DC1 for the
+ready command) ... ETX, reports are STX type guard command(2) data(2) ETX.
+Operation codes are not interpreted beyond the small table below, every
+operation command is acknowledged with a report so round trips can be measured.
+Bytes are written and read no faster than the configured baud rate allows
+with 8N1 framing.
+
+The codes follow the Yamaha YSP-4000 RS-232C command list, they are not taken
+from the yamaha-ysp-4000 library. tests/test_ysp_emulator.py runs the installed
+library against the emulator to catch a mismatch with the pinned release.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+import tty
+from typing import Dict, List, Optional, Tuple
+
+from media_center_kb.bench import LatencyStats
+
+logger = logging.getLogger("yse")
+
+STX = 0x02
+ETX = 0x03
+DC1 = 0x11
+DC2 = 0x12
+
+OPERATION = b"07A"
+READY = b"000"
+MODEL_ID = b"YSP40"
+
+# operation code -> report command and data, unknown codes get a generic report
+OPERATION_REPORTS: Dict[bytes, Tuple[bytes, bytes]] = {
+    b"1D": (b"20", b"01"),  # power on
+    b"1E": (b"20", b"00"),  # power off
+    b"1A": (b"26", b"UP"),  # volume up
+    b"1B": (b"26", b"DN"),  # volume down
+}
+GENERIC_REPORT = b"00"
+VOLUME_REPORT = b"26"
+
+# start + 8 data + stop bits
+BITS_PER_BYTE = 10
+
+
+def operation_frame(code: bytes) -> bytes:
+    """Operation command frame"""
+    return bytes([STX]) + OPERATION + code + bytes([ETX])
+
+
+def report_frame(command: bytes, data: bytes) -> bytes:
+    """Report frame: type 0 (response to a command), guard 0"""
+    return bytes([STX]) + b"00" + command + data + bytes([ETX])
+
+
+class FrameParser:  # pylint: disable=too-few-public-methods
+    """Splits a byte stream into frames, bytes outside of frames are dropped"""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Frames completed by data, with the start byte and without ETX"""
+        self._buf.extend(data)
+        frames = []
+        while True:
+            start = next(
+                (i for i, byte in enumerate(self._buf) if byte in (STX, DC1, DC2)),
+                None,
+            )
+            if start is None:
+                self._buf.clear()
+                break
+            end = self._buf.find(ETX, start)
+            if end < 0:
+                del self._buf[:start]
+                break
+            frames.append(bytes(self._buf[start:end]))
+            del self._buf[: end + 1]
+        return frames
+
+
+class SerialLine:
+    """Paces writes to a fd at the baud rate"""
+
+    def __init__(self, fd: int, baud: int):  # pylint: disable=invalid-name
+        self._fd = fd
+        self.byte_time = BITS_PER_BYTE / baud
+        self._free_at = 0.0
+        self.bytes_out = 0
+
+    def wire_time(self, size: int) -> float:
+        """Time to transfer size bytes"""
+        return size * self.byte_time
+
+    async def write(self, data: bytes):
+        """Write data once the line is free and the bytes had time to transfer"""
+        now = time.perf_counter()
+        start = max(now, self._free_at)
+        self._free_at = start + self.wire_time(len(data))
+        await asyncio.sleep(self._free_at - now)
+        os.write(self._fd, data)
+        self.bytes_out += len(data)
+
+
+class YspEmulator:  # pylint: disable=too-many-instance-attributes
+    """Soundbar on the master side of a pty, the daemon opens the slave side"""
+
+    def __init__(self, baud: int = 9600, report_interval: Optional[float] = None):
+        self._baud = baud
+        self._report_interval = report_interval
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self.path = ""
+        self.volume = 40
+        self.power = False
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.reports = 0
+        # command fully received -> report written
+        self.latencies: List[float] = []
+        self._started = 0.0
+        self._line: Optional[SerialLine] = None
+
+    def open(self) -> str:
+        """Create the pty, returns the serial port path for the daemon"""
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.path = os.ttyname(self._slave)
+        self._line = SerialLine(self._master, self._baud)
+        return self.path
+
+    def close(self):
+        """Close the pty"""
+        for fd in (self._master, self._slave):  # pylint: disable=invalid-name
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def _reply(self, frame: bytes) -> Optional[bytes]:
+        kind, body = frame[0], frame[1:]
+        if kind == DC1 and body == READY:
+            # configuration report: model id and status
+            return (
+                bytes([DC2]) + MODEL_ID + (b"1" if self.power else b"0") + bytes([ETX])
+            )
+        if kind == STX and body.startswith(OPERATION):
+            code = body[len(OPERATION) :]
+            command, data = OPERATION_REPORTS.get(code, (GENERIC_REPORT, code))
+            if command == b"20":
+                self.power = data == b"01"
+            elif command == VOLUME_REPORT:
+                self.volume = min(
+                    max(self.volume + (1 if data == b"UP" else -1), 0), 100
+                )
+                data = b"%02X" % self.volume
+            return report_frame(command, data)
+        logger.debug("unknown frame %r", frame)
+        return None
+
+    async def _handle(self, frame: bytes, received: float):
+        assert self._line is not None
+        self.frames_in += 1
+        reply = self._reply(frame)
+        if reply is not None:
+            await self._line.write(reply)
+            self.reports += 1
+            self.latencies.append(time.perf_counter() - received)
+
+    async def _report_state(self):
+        assert self._line is not None and self._report_interval
+        while True:
+            await asyncio.sleep(self._report_interval)
+            await self._line.write(report_frame(VOLUME_REPORT, b"%02X" % self.volume))
+
+    async def serve(self):
+        """Answer commands until cancelled"""
+        if self._master is None:
+            self.open()
+        assert self._master is not None and self._line is not None
+        loop = asyncio.get_running_loop()
+        data_queue: asyncio.Queue = asyncio.Queue()
+        master = self._master
+
+        def on_readable():
+            try:
+                data_queue.put_nowait((os.read(master, 4096), time.perf_counter()))
+            except BlockingIOError:
+                pass
+
+        parser = FrameParser()
+        reporter = (
+            asyncio.create_task(self._report_state()) if self._report_interval else None
+        )
+        loop.add_reader(master, on_readable)
+        self._started = time.perf_counter()
+        line_free_at = 0.0
+        logger.info("YSP-4000 emulator on %s, %d baud", self.path, self._baud)
+        try:
+            while True:
+                data, arrived = await data_queue.get()
+                self.bytes_in += len(data)
+                # pty delivers instantly, bytes are processed as if they came over the wire
+                line_free_at = max(arrived, line_free_at) + self._line.wire_time(
+                    len(data)
+                )
+                wait = line_free_at - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                for frame in parser.feed(data):
+                    await self._handle(frame, line_free_at)
+        finally:
+            loop.remove_reader(master)
+            if reporter:
+                reporter.cancel()
+
+    def summary(self) -> str:
+        """Throughput and command to report latency"""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        bytes_out = self._line.bytes_out if self._line else 0
+        stats = LatencyStats(self.latencies, elapsed)
+        return (
+            f"{self.frames_in} frames in, {self.reports} reports, "
+            f"{self.bytes_in} bytes in, {bytes_out} bytes out in {elapsed:.1f}s\n"
+            f"command -> report {stats}"
+        )
+
+
+async def probe(path: str, count: int, codes: Tuple[bytes, ...] = (b"1A", b"1B")):
+    """Send operation commands one by one and measure round trip time"""
+    fd = os.open(
+        path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK
+    )  # pylint: disable=invalid-name
+    loop = asyncio.get_running_loop()
+    frames: asyncio.Queue = asyncio.Queue()
+    parser = FrameParser()
+
+    def on_readable():
+        for frame in parser.feed(os.read(fd, 4096)):
+            frames.put_nowait(frame)
+
+    loop.add_reader(fd, on_readable)
+    latencies = []
+    started = time.perf_counter()
+    try:
+        for i in range(count):
+            sent = time.perf_counter()
+            os.write(fd, operation_frame(codes[i % len(codes)]))
+            await asyncio.wait_for(frames.get(), 5)
+            latencies.append(time.perf_counter() - sent)
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+    return LatencyStats(latencies, time.perf_counter() - started)
+
+
+async def _run(args: argparse.Namespace):
+    emulator = YspEmulator(args.baud, args.report_interval)
+    print(emulator.open(), flush=True)
+    server = asyncio.create_task(emulator.serve())
+    try:
+        if args.probe:
+            stats = await probe(emulator.path, args.probe)
+            print(f"round trip {stats}")
+        else:
+            await server
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        print(emulator.summary())
+        emulator.close()
+
+
+def main(argv=None):
+    """Run emulator and print the pty path"""
+    parser = argparse.ArgumentParser(description="YSP-4000 emulator on a pty")
+    parser.add_argument("--baud", type=int, default=9600, help="Baud rate")
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        help="Send unsolicited volume reports every SECONDS",
+    )
+    parser.add_argument(
+        "--probe",
+        type=int,
+        metavar="N",
+        help="Send N commands from an in-process client and report round trip time",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
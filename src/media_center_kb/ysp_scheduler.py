@@ -0,0 +1,314 @@
+"""
+Priority scheduling of soundbar serial commands.
+
+The scheduler stands in front of Ysp4000 and has the same command methods.
+Power commands are sent right away, mode changes go ahead of volume changes,
+queued commands made obsolete by a newer one are dropped:
+a newer command for the same setting replaces the queued one,
+power off drops everything queued, absolute volume drops queued volume steps.
+
+Commands can be submitted from any thread (keyboard on the event loop, MQTT
+callbacks on the paho thread), they are sent from the event loop by run().
+Until run() is started commands are sent immediately.
+
+With a circuit breaker the soundbar is expected to report its state after
+every command, a command without a report counts as a failure. When reports
+stop coming for several commands the breaker opens: commands fail fast and
+only the latest one for each setting is kept. The soundbar is probed with the
+ready (status) query, which does not change anything and is answered in any
+power state. Without it the last power command is re-sent (it is idempotent),
+power off if there was none yet as everything is off at startup. Once the
+soundbar reports again the breaker closes and the kept commands are sent.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from media_center_kb.breaker import CircuitBreaker
+
+logger = logging.getLogger("ysq")
+
+PRIORITY_POWER = 0
+PRIORITY_MODE = 1
+PRIORITY_VOLUME = 2
+
+# command -> priority and the setting it changes, a newer command for the setting supersedes
+COMMANDS: Dict[str, Tuple[int, Optional[str]]] = {
+    "power_on": (PRIORITY_POWER, "power"),
+    "power_off": (PRIORITY_POWER, "power"),
+    "set_input_tv": (PRIORITY_MODE, "input"),
+    "set_input_aux1": (PRIORITY_MODE, "input"),
+    "set_5beam": (PRIORITY_MODE, "sound_mode"),
+    "set_stereo": (PRIORITY_MODE, "sound_mode"),
+    "set_dsp_cinema": (PRIORITY_MODE, "dsp"),
+    "set_dsp_off": (PRIORITY_MODE, "dsp"),
+    "set_volume_pct": (PRIORITY_VOLUME, "volume"),
+    "volume_up": (PRIORITY_VOLUME, None),
+    "volume_down": (PRIORITY_VOLUME, None),
+}
+DEFAULT_COMMAND = (PRIORITY_MODE, None)
+POWER_COMMANDS = ("power_on", "power_off")
+# Ysp4000 method sending the ready command, answered with the configuration report
+STATUS_QUERY = "send_ready"
+
+# command name, args, kwargs
+Command = Tuple[str, tuple, dict]
+
+# command -> queued commands it makes obsolete, None for all
+OBSOLETES: Dict[str, Optional[Tuple[str, ...]]] = {
+    "power_off": None,
+    "set_volume_pct": ("volume_up", "volume_down"),
+}
+
+
+class _Entry:  # pylint: disable=too-few-public-methods
+    """Queued command"""
+
+    __slots__ = ("priority", "seq", "name", "args", "kwargs", "dropped")
+
+    def __init__(self, priority: int, seq: int, name: str, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.dropped = False
+
+    def __lt__(self, other: "_Entry") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class YspScheduler:  # pylint: disable=too-many-instance-attributes
+    """Ysp4000 proxy sending commands by priority"""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        ysp: Any,
+        passthrough: Iterable[str] = (),
+        min_interval: float = 0.05,
+        breaker: Optional[CircuitBreaker] = None,
+        response_timeout: float = 2.0,
+        probe_interval: float = 10.0,
+    ):
+        """
+        passthrough: methods that do not send commands and are called directly
+        min_interval: pause after a queued command so a following one can still
+            overtake it, about the time the soundbar takes to accept a command
+        breaker: fail fast when the soundbar does not report back in response_timeout,
+            probe it every probe_interval. Every command is expected to be reported
+        """
+        self._ysp = ysp
+        self._passthrough = frozenset(passthrough)
+        self._min_interval = min_interval
+        self._lock = threading.Lock()
+        self._heap: List[_Entry] = []
+        self._slots: Dict[str, _Entry] = {}
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.dropped = 0
+
+        self._breaker = breaker
+        self._response_timeout = response_timeout
+        self._probe_interval = probe_interval
+        # deadline for a state report after a sent command
+        self._awaiting: Optional[float] = None
+        # latest command per setting while the breaker is open
+        self._deferred: Dict[str, Command] = {}
+        self._power: Optional[str] = None
+        self._status_query = callable(getattr(ysp, STATUS_QUERY, None))
+        self._last_probe = 0.0
+        self.failed_fast = 0
+
+    @property
+    def online(self) -> bool:
+        """Soundbar is considered responsive, commands are sent"""
+        return self._breaker is None or self._breaker.closed
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._ysp, name)
+        if name.startswith("_") or name in self._passthrough or not callable(attr):
+            return attr
+
+        def scheduled(*args, **kwargs):
+            self.submit(name, *args, **kwargs)
+
+        return scheduled
+
+    def pending(self) -> List[str]:
+        """Queued command names in the order they will be sent"""
+        with self._lock:
+            return [entry.name for entry in sorted(self._heap) if not entry.dropped]
+
+    async def drain(self):
+        """Wait until queued commands are sent"""
+        while self._loop is not None and self.pending():
+            await asyncio.sleep(max(self._min_interval, 0.01))
+
+    def _drop(self, entry: _Entry):
+        entry.dropped = True
+        self.dropped += 1
+        logger.debug("dropped obsolete %s", entry.name)
+
+    def _drop_obsolete(self, name: str, slot: Optional[str]):
+        if slot and (queued := self._slots.pop(slot, None)) and not queued.dropped:
+            self._drop(queued)
+        if name in OBSOLETES:
+            names = OBSOLETES[name]
+            for entry in self._heap:
+                if not entry.dropped and (names is None or entry.name in names):
+                    self._drop(entry)
+
+    def submit(self, name: str, *args, **kwargs):
+        """Queue a command, power commands and commands before run() are sent now"""
+        priority, slot = COMMANDS.get(name, DEFAULT_COMMAND)
+        with self._lock:
+            if name in POWER_COMMANDS:
+                self._power = name
+            if not self.online:
+                self._defer(name, slot, args, kwargs)
+                return
+            self._drop_obsolete(name, slot)
+            loop = self._loop
+            immediate = loop is None or priority == PRIORITY_POWER
+            if not immediate:
+                entry = _Entry(priority, next(self._seq), name, args, kwargs)
+                heapq.heappush(self._heap, entry)
+                if slot:
+                    self._slots[slot] = entry
+
+        if immediate:
+            self._send(name, args, kwargs)
+        elif loop is not None and self._wakeup is not None:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _defer(self, name: str, slot: Optional[str], args, kwargs):
+        self.failed_fast += 1
+        logger.debug("soundbar offline, %s not sent", name)
+        if name in OBSOLETES:
+            names = OBSOLETES[name]
+            for key, (deferred, _, _) in list(self._deferred.items()):
+                if names is None or deferred in names:
+                    del self._deferred[key]
+        if slot:
+            self._deferred[slot] = (name, args, kwargs)
+
+    def _pop(self) -> Optional[_Entry]:
+        with self._lock:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                if entry.dropped:
+                    continue
+                for slot, queued in list(self._slots.items()):
+                    if queued is entry:
+                        del self._slots[slot]
+                return entry
+        return None
+
+    def _send(self, name: str, args, kwargs):
+        if self._breaker is not None:
+            with self._lock:
+                if self._awaiting is None:
+                    self._awaiting = time.monotonic() + self._response_timeout
+        try:
+            getattr(self._ysp, name)(*args, **kwargs)
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            logger.error("ysp %s failed: %s", name, ex)
+
+    def _on_report(self, **_):
+        """Soundbar state report, called from the serial reader"""
+        with self._lock:
+            self._awaiting = None
+        if self._breaker is not None and self._breaker.success():
+            loop = self._loop
+            if loop is not None:
+                loop.call_soon_threadsafe(self._resend_deferred)
+
+    def _resend_deferred(self):
+        with self._lock:
+            deferred = sorted(
+                self._deferred.values(),
+                key=lambda cmd: COMMANDS.get(cmd[0], DEFAULT_COMMAND)[0],
+            )
+            self._deferred.clear()
+        for name, args, kwargs in deferred:
+            self.submit(name, *args, **kwargs)
+
+    def _open(self):
+        """Keep queued commands for later"""
+        with self._lock:
+            for entry in sorted(self._heap):
+                if not entry.dropped:
+                    slot = COMMANDS.get(entry.name, DEFAULT_COMMAND)[1]
+                    if slot:
+                        self._deferred[slot] = (entry.name, entry.args, entry.kwargs)
+            self._heap.clear()
+            self._slots.clear()
+
+    def _probe_command(self) -> str:
+        if self._status_query:
+            return STATUS_QUERY
+        return self._power or "power_off"
+
+    def check_health(self, now: Optional[float] = None):
+        """Count a missing report as a failure, probe when the breaker is open"""
+        if self._breaker is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            timed_out = self._awaiting is not None and now > self._awaiting
+            if timed_out:
+                self._awaiting = None
+            probe = self._probe_command()
+        if timed_out and self._breaker.failure():
+            self._open()
+            self._last_probe = now
+            return
+        if now - self._last_probe >= self._probe_interval and self._breaker.try_probe():
+            self._last_probe = now
+            logger.info("probing soundbar with %s", probe)
+            self._send(probe, (), {})
+
+    async def _watch_health(self):
+        while True:
+            await asyncio.sleep(
+                self._probe_interval if not self.online else self._response_timeout / 2
+            )
+            self.check_health()
+
+    async def run(self):
+        """Send queued commands until cancelled"""
+        self._wakeup = asyncio.Event()
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+        watcher = None
+        if self._breaker is not None:
+            self._ysp.register_state_update_cb(self._on_report)
+            watcher = asyncio.create_task(self._watch_health())
+        try:
+            while True:
+                self._wakeup.clear()
+                entry = self._pop()
+                if entry is None:
+                    await self._wakeup.wait()
+                    continue
+                self._send(entry.name, entry.args, entry.kwargs)
+                await asyncio.sleep(self._min_interval)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+                self._ysp.unregister_state_update_cb(self._on_report)
+            with self._lock:
+                self._loop = None
+                remaining = [entry for entry in sorted(self._heap) if not entry.dropped]
+                self._heap.clear()
+                self._slots.clear()
+            # keep the soundbar consistent with the controller state
+            for entry in remaining:
+                self._send(entry.name, entry.args, entry.kwargs)
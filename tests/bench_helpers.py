@@ -0,0 +1,49 @@
+"""Benchmark baseline kept across test runs"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+from media_center_kb.bench import LatencyStats
+
+
+class BenchBaseline:
+    """Benchmark results compared to and saved as a baseline"""
+
+    # median latency changes under this are noise
+    min_regression_us = 20.0
+
+    def __init__(self, path: str, tolerance: float):
+        self.path = path
+        self.tolerance = tolerance
+        self.results: Dict[str, Dict[str, float]] = {}
+        # formatted results in run order, reported at the end of the session
+        self.lines: List[str] = []
+        self.baseline: Dict[str, Dict[str, float]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as baseline:
+                self.baseline = json.load(baseline)
+
+    def check(self, name: str, stats: LatencyStats) -> Optional[str]:
+        """Record result, return a message if it regressed against the baseline"""
+        result = stats.as_dict()
+        self.results[name] = result
+        base = self.baseline.get(name)
+        self.lines.append(
+            f"{name:40} {stats}" + ("  (no baseline)" if base is None else "")
+        )
+        if base is None:
+            return None
+        limit = max(
+            base["p50_us"] * (1 + self.tolerance),
+            base["p50_us"] + self.min_regression_us,
+        )
+        if result["p50_us"] > limit:
+            return f"{name}: p50 {result['p50_us']}us, baseline {base['p50_us']}us"
+        return None
+
+    def save(self):
+        """Write results as the new baseline"""
+        with open(self.path, "w", encoding="utf-8") as baseline:
+            json.dump(dict(sorted(self.results.items())), baseline, indent=2)
+            baseline.write("\n")
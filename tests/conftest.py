@@ -1,13 +1,18 @@
 """pytest fixtures and stuff"""
 
+import os
+import warnings
 from typing import Dict
 
 import pytest
 
 import media_center_kb.control
 from media_center_kb.relays import RelayModule, GPioIf, RelayIf
+from .bench_helpers import BenchBaseline
 from .mocks import GPMock, LoggerMock, ShellMock, YspMock
 
+BENCH_BASELINE = pytest.StashKey[BenchBaseline]()
+
 
 class WrapRelays(RelayModule):  # pylint: disable=too-few-public-methods
     """Relays class wrapper for tests"""
@@ -68,8 +73,12 @@ class WrapRelays(RelayModule):  # pylint: disable=too-few-public-methods
 @pytest.fixture
 def nosleep():
     """disable 1s sleep on graceful shutdown"""
+
+    async def no_sleep(_):
+        pass
+
     orig = media_center_kb.control.sleeper
-    media_center_kb.control.sleeper = lambda x: None
+    media_center_kb.control.sleeper = no_sleep
     yield
     media_center_kb.control.sleeper = orig
 
@@ -102,3 +111,72 @@ def ysp():
 def shell():
     """shell mock"""
     return ShellMock()
+
+
+def pytest_addoption(parser: pytest.Parser):
+    """benchmark options"""
+    group = parser.getgroup("bench", "performance benchmarks")
+    group.addoption(
+        "--bench", action="store_true", help="Run benchmarks marked with bench"
+    )
+    group.addoption(
+        "--bench-save",
+        action="store_true",
+        help="Save benchmark results as the new baseline",
+    )
+    group.addoption(
+        "--bench-baseline",
+        default=os.path.join(os.path.dirname(__file__), "bench_baseline.json"),
+        help="Baseline JSON file",
+    )
+    group.addoption(
+        "--bench-tolerance",
+        type=float,
+        default=0.5,
+        help="Allowed median latency increase over the baseline, 0.5 is +50%%",
+    )
+
+
+def pytest_configure(config: pytest.Config):
+    """register bench marker"""
+    config.addinivalue_line("markers", "bench: performance benchmark, run with --bench")
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items):
+    """skip benchmarks unless asked for"""
+    if config.getoption("--bench"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, use --bench to run")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def bench_baseline(request: pytest.FixtureRequest):
+    """benchmark baseline, saved at the end of session with --bench-save"""
+    config = request.config
+    baseline = BenchBaseline(
+        config.getoption("--bench-baseline"), config.getoption("--bench-tolerance")
+    )
+    if not baseline.baseline and not config.getoption("--bench-save"):
+        warnings.warn(
+            pytest.PytestWarning(
+                f"no benchmark baseline {baseline.path}, regressions are not checked, "
+                "save one on this machine with --bench-save"
+            )
+        )
+    config.stash[BENCH_BASELINE] = baseline
+    yield baseline
+    if config.getoption("--bench-save") and baseline.results:
+        baseline.save()
+
+
+def pytest_terminal_summary(terminalreporter, config: pytest.Config):
+    """benchmark results"""
+    baseline = config.stash.get(BENCH_BASELINE, None)
+    if baseline is None or not baseline.lines:
+        return
+    terminalreporter.section("benchmarks")
+    for line in baseline.lines:
+        terminalreporter.write_line(line)
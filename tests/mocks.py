@@ -4,6 +4,7 @@ import logging
 from typing import Callable
 
 from media_center_kb.relays import GPioIf, Logger
+from media_center_kb.shell import RestrictedShell, ShellResult
 
 # pylint: disable=missing-function-docstring,invalid-name
 
@@ -46,6 +47,7 @@ class YspMock:
         self.input = None
         self.sound_mode = None
         self.dsp = None
+        self.volume = 0
         self.cbs = set()
 
     def reset(self):
@@ -53,6 +55,7 @@ class YspMock:
         self.input = None
         self.sound_mode = None
         self.dsp = None
+        self.volume = 0
         self.cbs = set()
 
     def power_on(self):
@@ -80,6 +83,15 @@ class YspMock:
     def set_dsp_off(self):
         self.dsp = "off"
 
+    def volume_up(self):
+        self.volume = min(self.volume + 1, 100)
+
+    def volume_down(self):
+        self.volume = max(self.volume - 1, 0)
+
+    def set_volume_pct(self, value: int):
+        self.volume = value
+
     def register_state_update_cb(self, cb: Callable):
         self.cbs.add(cb)
 
@@ -112,14 +124,21 @@ class YspMock:
         return self.sound_mode == "5beam"
 
 
-class ShellMock:  # pylint: disable=too-few-public-methods
+class ShellMock(RestrictedShell):
     """Mock for cmd commands"""
 
     def __init__(self):
+        super().__init__()
+        # awaited and started in background commands
         self.last_cmd = None
+        self.background_cmd = None
 
-    def __call__(self, cmd):
+    async def run(self, cmd, timeout=None):
         self.last_cmd = cmd
+        return ShellResult(cmd, 0, "", "")
+
+    def __call__(self, cmd):
+        self.background_cmd = cmd
 
 
 class LoggerMock(Logger):
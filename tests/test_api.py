@@ -0,0 +1,121 @@
+"""Control API tests"""
+
+import asyncio
+import json
+import os
+import stat
+
+from media_center_kb.api import ControlServer
+from media_center_kb.control import Controller
+from media_center_kb.timers import TimerService
+
+from .conftest import WrapRelays
+from .mocks import YspMock
+
+
+def test_execute(relays: WrapRelays, ysp: YspMock, nosleep):
+    """single, batch and state requests"""
+    _ = nosleep
+
+    server = ControlServer(Controller(relays, ysp), "unused")
+
+    def execute(request):
+        return asyncio.run(server.execute(request))
+
+    assert execute({"cmd": "tv_on", "id": 7}) == {"ok": True, "id": 7}
+    assert ysp.is_power_on
+    assert relays.relay(1).is_on
+
+    response = execute({"cmd": "state"})
+    assert response["ok"]
+    assert response["state"]["tv"] is True
+    assert response["state"]["printer"] is False
+
+    response = execute(
+        {
+            "batch": [
+                {"cmd": "printer_on"},
+                {"cmd": "nope"},
+                {"cmd": "volume_set", "args": [30]},
+            ]
+        }
+    )
+    assert not response["ok"]
+    assert [result["ok"] for result in response["results"]] == [True, False, True]
+    assert relays.relay(4).is_on
+    assert ysp.volume == 30
+
+    assert not execute({"cmd": "volume_set", "args": 30})["ok"]
+    assert not execute({"cmd": "volume_set"})["ok"]
+    assert not execute([])["ok"]
+    assert not json.loads(asyncio.run(server.handle_line(b"{bad")))["ok"]
+
+
+def test_socket(relays: WrapRelays, ysp: YspMock, tmp_path, nosleep):
+    """pipelined requests over a real unix socket"""
+    _ = nosleep
+
+    path = str(tmp_path / "ctl.sock")
+    server = ControlServer(Controller(relays, ysp), path)
+
+    async def client():
+        task = asyncio.create_task(server.serve())
+        for _ in range(100):
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+                break
+            except OSError:
+                await asyncio.sleep(0.01)
+
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o660
+        writer.write(b'{"cmd": "turntable_on"}\n\n{"cmd": "state", "id": "s"}\n')
+        first = json.loads(await reader.readline())
+        second = json.loads(await reader.readline())
+        writer.close()
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return first, second
+
+    first, second = asyncio.run(client())
+    assert first == {"ok": True}
+    assert second["id"] == "s"
+    assert second["state"]["turntable"] is True
+    assert not (tmp_path / "ctl.sock").exists()
+
+
+def test_timers(relays: WrapRelays, ysp: YspMock, nosleep):
+    """sleep timers over the API run controller commands"""
+    _ = nosleep
+    controller = Controller(relays, ysp)
+    timers = TimerService(controller.async_commands_map())
+    server = ControlServer(controller, "unused", timers)
+
+    async def main():
+        task = asyncio.create_task(timers.run())
+        await server.execute({"cmd": "printer_on"})
+        response = await server.execute(
+            {"cmd": "timer", "run": "printer_off", "after": 0.02}
+        )
+        assert response == {"ok": True, "timer": 1}
+        response = await server.execute(
+            {"cmd": "timer", "run": "volume_set", "args": [30], "daily": "07:00"}
+        )
+        assert response["ok"]
+        assert not (await server.execute({"cmd": "timer", "run": "nope", "after": 1}))[
+            "ok"
+        ]
+        response = await server.execute({"cmd": "timers"})
+        assert [timer["cmd"] for timer in response["timers"]] == [
+            "printer_off",
+            "volume_set",
+        ]
+        assert (await server.execute({"cmd": "timer_cancel", "timer": 2}))["ok"]
+        assert not (await server.execute({"cmd": "timer_cancel", "timer": 2}))["ok"]
+
+        await asyncio.sleep(0.05)
+        assert not relays.relay(4).is_on
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+"""
+Keypress to actuation benchmarks over the test mocks:
+
+    pytest --bench                 # run and compare with tests/bench_baseline.json
+    pytest --bench --bench-save    # save results as the new baseline
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import pytest
+from evdev import InputEvent, ecodes
+
+from media_center_kb.bench import LatencyStats, when_done
+from media_center_kb.config import DEFAULT_CONFIG, parse_config
+from media_center_kb.control import Controller
+from media_center_kb.kb import dispatch_events
+
+from .bench_helpers import BenchBaseline
+from .conftest import WrapRelays
+from .mocks import ShellMock, YspMock
+
+pytestmark = pytest.mark.bench
+
+ITERATIONS = 200
+
+# scenes switched between, "off" is the all devices off state
+BENCH_SCENES = {
+    "movie_night": ["printer_off", "turntable_off", "tv_on"],
+    "vinyl": ["tv_off", "turntable_on"],
+    "radio": ["turntable_off", "streaming_on"],
+}
+
+
+class KeySource:  # pylint: disable=too-few-public-methods
+    """Simulated keyboard: key down and up events for a sequence of keys,
+    remembers when each key down was produced. The next key is pressed after
+    the commands started by the previous one are done, so every press is
+    executed instead of joining or superseding the change in flight"""
+
+    def __init__(self, keys: Sequence[str]):
+        self._keys = keys
+        self.sent: List[float] = []
+        self.pending: List[asyncio.Future] = []
+
+    async def __aiter__(self):
+        for key in self._keys:
+            # pylint: disable=no-member
+            code = ecodes.ecodes[key]
+            self.sent.append(time.perf_counter())
+            yield InputEvent(0, 0, ecodes.EV_KEY, code, 1)
+            yield InputEvent(0, 0, ecodes.EV_KEY, code, 0)
+            # the device read yields to the loop, started commands run
+            await asyncio.sleep(0)
+            await asyncio.gather(*self.pending)
+            self.pending.clear()
+
+
+def drive(
+    handlers: Mapping[str, Callable], keys: Sequence[str], measured: Sequence[bool]
+) -> LatencyStats:
+    """Dispatch keys and measure latency until the command is done
+    for the measured ones"""
+    source = KeySource(keys)
+    latencies: List[float] = []
+
+    def timed(handler: Callable) -> Callable:
+        def inner():
+            idx = len(source.sent) - 1
+
+            def done():
+                if measured[idx]:
+                    latencies.append(time.perf_counter() - source.sent[idx])
+
+            if task := when_done(handler(), done):
+                source.pending.append(task)
+
+        return inner
+
+    async def run():
+        await dispatch_events(source, wrapped)
+
+    wrapped = {key: timed(handler) for key, handler in handlers.items()}
+    started = time.perf_counter()
+    asyncio.run(run())
+    return LatencyStats(latencies, time.perf_counter() - started)
+
+
+@pytest.fixture
+def bench_handlers(
+    relays: WrapRelays, ysp: YspMock, shell: ShellMock, nosleep
+) -> Tuple[Dict[str, str], Dict[str, Callable]]:
+    """key -> command name map and handlers with a key bound to every command"""
+    _ = nosleep
+    config = parse_config({**DEFAULT_CONFIG, "scenes": BENCH_SCENES})
+    controller = Controller(relays, ysp, shell, config=config)
+    commands = controller.commands_map()
+    keymap = {f"KEY_F{idx}": name for idx, name in enumerate(sorted(commands), 1)}
+    handlers = {key: commands[name] for key, name in keymap.items()}
+    # the only command with an argument
+    volume_key = next(key for key, name in keymap.items() if name == "volume_set")
+    handlers[volume_key] = lambda: commands["volume_set"](30)
+    return keymap, handlers
+
+
+def opposite(name: str) -> Optional[str]:
+    """Command undoing name, pressed in between so that every measured press
+    changes something"""
+    if name.endswith("_on"):
+        return name[: -len("on")] + "off"
+    if name.endswith("_off"):
+        return name[: -len("off")] + "on"
+    if name in ("off", "shutdown") or name in BENCH_SCENES:
+        return "tv_on" if name != "movie_night" else "off"
+    # volume changes are executed on every press
+    return None
+
+
+def test_commands(
+    bench_handlers, bench_baseline: BenchBaseline
+):  # pylint: disable=redefined-outer-name
+    """every command through the keyboard dispatch"""
+    keymap, handlers = bench_handlers
+    keys = {name: key for key, name in keymap.items()}
+
+    regressions = []
+    for name, key in sorted(keys.items()):
+        if undo := opposite(name):
+            sequence = [key, keys[undo]] * ITERATIONS
+            measured = [True, False] * ITERATIONS
+        else:
+            sequence = [key] * ITERATIONS
+            measured = [True] * ITERATIONS
+        stats = drive(handlers, sequence, measured)
+        assert stats.count == ITERATIONS
+        if msg := bench_baseline.check(f"command {name}", stats):
+            regressions.append(msg)
+    assert not regressions, "\n".join(regressions)
+
+
+def test_scene_transitions(
+    bench_handlers, bench_baseline: BenchBaseline
+):  # pylint: disable=redefined-outer-name
+    """switching between every pair of configured scenes and off"""
+    keymap, handlers = bench_handlers
+    keys = {name: key for key, name in keymap.items()}
+    scenes = ("off", *BENCH_SCENES)
+
+    regressions = []
+    for start in scenes:
+        for target in scenes:
+            if start == target:
+                continue
+            sequence = [keys[start], keys[target]] * ITERATIONS
+            stats = drive(handlers, sequence, [False, True] * ITERATIONS)
+            assert stats.count == ITERATIONS
+            if msg := bench_baseline.check(f"scene {start} -> {target}", stats):
+                regressions.append(msg)
+    assert not regressions, "\n".join(regressions)
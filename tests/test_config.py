@@ -0,0 +1,167 @@
+"""Declarative configuration tests"""
+
+import asyncio
+import json
+
+import pytest
+
+from media_center_kb.config import load_config, parse_config, parse_rooms
+from media_center_kb.control import Controller
+from media_center_kb.relays import RelayModule
+from media_center_kb.rooms import Rooms
+
+from .mocks import GPMock, LoggerMock, ShellMock, YspMock
+
+CONFIG = {
+    "relays": {"amp": 5, "lamp": 12},
+    "devices": {
+        "radio": {"relays": ["amp"], "soundbar": ["set_input_aux1", "set_stereo"]},
+        "lamp": {"relays": ["lamp"]},
+    },
+    "scenes": {"evening": ["lamp_on", "radio_on"]},
+    "keymap": {"KEY_KP1": "evening", "KEY_KP2": "off"},
+}
+
+
+def test_default():
+    """built-in configuration is the hard-wired media center"""
+    config = load_config(None)
+    assert config.pins == (6, 13, 19, 26)
+    assert config.devices["turntable"].relays == (1, 3)
+    assert config.devices["printer"].soundbar is None
+    assert config.device_commands()["streaming_on"] == ("bt", True)
+    assert config.keymap["KEY_KP7"] == "tv_on"
+    assert config.resources("turntable_on") == {"relay1", "relay3", "soundbar"}
+    assert config.resources("printer_off") == {"relay4"}
+    assert config.resources("volume_up") == {"soundbar"}
+    assert len(config.resources("off")) == 5
+
+
+def test_compiled(nosleep):
+    """devices, scenes and keys from the config file"""
+    _ = nosleep
+    config = parse_config(CONFIG)
+    gpio = GPMock()
+    relays = RelayModule(gpio, LoggerMock(), config.pins)
+    ysp = YspMock()
+    controller = Controller(relays, ysp, config=config)
+    assert set(controller.commands_map()) >= {"radio_on", "lamp_off", "evening"}
+
+    handlers = controller.kb_handlers()
+    handlers["KEY_KP1"]()
+    assert gpio.states == {5: 1, 12: 1}
+    assert ysp.is_power_on and ysp.is_input_aux1 and ysp.is_stereo
+    assert controller.state() == {"radio": True, "lamp": True, "volume": 0}
+
+    handlers["KEY_KP2"]()
+    assert gpio.states == {5: 0, 12: 0}
+    assert ysp.is_power_off
+
+
+@pytest.mark.parametrize(
+    "section, value",
+    [
+        ("relays", {"a": 1, "b": 1}),
+        ("devices", {"x": {"relays": ["nope"]}}),
+        ("devices", {"x": {"soundbar": ["power_off"]}}),
+        ("devices", {"x": {"colour": "red"}}),
+        ("devices", {"x": {}, "y": {"command": "x"}}),
+        ("devices", {"x": {"cups": "lpd://printer"}}),
+        ("devices", {"x": {"idle_off": 60}}),
+        ("scenes", {"off": ["lamp_on"]}),
+        ("scenes", {"s": ["volume_set"]}),
+        ("scenes", {"s": ["lamp_on", "s"]}),
+        ("keymap", {"KEY_A": "coffee_on"}),
+    ],
+)
+def test_invalid(section, value):
+    """configuration errors are reported before anything is built"""
+    with pytest.raises(ValueError):
+        parse_config({**CONFIG, section: value})
+
+
+def test_files(tmp_path):
+    """JSON and TOML files"""
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(CONFIG))
+    assert load_config(str(path)) == parse_config(CONFIG)
+
+    path = tmp_path / "config.toml"
+    path.write_text("""
+[relays]
+amp = 5
+
+[devices.radio]
+relays = ["amp"]
+soundbar = ["set_input_tv"]
+
+[keymap]
+KEY_KP1 = "radio_on"
+""")
+    config = load_config(str(path))
+    assert config.devices["radio"].soundbar == ("set_input_tv",)
+    assert config.keymap == {"KEY_KP1": "radio_on"}
+
+    config = parse_config(
+        {
+            "devices": {"p": {"cups": "ipp://localhost/printers/p", "idle_off": 300}},
+            "keymap": {},
+        }
+    )
+    assert config.devices["p"].idle_off == 300
+
+    path.write_text("[relays")
+    with pytest.raises(ValueError):
+        load_config(str(path))
+
+
+def test_rooms(tmp_path, nosleep):
+    """several rooms with their own boards, commands are prefixed with the room"""
+    _ = nosleep
+    bedroom = {
+        **CONFIG,
+        "relays": {"amp": 20, "lamp": 21},
+        "serial_port": "/dev/b",
+        "keypad": "/dev/input/bed",
+    }
+    rooms = parse_rooms(
+        {"rooms": {"living": {"serial_port": "/dev/a"}, "bed": bedroom}}
+    )
+    assert list(rooms) == ["living", "bed"]
+    assert rooms["living"].pins == (6, 13, 19, 26)
+    assert rooms["bed"].serial_port == "/dev/b"
+    assert parse_rooms(CONFIG) == {"": parse_config(CONFIG)}
+
+    path = tmp_path / "rooms.json"
+    path.write_text(
+        json.dumps({"rooms": {"living": {}, "bed": {**bedroom, "keypad": None}}})
+    )
+    with pytest.raises(ValueError, match="keypads"):
+        load_config(str(path))
+    path.write_text(json.dumps({"rooms": {"living": {}, "bed": CONFIG}}))
+    with pytest.raises(ValueError, match="serial ports"):
+        load_config(str(path))
+    path.write_text(json.dumps({"rooms": {"living": {}, "bed": {"keypad": "/dev/k"}}}))
+    with pytest.raises(ValueError, match="GPIO pins"):
+        load_config(str(path))
+
+    controllers = {}
+    shells = []
+    for room, config in rooms.items():
+        relays = RelayModule(GPMock(), LoggerMock(), config.pins)
+        shells.append(ShellMock())
+        controllers[room] = Controller(relays, YspMock(), shells[-1], config=config)
+    house = Rooms(controllers)
+    commands = house.async_commands_map()
+    assert {"living/tv_on", "bed/lamp_on", "bed/evening"} <= set(commands)
+    asyncio.run(commands["bed/lamp_on"]())
+    assert house.state()["bed/lamp"] is True
+    assert house.state()["living/printer"] is False
+
+    # every room is switched off, the board is powered off once
+    asyncio.run(commands["living/printer_on"]())
+    asyncio.run(house.power_off())
+    assert not any(
+        value for name, value in house.state().items() if "volume" not in name
+    )
+    assert [shell.last_cmd for shell in shells] == [None, "sudo poweroff"]
@@ -1,10 +1,21 @@
 """Controller tests"""
 
-from typing import Iterable
+import asyncio
+import threading
+import time
+from typing import Iterable, List
 
 import pytest
 
 import media_center_kb.control
+from media_center_kb.config import DEFAULT_CONFIG, parse_config
+from media_center_kb.events import (
+    CommandExecuted,
+    EventBus,
+    KeyPressed,
+    RelayToggled,
+    StateChanged,
+)
 
 from .conftest import WrapRelays
 from .mocks import ShellMock, YspMock
@@ -40,7 +51,7 @@ def test_handlers(
     handlers.get("UNK", lambda: None)()
 
     # tv
-    for action in [handlers.get("KEY_KP7"), commands["tv_on"]]:
+    for action in [handlers["KEY_KP7"], commands["tv_on"]]:
         action()
         assert some_on(relays, [1])
         assert ysp.is_power_on
@@ -48,7 +59,7 @@ def test_handlers(
         assert ysp.is_5beam
         ysp.reset()
 
-    for action in [handlers.get("KEY_KP4"), commands["tv_off"]]:
+    for action in [handlers["KEY_KP4"], commands["tv_off"]]:
         action()
         assert all_off(relays)
         assert ysp.is_power_off
@@ -57,7 +68,7 @@ def test_handlers(
         ysp.reset()
 
     # music stream
-    for action in [handlers.get("KEY_KP9"), commands["streaming_on"]]:
+    for action in [handlers["KEY_KP9"], commands["streaming_on"]]:
         action()
         assert some_on(relays, [1])
         assert ysp.is_power_on
@@ -65,7 +76,7 @@ def test_handlers(
         assert ysp.is_stereo
         ysp.reset()
 
-    for action in [handlers.get("KEY_KP6"), commands["streaming_off"]]:
+    for action in [handlers["KEY_KP6"], commands["streaming_off"]]:
         action()
         assert all_off(relays)
         assert ysp.is_power_off
@@ -74,7 +85,7 @@ def test_handlers(
         ysp.reset()
 
     # turntable
-    for action in [handlers.get("KEY_KP8"), commands["turntable_on"]]:
+    for action in [handlers["KEY_KP8"], commands["turntable_on"]]:
         action()
         assert some_on(relays, [1, 3])
         assert ysp.is_power_on
@@ -82,7 +93,7 @@ def test_handlers(
         assert ysp.is_stereo
         ysp.reset()
 
-    for action in [handlers.get("KEY_KP5"), commands["turntable_off"]]:
+    for action in [handlers["KEY_KP5"], commands["turntable_off"]]:
         action()
         assert all_off(relays)
         assert ysp.is_power_off
@@ -91,14 +102,14 @@ def test_handlers(
         ysp.reset()
 
     # printer
-    for action in [handlers.get("KEY_KPMINUS"), commands["printer_on"]]:
+    for action in [handlers["KEY_KPMINUS"], commands["printer_on"]]:
         action()
         assert some_on(relays, [4])
         assert not ysp.is_power_on
         assert ysp.power_state is None
         ysp.reset()
 
-    for action in [handlers.get("KEY_KPPLUS"), commands["printer_off"]]:
+    for action in [handlers["KEY_KPPLUS"], commands["printer_off"]]:
         action()
         assert all_off(relays)
         assert not ysp.is_power_on
@@ -143,6 +154,7 @@ def test_poweroff(relays: WrapRelays, ysp: YspMock, shell: ShellMock, nosleep):
     assert all_off(relays)
     assert ysp.is_power_off
     assert "sudo poweroff" == shell.last_cmd
+    assert shell.background_cmd is None
 
 
 def test_controller_devices(relays: WrapRelays, ysp: YspMock, nosleep):
@@ -161,3 +173,202 @@ def test_controller_devices(relays: WrapRelays, ysp: YspMock, nosleep):
 
     with pytest.raises(ValueError):
         controller.devices(("tv", "test"))
+
+
+def test_async_commands(relays: WrapRelays, ysp: YspMock, monkeypatch):
+    """soundbar power off wait does not hold back other devices"""
+    monkeypatch.setattr(
+        media_center_kb.control, "sleeper", lambda _: asyncio.sleep(0.2)
+    )
+    controller = media_center_kb.control.Controller(relays, ysp)
+    commands = controller.async_commands_map()
+    handlers = controller.kb_handlers()
+
+    async def main():
+        await commands["tv_on"]()
+        started = time.perf_counter()
+        tv_off = handlers["KEY_KP4"]()
+        printer_on = handlers["KEY_KPMINUS"]()
+        await printer_on
+        assert time.perf_counter() - started < 0.1
+        assert relays.relay(4).is_on
+        assert not tv_off.done()
+        await tv_off
+        assert not relays.relay(1).is_on
+
+    asyncio.run(main())
+
+
+def test_sync_adapters(relays: WrapRelays, ysp: YspMock, nosleep):
+    """devices switched from another thread wait for the event loop"""
+    _ = nosleep
+    controller = media_center_kb.control.Controller(relays, ysp)
+    printer = controller.devices(["printer"])["printer"]
+    assert isinstance(printer, media_center_kb.control.PoweredDevice)
+    runner = media_center_kb.control.runner
+
+    async def main():
+        runner.bind(asyncio.get_running_loop())
+        try:
+            thread = threading.Thread(target=printer.on)
+            thread.start()
+            await asyncio.to_thread(thread.join)
+        finally:
+            runner.bind(None)
+        assert relays.relay(4).is_on
+
+    asyncio.run(main())
+    printer.off()
+    assert not relays.relay(4).is_on
+    assert not printer.state()
+
+
+def test_latest_request_wins(relays: WrapRelays, ysp: YspMock, monkeypatch):
+    """opposite request cancels the change in flight, the same one joins it"""
+    monkeypatch.setattr(
+        media_center_kb.control, "sleeper", lambda _: asyncio.sleep(0.2)
+    )
+    controller = media_center_kb.control.Controller(relays, ysp)
+    commands = controller.async_commands_map()
+    tv = controller.powered_devices()["tv"]
+
+    async def main():
+        await commands["tv_on"]()
+        tv_off = asyncio.create_task(tv.turn_off())
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        assert await tv.turn_on()
+        assert time.perf_counter() - started < 0.1
+        assert not await tv_off
+        assert tv.state()
+        assert relays.relay(1).is_on
+
+        results = await asyncio.gather(tv.turn_off(), tv.turn_off(), tv.turn_off())
+        assert results == [True, True, True]
+        assert not relays.relay(1).is_on
+
+    asyncio.run(main())
+    assert tv.cancelled == 1
+    assert tv.superseded == 2
+
+
+def test_shared_relays(relays: WrapRelays, ysp: YspMock, nosleep):
+    """turning off one soundbar device keeps power for another one"""
+    _ = nosleep
+    controller = media_center_kb.control.Controller(relays, ysp)
+    commands = controller.commands_map()
+
+    commands["turntable_on"]()
+    commands["streaming_on"]()
+    commands["streaming_off"]()
+    assert relays.relay(1).is_on
+    assert relays.relay(3).is_on
+    assert ysp.is_power_on
+
+    commands["turntable_off"]()
+    assert not relays.relay(1).is_on
+    assert not relays.relay(3).is_on
+    assert ysp.is_power_off
+    assert relays.toggles[1] == 2
+
+
+def test_concurrent_scene(relays: WrapRelays, ysp: YspMock, monkeypatch):
+    """independent scene steps run together, dependent ones in order"""
+    monkeypatch.setattr(
+        media_center_kb.control, "sleeper", lambda _: asyncio.sleep(0.2)
+    )
+    config = parse_config(
+        {
+            **DEFAULT_CONFIG,
+            "scenes": {"movie_night": ["turntable_off", "printer_off", "tv_on"]},
+        }
+    )
+    controller = media_center_kb.control.Controller(relays, ysp, config=config)
+    commands = controller.async_commands_map()
+
+    async def main():
+        await commands["turntable_on"]()
+        await commands["printer_on"]()
+        scene = asyncio.ensure_future(commands["movie_night"]())
+        await asyncio.sleep(0.05)
+        # printer does not wait for the soundbar
+        assert not relays.relay(4).is_on
+        assert relays.relay(3).is_on
+        await scene
+        assert not relays.relay(3).is_on
+        assert relays.relay(1).is_on
+        assert ysp.is_power_on and ysp.is_input_tv
+
+        await commands["printer_on"]()
+        started = time.perf_counter()
+        off = asyncio.ensure_future(commands["off"]())
+        await asyncio.sleep(0.05)
+        assert not relays.relay(4).is_on
+        assert relays.relay(1).is_on
+        await off
+        assert time.perf_counter() - started < 0.4
+        assert not relays.relay(1).is_on
+
+    asyncio.run(main())
+
+
+def test_events(relays: WrapRelays, ysp: YspMock, nosleep):
+    """keys, commands, relays and soundbar reports share one event stream"""
+    _ = nosleep
+    bus = EventBus()
+    relays.bus = bus
+    controller = media_center_kb.control.Controller(relays, ysp, bus=bus)
+    # one soundbar callback however many devices report the volume
+    assert len(ysp.cbs) == 1
+    events: List = []
+    for event_type in (KeyPressed, CommandExecuted, StateChanged, RelayToggled):
+        bus.subscribe(event_type, events.append)
+
+    controller.kb_handlers()["KEY_KP7"]()
+    assert [type(event) for event in events] == [
+        KeyPressed,
+        RelayToggled,
+        StateChanged,
+        CommandExecuted,
+    ]
+    assert events[0] == KeyPressed("KEY_KP7", "tv_on")
+    assert events[1] == RelayToggled(1, True)
+    assert events[2] == StateChanged("tv", True)
+    assert events[3].command == "tv_on"
+
+    events.clear()
+    for callback in ysp.cbs:
+        callback(volume="30")
+        callback(volume="30", input="tv")
+    assert events == [StateChanged("volume", 30)]
+    assert controller.state()["volume"] == 30
+
+    controller.commands_map()["printer_on"]()
+    events.clear()
+    controller.commands_map()["off"]()
+    assert StateChanged("printer", False) in events
+    assert RelayToggled(4, False) in events
+    assert isinstance(events[-1], CommandExecuted)
+
+
+def test_reset_reports_off(relays: WrapRelays, ysp: YspMock, shell: ShellMock, nosleep):
+    """board reset and shutdown switch every device off, state and events agree"""
+    _ = nosleep
+    controller = media_center_kb.control.Controller(relays, ysp, shell)
+    events: List[StateChanged] = []
+    controller.bus.subscribe(StateChanged, events.append)
+    commands = controller.commands_map()
+
+    for command in ("off", "shutdown"):
+        for name in ("tv_on", "turntable_on", "printer_on"):
+            commands[name]()
+        assert controller.state()["tv"] and controller.state()["turntable"]
+        events.clear()
+        commands[command]()
+        assert not any(
+            value for name, value in controller.state().items() if name != "volume"
+        )
+        assert sorted(events) == [
+            StateChanged(name, False) for name in ("printer", "turntable", "tv")
+        ]
+        assert all_off(relays)
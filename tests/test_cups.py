@@ -0,0 +1,79 @@
+"""CUPS driven printer power tests"""
+
+import asyncio
+
+import pytest
+
+from media_center_kb.control import Controller
+from media_center_kb.cups import IppClient, IppStandIn, PrinterWatcher, decode_message
+
+from .conftest import WrapRelays
+from .mocks import YspMock
+
+
+def test_stand_in():
+    """queued job count over IPP from the stand-in"""
+    printer = IppStandIn(jobs=2)
+
+    async def main():
+        task = asyncio.create_task(printer.serve())
+        await asyncio.sleep(0.01)
+        client = IppClient(f"ipp://127.0.0.1:{printer.port}/printers/test")
+        assert await client.queued_jobs() == 2
+        printer.jobs = 0
+        assert await client.queued_jobs() == 0
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        with pytest.raises(OSError):
+            await client.queued_jobs()
+
+    asyncio.run(main())
+    assert printer.requests == 2
+
+    with pytest.raises(ValueError):
+        decode_message(b"\x01\x01\x00")
+    with pytest.raises(ValueError):
+        IppClient("lpd://printer")
+
+
+def test_watcher(relays: WrapRelays, ysp: YspMock, nosleep):
+    """printer on when jobs are queued, off after idle time, manual use kept"""
+    _ = nosleep
+    controller = Controller(relays, ysp)
+    printer = controller.powered_devices()["printer"]
+    cups = IppStandIn()
+    now = [0.0]
+
+    async def main():
+        task = asyncio.create_task(cups.serve())
+        await asyncio.sleep(0.01)
+        client = IppClient(f"ipp://127.0.0.1:{cups.port}/printers/test")
+        watcher = PrinterWatcher(printer, client, idle_off=60, clock=lambda: now[0])
+
+        await watcher.check()
+        assert not relays.relay(4).is_on
+
+        cups.jobs = 1
+        await watcher.check()
+        assert relays.relay(4).is_on
+        cups.jobs = 0
+        now[0] = 30
+        await watcher.check()
+        assert relays.relay(4).is_on
+        now[0] = 61
+        await watcher.check()
+        assert not relays.relay(4).is_on
+
+        # switched on by hand, no jobs: left on
+        await printer.turn_on()
+        now[0] = 200
+        await watcher.check()
+        assert relays.relay(4).is_on
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return watcher
+
+    watcher = asyncio.run(main())
+    assert watcher.powered_on == 1
+    assert watcher.powered_off == 1
@@ -0,0 +1,37 @@
+"""Event bus tests"""
+
+from typing import List
+
+from media_center_kb.events import EventBus, KeyPressed, RelayToggled, StateChanged
+
+
+def test_fan_out():
+    """subscribers get events of their type in subscription order"""
+    bus = EventBus()
+    received: List = []
+
+    def failing(_):
+        raise RuntimeError("subscriber bug")
+
+    bus.subscribe(KeyPressed, lambda event: received.append(("a", event)))
+    bus.subscribe(KeyPressed, failing)
+    unsubscribe = bus.subscribe(KeyPressed, lambda event: received.append(("b", event)))
+    bus.subscribe(StateChanged, lambda event: received.append(("s", event)))
+
+    bus.publish(KeyPressed("KEY_KP7", "tv_on"))
+    bus.publish(RelayToggled(1, True))
+    assert received == [
+        ("a", KeyPressed("KEY_KP7", "tv_on")),
+        ("b", KeyPressed("KEY_KP7", "tv_on")),
+    ]
+
+    unsubscribe()
+    unsubscribe()
+    received.clear()
+    bus.publish(KeyPressed("KEY_KP4", "tv_off"))
+    bus.publish(StateChanged("tv", False))
+    assert received == [
+        ("a", KeyPressed("KEY_KP4", "tv_off")),
+        ("s", StateChanged("tv", False)),
+    ]
+    assert bus.published == 4
@@ -0,0 +1,175 @@
+"""Volume fade tests"""
+
+import asyncio
+from typing import List
+
+from media_center_kb.control import Controller
+from media_center_kb.fade import VOLUME_STEP, VolumeFader
+from media_center_kb.ysp_scheduler import YspScheduler
+
+from .conftest import WrapRelays
+from .mocks import YspMock
+
+
+class VolumeYsp(YspMock):
+    """Records sent volume levels and power commands"""
+
+    def __init__(self):
+        super().__init__()
+        self.log: List = []
+
+    def set_volume_pct(self, value: int):
+        super().set_volume_pct(value)
+        self.log.append(value)
+
+    def power_off(self):
+        super().power_off()
+        self.log.append("off")
+
+
+def _with_fader(test, fader: VolumeFader):
+    async def run():
+        task = asyncio.create_task(fader.run())
+        await asyncio.sleep(0)
+        try:
+            await test()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_not_running():
+    """targets are set right away"""
+    ysp = VolumeYsp()
+    fader = VolumeFader(ysp)
+    fader.nudge(VOLUME_STEP)
+    fader.nudge(VOLUME_STEP)
+    assert asyncio.run(fader.ramp(30, 10))
+    assert ysp.log == [VOLUME_STEP, 2 * VOLUME_STEP, 30]
+
+
+def test_ramp():
+    """ramp sends a few commands and ends at the target"""
+    ysp = VolumeYsp()
+    fader = VolumeFader(ysp, min_interval=0.05)
+
+    async def test():
+        assert await fader.ramp(40, 0.3)
+
+    _with_fader(test, fader)
+    assert not ysp.cbs
+    assert ysp.log[-1] == 40
+    assert ysp.log == sorted(ysp.log)
+    assert 3 <= len(ysp.log) <= 8
+    assert fader.volume == 40
+
+
+def test_coalesce():
+    """volume key presses within an interval are one command"""
+    ysp = VolumeYsp()
+    fader = VolumeFader(ysp, min_interval=0.05)
+
+    async def test():
+        for _ in range(10):
+            fader.nudge(VOLUME_STEP)
+        await asyncio.sleep(0.01)
+        assert fader.target == 10 * VOLUME_STEP
+        await fader.ramp(fader.target, 0)
+
+    _with_fader(test, fader)
+    assert ysp.log == [10 * VOLUME_STEP]
+    assert fader.coalesced == 9
+
+
+def test_replace():
+    """a new ramp replaces the running one"""
+    ysp = VolumeYsp()
+    fader = VolumeFader(ysp, min_interval=0.01)
+
+    async def test():
+        first = asyncio.create_task(fader.ramp(100, 1))
+        await asyncio.sleep(0.05)
+        assert await fader.ramp(0, 0.05)
+        assert not await first
+
+    _with_fader(test, fader)
+    assert ysp.log[-1] == 0
+    assert max(ysp.log) < 100
+
+
+def test_power_fades(relays: WrapRelays, nosleep):
+    """fade out before power off, fade back in on power on"""
+    _ = nosleep
+    ysp = VolumeYsp()
+    controller = Controller(relays, ysp)
+    commands = controller.async_commands_map()
+
+    async def test():
+        await commands["volume_set"](30)
+        await commands["tv_off"]()
+        # silent, then the volume is sent back for the next power on
+        assert ysp.log[-3:] == [0, 30, "off"]
+        assert ysp.log.index(0) > ysp.log.index(30)
+        ysp.log.clear()
+        await commands["tv_on"]()
+        await asyncio.sleep(0.15)
+        # fading in from silence
+        assert len(ysp.log) == 1 and ysp.log[0] < 10
+        assert controller.fader.target == 30
+
+    _with_fader(test, controller.fader)
+    # stopped in the middle of the fade in, the target is set
+    assert ysp.log[-1] == 30
+
+
+def test_reported_volume(relays: WrapRelays, nosleep):
+    """the fader starts from the reported volume, fades in to it without a saved one
+    and HA volume sets go through it"""
+    _ = nosleep
+    ysp = VolumeYsp()
+    controller = Controller(relays, ysp)
+    commands = controller.async_commands_map()
+    tv = controller.powered_devices()["tv"]
+    # soundbar left at 40 by the previous daemon run, reported before the fader runs
+    for cb in ysp.cbs:
+        cb(volume="40")
+
+    async def test():
+        await commands["volume_up"]()
+        assert controller.fader.target == 40 + VOLUME_STEP
+        await asyncio.sleep(0.15)
+        ysp.log.clear()
+        await commands["tv_on"]()
+        await asyncio.sleep(0.15)
+        # fading in from silence to the current volume
+        assert ysp.log[0] < 10
+        assert controller.fader.target == 40 + VOLUME_STEP
+        await tv.set_volume(20)  # type: ignore[attr-defined]
+        assert controller.fader.target == controller.fader.volume == 20
+
+    _with_fader(test, controller.fader)
+    assert ysp.log[-1] == 20
+
+
+def test_power_off_through_scheduler(relays: WrapRelays, nosleep):
+    """the volume sent back after the fade out is not dropped by the power off"""
+    _ = nosleep
+    ysp = VolumeYsp()
+    scheduler = YspScheduler(ysp, ("register_state_update_cb",), min_interval=0.01)
+    controller = Controller(relays, scheduler)  # type: ignore[arg-type]
+    commands = controller.async_commands_map()
+
+    async def test():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0)
+        try:
+            await commands["volume_set"](30)
+            await commands["tv_off"]()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    _with_fader(test, controller.fader)
+    assert ysp.log[-3:] == [0, 30, "off"]
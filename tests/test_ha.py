@@ -0,0 +1,86 @@
+"""HA integration tests over fake MQTT entities"""
+
+from typing import Dict, List
+
+import pytest
+
+import media_center_kb.ha
+from media_center_kb.control import Controller
+from media_center_kb.ha import SmartOutletHaDevice
+from media_center_kb.relays import RelayModule
+from media_center_kb.rooms import Rooms
+
+from .mocks import GPMock, LoggerMock, ShellMock, YspMock
+
+# pylint: disable=missing-function-docstring
+
+
+class FakeEntity:
+    """Entity that records its state instead of talking to a broker"""
+
+    created: List["FakeEntity"] = []
+
+    def __init__(self, settings, callback):
+        self.unique_id = settings.entity.unique_id
+        self.callback = callback
+        self.state = None
+        FakeEntity.created.append(self)
+
+    def on(self):  # pylint: disable=invalid-name
+        self.state = True
+
+    def off(self):
+        self.state = False
+
+    def update_state(self, state: bool):
+        self.state = state
+
+    def set_value(self, value: float):
+        self.state = value
+
+
+class Message:  # pylint: disable=too-few-public-methods
+    """MQTT message"""
+
+    def __init__(self, payload: str):
+        self.payload = payload.encode()
+
+
+@pytest.fixture
+def entities(monkeypatch) -> Dict[str, FakeEntity]:
+    """unique id -> entity created by the HA device"""
+    FakeEntity.created = []
+    monkeypatch.setattr(media_center_kb.ha, "CachedSwitch", FakeEntity)
+    monkeypatch.setattr(media_center_kb.ha, "CachedNumber", FakeEntity)
+    monkeypatch.setattr(media_center_kb.ha, "get_mac_address", lambda: "mac")
+    return {}
+
+
+def test_rooms(entities, nosleep):  # pylint: disable=redefined-outer-name
+    """one board switch for all rooms, its OFF powers the board off once"""
+    _ = nosleep
+    shells = [ShellMock(), ShellMock()]
+    controllers = {
+        room: Controller(RelayModule(GPMock(), LoggerMock(), pins), YspMock(), shell)
+        for room, pins, shell in (
+            ("living", (1, 2, 3, 4), shells[0]),
+            ("bed", (5, 6, 7, 8), shells[1]),
+        )
+    }
+    device = SmartOutletHaDevice(Rooms(controllers), {"host": "localhost"})
+    entities.update((entity.unique_id, entity) for entity in FakeEntity.created)
+    assert len(entities) == len(FakeEntity.created) == 11
+    assert {"mac-outlet", "mac-living-tv-switch", "mac-bed-tv-vol"} <= set(entities)
+
+    device.announce()
+    unsubscribe = device.watch()
+    controllers["bed"].commands_map()["printer_on"]()
+    assert entities["mac-bed-printer-switch"].state is True
+    assert entities["mac-living-printer-switch"].state is False
+
+    board = entities["mac-outlet"]
+    board.callback(None, None, Message("OFF"))
+    assert board.state is False
+    assert entities["mac-bed-printer-switch"].state is False
+    assert [shell.last_cmd for shell in shells] == [None, "sudo poweroff"]
+    unsubscribe()
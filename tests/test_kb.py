@@ -0,0 +1,95 @@
+"""Keyboard dispatch and event loop selection tests"""
+
+import asyncio
+import time
+
+import pytest
+from evdev import InputEvent, ecodes
+
+from media_center_kb import bench
+from media_center_kb.kb import dispatch_events, handle_event
+from media_center_kb.loops import use_event_loop
+
+# pylint: disable=no-member
+
+
+def _key(code: int, value: int) -> InputEvent:
+    return InputEvent(0, 0, ecodes.EV_KEY, code, value)
+
+
+def test_handle_event():
+    """only key presses of mapped keys call handlers"""
+    calls = []
+    handlers = {"KEY_KP7": lambda: calls.append("kp7")}
+
+    handle_event(handlers, _key(ecodes.KEY_KP7, 1))
+    assert calls == ["kp7"]
+    # key up, hold, sync, numlock and unmapped key are ignored
+    handle_event(handlers, _key(ecodes.KEY_KP7, 0))
+    handle_event(handlers, _key(ecodes.KEY_KP7, 2))
+    handle_event(handlers, InputEvent(0, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+    handle_event(handlers, _key(ecodes.KEY_NUMLOCK, 1))
+    handle_event(handlers, _key(ecodes.KEY_KP1, 1))
+    assert calls == ["kp7"]
+
+
+def test_dispatch_events():
+    """events stream is dispatched in order"""
+    calls = []
+    handlers = {
+        "KEY_KP1": lambda: calls.append(1),
+        "KEY_KP0": lambda: calls.append(0),
+    }
+
+    async def events():
+        for code in (ecodes.KEY_KP1, ecodes.KEY_KP0, ecodes.KEY_KP1):
+            yield _key(code, 1)
+            yield _key(code, 0)
+
+    asyncio.run(dispatch_events(events(), handlers))
+    assert calls == [1, 0, 1]
+
+
+def test_use_event_loop():
+    """asyncio is always available, unknown loops are rejected"""
+    assert use_event_loop("asyncio") == "asyncio"
+    with pytest.raises(ValueError):
+        use_event_loop("trio")
+
+
+def test_bench():
+    """benchmark handles every event under each available loop"""
+    results = bench.run(["asyncio", "uvloop"], 20)
+    assert "asyncio" in results
+    for suite in results.values():
+        assert set(suite) == {
+            "keyboard burst",
+            "mqtt burst",
+            "keyboard paced",
+            "mqtt paced",
+        }
+        for stats in suite.values():
+            assert stats.count == 20
+            assert stats.throughput > 0
+
+
+def test_bench_out_of_order():
+    """latency is credited to the event started, not to the next one sent"""
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        recorder = bench._Recorder(2, loop)  # pylint: disable=protected-access
+        slow = loop.create_future()
+        handler = recorder.wrap(lambda result: result)
+        now = time.perf_counter()
+        recorder.sent.extend([now - 1, now])
+        handler(slow)
+        # the second command is done first
+        handler(None)
+        slow.set_result(None)
+        await asyncio.wait_for(recorder.done, 1)
+        return recorder.latencies
+
+    fast, slow = asyncio.run(main())
+    assert fast < 0.5
+    assert slow >= 1
@@ -0,0 +1,127 @@
+"""Loop lag sampler, stall watchdog and systemd notify tests"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+from media_center_kb import systemd
+from media_center_kb.lag import LoopLagSampler, StallWatchdog
+
+
+def test_sampler_callbacks():
+    """samples are recorded and passed to callbacks"""
+    sampler = LoopLagSampler()
+    seen = []
+    sampler.add_callback(seen.append)
+    for lag in (0.002, 0.3, 0.001):
+        sampler.sample(lag)
+    assert seen == [0.002, 0.3, 0.001]
+    assert sampler.last == 0.001
+    assert sampler.max == 0.3
+
+
+def test_lag_import_is_light():
+    """lag sampler does not pull in metrics and through it the controller"""
+    code = (
+        "import sys, media_center_kb.lag; "
+        "assert 'media_center_kb.metrics' not in sys.modules; "
+        "assert 'media_center_kb.control' not in sys.modules"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    subprocess.run([sys.executable, "-c", code], check=True, env=env)
+
+
+def test_stall_watchdog():
+    """blocked loop stack is captured once per stall"""
+    now = [0.0]
+    watchdog = StallWatchdog(interval=0.5, threshold=0.5, clock=lambda: now[0])
+    watchdog.start()
+    watchdog.stop()
+
+    now[0] = 0.9
+    watchdog.check()
+    assert watchdog.stalls == 0
+
+    now[0] = 1.1
+    watchdog.check()
+    now[0] = 2.0
+    watchdog.check()
+    assert watchdog.stalls == 1
+    # current thread is the "loop" thread
+    assert "test_stall_watchdog" in watchdog.loop_stack()
+
+    watchdog.beat()
+    now[0] = 2.5
+    watchdog.check()
+    assert watchdog.stalls == 1
+
+
+def test_stall_watchdog_thread():
+    """watchdog thread notices time.sleep in the loop"""
+
+    async def stall():
+        watchdog = StallWatchdog(interval=0.05, threshold=0.05)
+        sampler = LoopLagSampler(interval=0.05)
+        sampler.add_callback(watchdog.beat)
+        watchdog.start()
+        task = asyncio.create_task(sampler.run())
+        await asyncio.sleep(0.1)
+        time.sleep(0.3)
+        await asyncio.sleep(0.1)
+        task.cancel()
+        watchdog.stop()
+        return watchdog.stalls, sampler.max
+
+    stalls, max_lag = asyncio.run(stall())
+    assert stalls == 1
+    assert max_lag > 0.2
+
+
+def test_notify(monkeypatch: pytest.MonkeyPatch):
+    """states are sent to NOTIFY_SOCKET"""
+    monkeypatch.delenv("NOTIFY_SOCKET", raising=False)
+    assert not systemd.notify("READY=1")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "notify")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind(path)
+            monkeypatch.setenv("NOTIFY_SOCKET", path)
+            assert systemd.notify("READY=1")
+            assert sock.recv(64) == b"READY=1"
+
+
+def test_watchdog_interval(monkeypatch: pytest.MonkeyPatch):
+    """watchdog is enabled for this process only"""
+    monkeypatch.delenv("WATCHDOG_USEC", raising=False)
+    assert systemd.watchdog_interval() is None
+    monkeypatch.setenv("WATCHDOG_USEC", "30000000")
+    monkeypatch.setenv("WATCHDOG_PID", str(os.getpid()))
+    assert systemd.watchdog_interval() == 30.0
+    monkeypatch.setenv("WATCHDOG_PID", "1")
+    assert systemd.watchdog_interval() is None
+
+
+def test_watchdog_pinger():
+    """pings twice per interval and only while lag is under the limit"""
+    now = [0.0]
+    sent = []
+    pinger = systemd.WatchdogPinger(
+        10, 0.5, send=lambda state: sent.append(state) or True, clock=lambda: now[0]
+    )
+    pinger(0.01)
+    assert sent == ["WATCHDOG=1"]
+    now[0] = 1
+    pinger(0.01)
+    assert len(sent) == 1
+    now[0] = 6
+    pinger(1.0)
+    assert len(sent) == 1
+    pinger(0.01)
+    assert len(sent) == 2
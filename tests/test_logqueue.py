@@ -0,0 +1,71 @@
+"""Queue based logging tests"""
+
+import io
+import logging
+import queue
+
+from media_center_kb.logqueue import (
+    BatchStreamHandler,
+    DroppingQueueHandler,
+    LogWriter,
+    RateLimitFilter,
+)
+
+
+def _record(msg: str, level: int = logging.INFO, name: str = "kbb"):
+    return logging.LogRecord(name, level, __file__, 0, msg, None, None)
+
+
+class CountingStream(io.StringIO):
+    """StringIO counting flushes"""
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+
+def test_rate_limit():
+    """records over the rate are suppressed per logger, warnings always pass"""
+    now = [0.0]
+    limit = RateLimitFilter(rate=1, burst=2, clock=lambda: now[0])
+
+    assert limit.filter(_record("1"))
+    assert limit.filter(_record("2"))
+    assert not limit.filter(_record("3"))
+    assert not limit.filter(_record("4"))
+    assert limit.filter(_record("other logger", name="rly"))
+    assert limit.filter(_record("error", level=logging.ERROR))
+    assert limit.suppressed == {"kbb": 2}
+
+    now[0] = 1.0
+    record = _record("5")
+    assert limit.filter(record)
+    assert record.getMessage() == "5 (2 messages suppressed)"
+    assert not limit.suppressed
+
+
+def test_dropping_queue_handler():
+    """full queue drops records instead of blocking"""
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for i in range(5):
+        handler.handle(_record(str(i)))
+    assert handler.dropped == 3
+
+
+def test_writer_batches():
+    """queued records are written in order and flushed once per batch"""
+    stream = CountingStream()
+    log_queue: queue.Queue = queue.Queue()
+    for i in range(10):
+        log_queue.put(_record(str(i)))
+
+    writer = LogWriter(log_queue, BatchStreamHandler(stream), batch_size=4)
+    writer.start()
+    writer.stop()
+
+    assert stream.getvalue().split() == [str(i) for i in range(10)]
+    assert stream.flushes == 3
@@ -0,0 +1,32 @@
+"""Daemon wiring tests"""
+
+import pytest
+
+from media_center_kb.main import YSP_PORT_ARG, make_ysp
+
+
+class PortYsp:  # pylint: disable=too-few-public-methods
+    """Soundbar constructor taking the serial device"""
+
+    def __init__(self, port: str = "/dev/ttyUSB0", verbose: bool = False):
+        self.port = port
+        self.verbose = verbose
+
+
+class FixedPortYsp:  # pylint: disable=too-few-public-methods
+    """Soundbar constructor without a serial device argument"""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+
+
+def test_make_ysp():
+    """the serial port is passed only when set, by the pinned argument name"""
+    assert YSP_PORT_ARG == "port"
+    assert make_ysp(PortYsp, True).port == "/dev/ttyUSB0"
+    ysp = make_ysp(PortYsp, False, "/dev/pts/5")
+    assert ysp.port == "/dev/pts/5" and not ysp.verbose
+
+    assert make_ysp(FixedPortYsp, True).verbose
+    with pytest.raises(ValueError, match="/dev/pts/5"):
+        make_ysp(FixedPortYsp, False, "/dev/pts/5")
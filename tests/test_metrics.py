@@ -0,0 +1,131 @@
+"""Metrics tests"""
+
+import asyncio
+
+from media_center_kb.control import Controller
+from media_center_kb.lag import LoopLagSampler
+from media_center_kb.metrics import (
+    Counter,
+    DaemonMetrics,
+    Histogram,
+    MetricsServer,
+    Registry,
+)
+from media_center_kb.relays import RelayModule
+from media_center_kb.supervisor import Supervisor
+from media_center_kb.ysp_scheduler import YspScheduler
+
+from .conftest import WrapRelays
+from .mocks import GPMock, LoggerMock, YspMock
+
+
+def test_render():
+    """text exposition format"""
+    registry = Registry()
+    counter = registry.register(Counter("c_total", "A counter", ("cmd",)))
+    histogram = registry.register(Histogram("h_seconds", "A histogram", (), (0.1, 1)))
+    counter.inc("tv_on")
+    counter.inc("tv_on")
+    counter.inc('say "hi"')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE c_total counter" in lines
+    assert 'c_total{cmd="tv_on"} 2' in lines
+    assert 'c_total{cmd="say \\"hi\\""} 1' in lines
+    assert "# TYPE h_seconds histogram" in lines
+    assert 'h_seconds_bucket{le="0.1"} 1' in lines
+    assert 'h_seconds_bucket{le="1"} 2' in lines
+    assert 'h_seconds_bucket{le="+Inf"} 3' in lines
+    assert "h_seconds_sum 5.55" in lines
+    assert "h_seconds_count 3" in lines
+
+
+def test_daemon_metrics(relays: WrapRelays, ysp: YspMock, nosleep):
+    """commands, serial commands, relays and restarts are tracked"""
+    _ = nosleep
+
+    metrics = DaemonMetrics()
+    metrics.track_relays(relays)
+    metrics.track_restarts(Supervisor())
+
+    controller = Controller(relays, metrics.count_serial(ysp, ("close",)), None)
+    controller.add_observer(metrics.observe_command)
+    commands = controller.commands_map()
+    commands["tv_on"]()
+    commands["tv_on"]()
+    commands["printer_on"]()
+
+    assert metrics.command_duration.count("tv_on") == 2
+    assert metrics.command_duration.count("printer_on") == 1
+    assert ysp.is_power_on
+
+    text = metrics.registry.render()
+    assert 'mediackb_serial_commands_total{command="power_on"} 2' in text
+    assert 'mediackb_relay_toggles_total{relay="1"} 1' in text
+    assert 'mediackb_relay_toggles_total{relay="4"} 1' in text
+
+
+def test_lag():
+    """lag sampler samples end up in the histogram"""
+    metrics = DaemonMetrics()
+    sampler = LoopLagSampler()
+    histogram = metrics.track_lag(sampler)
+    for lag in (0.002, 0.3, 7):
+        sampler.sample(lag)
+    assert histogram.count() == 3
+    assert 'mediackb_loop_lag_seconds_bucket{le="10"} 3' in metrics.registry.render()
+
+
+def test_server():
+    """HTTP endpoint"""
+    registry = Registry()
+    registry.register(Counter("up_total", "Up")).inc()
+
+    async def scrape(path: bytes):
+        server = MetricsServer(registry, "127.0.0.1", 0)
+        handler = server._handle_client  # pylint: disable=protected-access
+        srv = await asyncio.start_server(handler, "127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET " + path + b" HTTP/1.1\r\nHost: x\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        srv.close()
+        await srv.wait_closed()
+        return response
+
+    response = asyncio.run(scrape(b"/metrics"))
+    assert response.startswith(b"HTTP/1.0 200 OK")
+    assert response.endswith(b"up_total 1\n")
+
+    response = asyncio.run(scrape(b"/other"))
+    assert response.startswith(b"HTTP/1.0 404")
+
+
+def test_rooms(relays: WrapRelays, ysp: YspMock, nosleep):
+    """rooms add their relays and soundbars under prefixed labels"""
+    _ = nosleep
+
+    metrics = DaemonMetrics()
+    metrics.track_relays(relays, "living")
+    metrics.track_relays(RelayModule(GPMock(), LoggerMock(), (20,)), "bed")
+    for room in ("living", "bed"):
+        metrics.track_soundbar(YspScheduler(ysp), room)
+        observer = metrics.command_observer(room)
+        observer("tv_on", 0.01)
+    proxy = metrics.count_serial(ysp, (), "bed")
+    proxy.power_on()
+
+    text = metrics.registry.render()
+    assert 'mediackb_relay_toggles_total{relay="living/1"} 0' in text
+    assert 'mediackb_relay_toggles_total{relay="bed/1"} 0' in text
+    assert 'mediackb_soundbar_online{room="bed"} 1' in text
+    assert 'mediackb_serial_commands_total{command="bed/power_on"} 1' in text
+    assert metrics.command_duration.count("living/tv_on") == 1
+
+    single = DaemonMetrics()
+    single.track_soundbar(YspScheduler(ysp))
+    assert "mediackb_soundbar_online 1" in single.registry.render()
@@ -0,0 +1,65 @@
+"""On-demand profiling tests"""
+
+import os
+import tempfile
+import tracemalloc
+
+import pytest
+
+from media_center_kb.profiling import Profiler
+
+
+@pytest.fixture
+def profile_dir():
+    """temporary capture directory"""
+    with tempfile.TemporaryDirectory() as tmp:
+        yield os.path.join(tmp, "captures")
+
+
+def test_toggle_profile(profile_dir: str):  # pylint: disable=redefined-outer-name
+    """second toggle stops capture, stats and text summary are written apart"""
+    profiler = Profiler(profile_dir)
+    assert profiler.toggle_profile() is None
+    assert profiler.profiling
+    sum(range(1000))
+    profile = profiler.toggle_profile()
+    assert not profiler.profiling
+    assert profile is not None and not profiler.files()
+    path = profiler.write_profile(profile)
+    assert os.path.exists(path)
+    with open(path[: -len(".prof")] + ".txt", encoding="utf-8") as summary:
+        assert "function calls" in summary.read()
+
+
+def test_memory_snapshot(profile_dir: str):  # pylint: disable=redefined-outer-name
+    """every request writes top allocations when tracing is on"""
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        tracemalloc.stop()
+        assert Profiler(profile_dir).memory_snapshot() is None
+        profiler = Profiler(profile_dir, top=5, trace_memory=True)
+        assert tracemalloc.is_tracing()
+
+        first = profiler.memory_snapshot()
+        data = [bytearray(1024) for _ in range(100)]
+        second = profiler.memory_snapshot()
+        assert first and second and first != second
+        with open(second, encoding="utf-8") as snapshot:
+            assert "growth since previous snapshot" in snapshot.read()
+        del data
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def test_rotation(profile_dir: str):  # pylint: disable=redefined-outer-name
+    """only the newest captures are kept"""
+    profiler = Profiler(profile_dir, keep=2)
+    for _ in range(4):
+        profiler.toggle_profile()
+        profile = profiler.toggle_profile()
+        assert profile is not None
+        profiler.write_profile(profile)
+    names = [os.path.basename(path) for path in profiler.files()]
+    assert len([name for name in names if name.endswith(".prof")]) == 2
+    assert len([name for name in names if name.endswith(".txt")]) == 2
@@ -51,3 +51,32 @@ def test_reset(gpio: GPMock, rel_module: RelayModule):
         rel_module.reset()
         for pin in Pins:
             assert gpio.low_count[pin] == 1
+
+
+def test_leases(gpio: GPMock, rel_module: RelayModule):
+    """shared relay is switched on by the first holder and off by the last one"""
+    pin = Pins[0]
+    tv = rel_module.lease(1, "tv")
+    turntable = rel_module.lease(1, "turntable")
+
+    tv.on()
+    turntable.on()
+    tv.on()
+    assert gpio.high_count[pin] == 1
+    assert turntable.shared()
+    assert rel_module.holders(1) == {"tv", "turntable"}
+
+    tv.off()
+    tv.off()
+    assert pin not in gpio.low_count
+    assert turntable.enabled()
+    assert not turntable.shared()
+
+    turntable.off()
+    assert gpio.low_count[pin] == 1
+    assert rel_module.toggles[1] == 2
+
+    turntable.on()
+    rel_module.reset()
+    assert not rel_module.holders(1)
+    assert gpio.low_count[pin] == 2
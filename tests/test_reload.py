@@ -0,0 +1,81 @@
+"""Configuration reload tests"""
+
+import asyncio
+import json
+
+import pytest
+
+from media_center_kb.control import Controller
+from media_center_kb.reload import Reloader
+from media_center_kb.supervisor import Supervisor
+
+from .conftest import WrapRelays
+from .mocks import YspMock
+
+
+def test_keymap(relays: WrapRelays, ysp: YspMock):
+    """custom keymap, unknown commands are rejected"""
+    controller = Controller(relays, ysp)
+    handlers = controller.kb_handlers({"KEY_A": "printer_on"})
+    assert list(handlers) == ["KEY_A"]
+    handlers["KEY_A"]()
+    assert relays.relay(4).is_on
+
+    with pytest.raises(ValueError):
+        controller.kb_handlers({"KEY_A": "coffee_on"})
+
+
+def test_reload(relays: WrapRelays, ysp: YspMock, tmp_path):
+    """only changed parts are swapped, bad config keeps the current one"""
+    config = tmp_path / "config.json"
+    mqtt = tmp_path / "mqtt.json"
+    config.write_text(json.dumps({"keymap": {"KEY_A": "printer_on"}}))
+    mqtt.write_text(json.dumps({"host": "a"}))
+
+    controller = Controller(relays, ysp)
+    supervisor = Supervisor()
+    ha_started = []
+
+    def ha_factory(settings):
+        async def ha():
+            ha_started.append(settings)
+            await asyncio.sleep(100)
+
+        return ha
+
+    async def main():
+        reloader = Reloader(controller, supervisor, str(config), str(mqtt), ha_factory)
+        handlers = reloader.kb_handlers
+        supervisor.add("ha", ha_factory(reloader.mqtt_settings))
+        task = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+
+        await handlers["KEY_A"]()
+        assert relays.relay(4).is_on
+
+        # keymap changes, HA is not restarted
+        config.write_text(json.dumps({"keymap": {"KEY_B": "printer_off"}}))
+        await reloader.reload()
+        assert reloader.kb_handlers is handlers
+        assert list(handlers) == ["KEY_B"]
+        await handlers["KEY_B"]()
+        assert not relays.relay(4).is_on
+
+        # broken config, nothing changes
+        config.write_text(json.dumps({"keymap": {"KEY_C": "coffee_on"}}))
+        await reloader.reload()
+        assert list(handlers) == ["KEY_B"]
+
+        # mqtt changes
+        config.write_text(json.dumps({"keymap": {"KEY_B": "printer_off"}}))
+        mqtt.write_text(json.dumps({"host": "b"}))
+        await reloader.reload()
+        await asyncio.sleep(0.01)
+        assert list(handlers) == ["KEY_B"]
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert ha_started == [{"host": "a"}, {"host": "b"}]
+    assert supervisor.restarts["ha"] == 0
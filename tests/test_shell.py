@@ -0,0 +1,78 @@
+"""Restricted shell tests"""
+
+import asyncio
+
+import pytest
+
+from media_center_kb.shell import RestrictedShell
+
+
+def test_run_captures_output():
+    """allowed command output and exit code are captured"""
+    shell = RestrictedShell(allowed_cmds=["echo hello", "false"])
+
+    result = asyncio.run(shell.run("echo hello"))
+    assert result.ok
+    assert result.stdout == "hello\n"
+
+    result = asyncio.run(shell.run("false"))
+    assert not result.ok
+    assert result.returncode == 1
+
+    result = shell.run_sync("echo hello")
+    assert result.ok
+    assert result.stdout == "hello\n"
+
+
+def test_run_timeout():
+    """hanging command is killed"""
+    shell = RestrictedShell(allowed_cmds=["sleep 10"], timeout=0.1)
+
+    result = asyncio.run(shell.run("sleep 10"))
+    assert result.returncode is None
+
+    result = shell.run_sync("sleep 10")
+    assert result.returncode is None
+
+
+def test_not_allowed():
+    """commands outside of the allow-list never run"""
+    shell = RestrictedShell(allowed_cmds=[])
+
+    with pytest.raises(PermissionError):
+        asyncio.run(shell.run("echo hello"))
+    with pytest.raises(PermissionError):
+        shell.run_sync("echo hello")
+    shell("echo hello")
+
+
+def test_call_does_not_block():
+    """command started from the event loop runs in background"""
+    shell = RestrictedShell(allowed_cmds=["sleep 0.2"])
+
+    async def call():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        shell("sleep 0.2")
+        elapsed = loop.time() - started
+        # pylint: disable=protected-access
+        assert len(shell._tasks) == 1
+        await asyncio.gather(*shell._tasks)
+        assert not shell._tasks
+        return elapsed
+
+    assert asyncio.run(call()) < 0.1
+
+
+def test_call_logs_failures(caplog):
+    """a command that cannot be started is logged, not left in the task"""
+    shell = RestrictedShell(allowed_cmds=["/nonexistent/poweroff"])
+
+    async def call():
+        shell("/nonexistent/poweroff")
+        # pylint: disable=protected-access
+        await asyncio.gather(*shell._tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(call())
+    assert "command failed" in caplog.text
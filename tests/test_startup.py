@@ -0,0 +1,23 @@
+"""Startup profile tests"""
+
+from media_center_kb.startup import StartupProfile, process_age
+
+
+def test_process_age():
+    """process age is known on linux and not negative"""
+    age = process_age()
+    assert age is None or age >= 0
+
+
+def test_phases():
+    """phases are recorded in order and reported once"""
+    profile = StartupProfile()
+    profile.mark("one")
+    profile.mark("two")
+    profile.report()
+    profile.report("again")
+
+    names = [name for name, _ in profile.phases]
+    assert names == ["interpreter", "one", "two", "ready"]
+    assert all(duration >= 0 for _, duration in profile.phases)
+    assert profile.elapsed >= sum(duration for _, duration in profile.phases[1:])
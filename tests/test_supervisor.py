@@ -0,0 +1,83 @@
+"""Supervisor tests"""
+
+import asyncio
+
+from media_center_kb.supervisor import Supervisor
+
+
+def test_restart_isolated():
+    """failing subsystem is restarted, others keep running"""
+
+    starts = {"flaky": 0, "steady": 0}
+    steady_ticks = []
+
+    async def flaky():
+        starts["flaky"] += 1
+        if starts["flaky"] < 3:
+            raise OSError("keypad unplugged")
+
+    async def steady():
+        starts["steady"] += 1
+        for i in range(10):
+            steady_ticks.append(i)
+            await asyncio.sleep(0.001)
+
+    supervisor = Supervisor(initial_delay=0.001, max_delay=0.002)
+    supervisor.add("flaky", flaky)
+    supervisor.add("steady", steady)
+
+    asyncio.run(asyncio.wait_for(supervisor.run(), 5))
+
+    assert starts == {"flaky": 3, "steady": 1}
+    assert supervisor.restarts == {"flaky": 2, "steady": 0}
+    assert steady_ticks == list(range(10))
+
+
+def test_backoff(monkeypatch):
+    """restart delay grows exponentially up to the limit"""
+
+    delays = []
+    orig = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        await orig(0)
+
+    async def failing():
+        if len(delays) < 5:
+            raise RuntimeError("broker down")
+
+    supervisor = Supervisor(initial_delay=1, max_delay=4)
+    supervisor.add("ha", failing)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    asyncio.run(asyncio.wait_for(supervisor.run(), 5))
+
+    assert delays == [1, 2, 4, 4, 4]
+    assert supervisor.restarts["ha"] == 5
+
+
+def test_cancel():
+    """cancelling the supervisor cancels subsystems"""
+
+    cancelled = []
+
+    async def forever():
+        try:
+            await asyncio.sleep(100)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        supervisor = Supervisor()
+        supervisor.add("kb", forever)
+        task = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        supervisor.add("late", forever)
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert cancelled == [True, True]
@@ -0,0 +1,184 @@
+"""Timer service tests"""
+
+import asyncio
+import datetime
+import json
+import threading
+import time
+from typing import List
+
+import pytest
+
+import media_center_kb.timers
+from media_center_kb.timers import TimerService, next_daily
+
+
+class Commands(dict):
+    """Command table recording executed commands"""
+
+    def __init__(self, *names: str):
+        super().__init__()
+        self.executed: List[str] = []
+        for name in names:
+            self[name] = self._command(name)
+
+    def _command(self, name: str):
+        async def command(*args):
+            self.executed.append(name if not args else f"{name}{args}")
+
+        return command
+
+
+def test_sleep_timers():
+    """timers fire in due order from a single loop timer"""
+    commands = Commands("printer_off", "turntable_off", "volume_set")
+    timers = TimerService(commands)
+
+    async def main():
+        task = asyncio.create_task(timers.run())
+        await asyncio.sleep(0)
+        for i in range(100):
+            timers.add("volume_set", [i], delay=10 + i)
+        timers.add("turntable_off", delay=0.05)
+        first = timers.add("printer_off", delay=0.02)
+        cancelled = timers.add("printer_off", delay=0.03)
+        assert timers.cancel(cancelled)
+        assert not timers.cancel(cancelled)
+        # waiting timers are not tasks
+        assert len(asyncio.all_tasks()) == 2
+        assert timers.timers()[0]["id"] == first
+
+        await asyncio.sleep(0.1)
+        assert commands.executed == ["printer_off", "turntable_off"]
+        assert len(timers.timers()) == 100
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert timers.fired == 2
+
+    with pytest.raises(ValueError):
+        timers.add("coffee_on", delay=1)
+    with pytest.raises(ValueError):
+        timers.add("printer_off")
+    with pytest.raises(ValueError):
+        timers.add("printer_off", daily="25:00")
+
+
+def test_daily():
+    """daily timers run at local time and come back the next day"""
+    noon = datetime.datetime(2024, 5, 1, 12, 0).timestamp()
+    assert (
+        next_daily("23:30", noon) == datetime.datetime(2024, 5, 1, 23, 30).timestamp()
+    )
+    assert next_daily("12:00", noon) == datetime.datetime(2024, 5, 2, 12, 0).timestamp()
+
+    commands = Commands("printer_off")
+    offset = [0.0]
+    timers = TimerService(commands, clock=lambda: time.time() + offset[0])
+
+    async def main():
+        task = asyncio.create_task(timers.run())
+        await asyncio.sleep(0)
+        timers.add("printer_off", daily="03:00")
+        due = timers.timers()[0]["due"]
+        offset[0] = due - time.time()
+        # pylint: disable=protected-access
+        timers._arm()
+        await asyncio.sleep(0.01)
+        assert commands.executed == ["printer_off"]
+        assert timers.timers()[0]["due"] == pytest.approx(due + 24 * 3600, abs=3600)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_persistence(tmp_path):
+    """timers survive restarts, overdue sleep timers run on start"""
+    path = str(tmp_path / "timers.json")
+    commands = Commands("printer_off", "turntable_off")
+    timers = TimerService(commands, path)
+    timers.add("turntable_off", delay=1000)
+    timers.add("printer_off", daily="23:30")
+    timers.cancel(timers.add("printer_off", delay=5))
+
+    restored = TimerService(commands, path)
+    assert restored.timers() == timers.timers()
+    assert restored.add("printer_off", delay=1) == 4
+
+    with open(path, "rt", encoding="utf8") as timers_file:
+        saved = json.load(timers_file)
+    assert saved["next_id"] == 5
+    saved["timers"] = [t for t in saved["timers"] if t["cmd"] != "printer_off"]
+    saved["timers"][0]["due"] = time.time() - 60
+    saved["timers"].append({"id": 9, "cmd": "coffee_on", "args": [], "due": 0})
+    with open(path, "wt", encoding="utf8") as timers_file:
+        json.dump(saved, timers_file)
+
+    restored = TimerService(commands, path)
+    assert len(restored.timers()) == 1
+
+    async def main():
+        task = asyncio.create_task(restored.run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert commands.executed == ["turntable_off"]
+    assert not TimerService(commands, path).timers()
+
+
+def test_batched_saves(tmp_path, monkeypatch):
+    """changes while running are written off the loop, together"""
+    path = str(tmp_path / "timers.json")
+    commands = Commands("printer_off")
+    timers = TimerService(commands, path)
+    loop_thread = threading.get_ident()
+    write_threads = []
+    write = timers._write  # pylint: disable=protected-access
+
+    def recording_write(data):
+        write_threads.append(threading.get_ident())
+        write(data)
+
+    monkeypatch.setattr(timers, "_write", recording_write)
+
+    async def main():
+        task = asyncio.create_task(timers.run())
+        await asyncio.sleep(0)
+        for _ in range(50):
+            timers.add("printer_off", delay=1000)
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert timers.saves == 1
+    assert write_threads and loop_thread not in write_threads
+    with open(path, "rt", encoding="utf8") as timers_file:
+        assert len(json.load(timers_file)["timers"]) == 50
+
+
+def test_clock_jump(monkeypatch):
+    """wall clock set forward after the timer was armed still fires it"""
+    monkeypatch.setattr(media_center_kb.timers, "MAX_WAIT", 0.01)
+    commands = Commands("printer_off")
+    offset = [0.0]
+    timers = TimerService(commands, clock=lambda: time.time() + offset[0])
+
+    async def main():
+        task = asyncio.create_task(timers.run())
+        await asyncio.sleep(0)
+        timers.add("printer_off", delay=3600)
+        await asyncio.sleep(0.03)
+        assert not commands.executed
+        # NTP sync after boot
+        offset[0] = 3600
+        await asyncio.sleep(0.03)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert commands.executed == ["printer_off"]
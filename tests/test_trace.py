@@ -0,0 +1,58 @@
+"""Input event trace tests"""
+
+import asyncio
+import io
+
+import pytest
+from evdev import InputEvent, ecodes
+
+from media_center_kb.trace import TraceWriter, read_trace, replay
+
+# pylint: disable=no-member
+
+
+def _trace() -> io.BytesIO:
+    out = io.BytesIO()
+    writer = TraceWriter(out)
+    for usec, code in ((0, ecodes.KEY_KP1), (20000, ecodes.KEY_KP0)):
+        writer.write(InputEvent(100, usec, ecodes.EV_KEY, code, 1))
+        writer.write(InputEvent(100, usec + 5000, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+        writer.write(InputEvent(100, usec + 10000, ecodes.EV_KEY, code, 0))
+    assert writer.count == 6
+    out.seek(0)
+    return out
+
+
+def test_roundtrip():
+    """events are read back with delays between them"""
+    records = list(read_trace(_trace()))
+    assert len(records) == 6
+    assert records[0] == (0.0, ecodes.EV_KEY, ecodes.KEY_KP1, 1)
+    assert records[1][0] == pytest.approx(0.005)
+    assert records[3] == (pytest.approx(0.01), ecodes.EV_KEY, ecodes.KEY_KP0, 1)
+
+
+def test_bad_trace():
+    """not a trace or truncated one is rejected"""
+    with pytest.raises(ValueError):
+        list(read_trace(io.BytesIO(b"garbage")))
+    data = _trace().getvalue()
+    with pytest.raises(ValueError):
+        list(read_trace(io.BytesIO(data[:-3])))
+
+
+def test_replay():
+    """replayed key presses reach handlers in order with original timing"""
+    records = list(read_trace(_trace()))
+    calls = []
+    handlers = {
+        "KEY_KP1": lambda: calls.append(1),
+        "KEY_KP0": lambda: calls.append(0),
+    }
+
+    stats = asyncio.run(replay(records, handlers, speed=1.0))
+    assert calls == [1, 0]
+    assert stats.count == 2
+
+    stats = asyncio.run(replay(records, handlers, speed=0))
+    assert calls == [1, 0, 1, 0]
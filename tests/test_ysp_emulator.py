@@ -0,0 +1,101 @@
+"""YSP-4000 emulator tests"""
+
+import asyncio
+
+import pytest
+
+from media_center_kb.main import make_ysp
+from media_center_kb.ysp_emulator import (
+    DC1,
+    ETX,
+    STX,
+    FrameParser,
+    YspEmulator,
+    operation_frame,
+    probe,
+)
+
+
+def test_frame_parser():
+    """frames split across reads, garbage between frames is dropped"""
+    parser = FrameParser()
+    frame = operation_frame(b"1A")
+    assert not parser.feed(b"xx" + frame[:3])
+    assert parser.feed(frame[3:] + bytes([DC1]) + b"000" + bytes([ETX])) == [
+        frame[:-1],
+        bytes([DC1]) + b"000",
+    ]
+    assert not parser.feed(b"noise")
+
+
+def test_round_trip():
+    """every command is answered no faster than the baud rate allows"""
+    baud = 38400
+
+    async def run():
+        emulator = YspEmulator(baud=baud)
+        emulator.open()
+        server = asyncio.create_task(emulator.serve())
+        try:
+            stats = await probe(emulator.path, 20)
+        finally:
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            emulator.close()
+        return emulator, stats
+
+    emulator, stats = asyncio.run(run())
+    assert stats.count == 20
+    assert emulator.frames_in == 20
+    assert emulator.reports == 20
+    # volume up then down
+    assert emulator.volume == 40
+    # 7 byte command in, 7 byte report out, 10 bits per byte
+    assert stats.p50 >= 14 * 10 / baud
+    assert emulator.bytes_in == 20 * len(operation_frame(b"1A"))
+
+
+def test_ready():
+    """ready command gets the configuration report with the model"""
+    emulator = YspEmulator()
+    # pylint: disable=protected-access
+    reply = emulator._reply(bytes([DC1]) + b"000")
+    assert reply is not None and b"YSP40" in reply
+    reply = emulator._reply(operation_frame(b"1D")[:-1])
+    assert reply is not None and reply[0] == STX and emulator.power
+
+
+def test_library():
+    """the installed yamaha-ysp-4000 opens the emulator port, its commands use
+    the emulated operation codes and its parser reads the emulated reports"""
+    ysp_module = pytest.importorskip("ysp4000.ysp")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        emulator = YspEmulator(baud=38400)
+        emulator.open()
+        server = asyncio.create_task(emulator.serve())
+        ysp = make_ysp(ysp_module.Ysp4000, False, emulator.path)
+        reports: list = []
+        ysp.register_state_update_cb(lambda **kwargs: reports.append(kwargs))
+        reader = asyncio.create_task(ysp.get_async_coro(loop))
+        try:
+            ysp.power_on()
+            ysp.volume_up()
+            for _ in range(200):
+                if any(report.get("volume") is not None for report in reports):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            for task in (reader, server):
+                task.cancel()
+            await asyncio.gather(reader, server, return_exceptions=True)
+            ysp.close()
+            emulator.close()
+        return emulator, reports
+
+    emulator, reports = asyncio.run(run())
+    assert emulator.power
+    assert emulator.volume == 41
+    volumes = [report["volume"] for report in reports if "volume" in report]
+    assert volumes and 0 <= int(volumes[-1]) <= 100
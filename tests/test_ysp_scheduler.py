@@ -0,0 +1,238 @@
+"""Soundbar command scheduler tests"""
+
+import asyncio
+import threading
+import time
+from typing import List
+
+from media_center_kb.breaker import CircuitBreaker
+from media_center_kb.ysp_scheduler import STATUS_QUERY, YspScheduler
+
+
+class RecordingYsp:  # pylint: disable=too-few-public-methods
+    """Records sent commands"""
+
+    def __init__(self):
+        self.sent: List[str] = []
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def command(*args):
+            self.sent.append(name if not args else f"{name}{args}")
+
+        return command
+
+
+def _with_scheduler(test, min_interval=0.0):
+    ysp = RecordingYsp()
+    scheduler = YspScheduler(ysp, ("register_state_update_cb",), min_interval)
+
+    async def run():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0)
+        try:
+            await test(scheduler, ysp)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    return scheduler, ysp
+
+
+def test_not_running():
+    """commands go straight through until the scheduler runs"""
+    ysp = RecordingYsp()
+    scheduler = YspScheduler(ysp)
+    scheduler.set_input_tv()
+    scheduler.volume_up()
+    assert ysp.sent == ["set_input_tv", "volume_up"]
+
+
+def test_priorities():
+    """power goes first, then mode changes, then volume"""
+
+    async def test(scheduler: YspScheduler, ysp: RecordingYsp):
+        scheduler.volume_up()
+        scheduler.volume_up()
+        scheduler.set_input_tv()
+        assert scheduler.pending() == ["set_input_tv", "volume_up", "volume_up"]
+        scheduler.power_on()
+        # power is not queued
+        assert ysp.sent == ["power_on"]
+        await asyncio.sleep(0.01)
+        assert ysp.sent == ["power_on", "set_input_tv", "volume_up", "volume_up"]
+
+    _with_scheduler(test)
+
+
+def test_supersede():
+    """newer commands drop the obsolete queued ones"""
+
+    async def test(scheduler: YspScheduler, ysp: RecordingYsp):
+        scheduler.set_input_tv()
+        scheduler.set_5beam()
+        scheduler.set_input_aux1()
+        scheduler.set_stereo()
+        scheduler.volume_up()
+        scheduler.set_volume_pct(30)
+        assert scheduler.pending() == [
+            "set_input_aux1",
+            "set_stereo",
+            "set_volume_pct",
+        ]
+        scheduler.power_off()
+        assert not scheduler.pending()
+        await asyncio.sleep(0.01)
+        assert ysp.sent == ["power_off"]
+
+    scheduler, _ = _with_scheduler(test)
+    assert scheduler.dropped == 6
+
+
+def test_threads():
+    """commands submitted from another thread are sent from the loop"""
+
+    async def test(scheduler: YspScheduler, ysp: RecordingYsp):
+        thread = threading.Thread(
+            target=lambda: [scheduler.volume_down() for _ in range(50)]
+        )
+        thread.start()
+        thread.join()
+        for _ in range(100):
+            if len(ysp.sent) == 50:
+                break
+            await asyncio.sleep(0.01)
+        assert ysp.sent == ["volume_down"] * 50
+
+    _with_scheduler(test)
+
+
+def test_flush_on_stop():
+    """queued commands are sent when the scheduler stops"""
+
+    async def test(scheduler: YspScheduler, ysp: RecordingYsp):
+        scheduler.set_input_tv()
+        scheduler.set_dsp_cinema()
+        await asyncio.sleep(0.01)
+        assert ysp.sent == ["set_input_tv"]
+
+    _, ysp = _with_scheduler(test, min_interval=1)
+    assert ysp.sent == ["set_input_tv", "set_dsp_cinema"]
+
+
+class ReportingYsp(RecordingYsp):  # pylint: disable=too-few-public-methods
+    """Soundbar that reports state after commands while connected"""
+
+    def __init__(self):
+        super().__init__()
+        self.connected = True
+        self.cbs: List = []
+
+    def register_state_update_cb(self, cb):
+        """add state callback"""
+        self.cbs.append(cb)
+
+    def unregister_state_update_cb(self, cb):
+        """remove state callback"""
+        self.cbs.remove(cb)
+
+    def __getattr__(self, name: str):
+        command = super().__getattr__(name)
+
+        def reporting(*args):
+            command(*args)
+            if self.connected:
+                for cb in self.cbs:
+                    cb(power="on")
+
+        return reporting
+
+
+def test_circuit_breaker():
+    """commands fail fast after missing reports and are resent on recovery"""
+    ysp = ReportingYsp()
+    breaker = CircuitBreaker("soundbar", threshold=2)
+    scheduler = YspScheduler(ysp, min_interval=0, breaker=breaker)
+
+    async def run():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0)
+        scheduler.power_on()
+        scheduler.check_health(time.monotonic() + 10)
+        assert scheduler.online
+
+        ysp.connected = False
+        for _ in range(2):
+            scheduler.volume_up()
+            await asyncio.sleep(0.01)
+            scheduler.check_health(time.monotonic() + 10)
+        assert not scheduler.online
+
+        # failing fast, only the latest command per setting is kept
+        scheduler.set_input_tv()
+        scheduler.set_input_aux1()
+        scheduler.volume_up()
+        scheduler.power_off()
+        scheduler.power_on()
+        assert scheduler.failed_fast == 5
+        sent = len(ysp.sent)
+
+        # probe with the status query while still disconnected
+        now = time.monotonic() + 10
+        scheduler.check_health(now)
+        assert len(ysp.sent) == sent
+        scheduler.check_health(now + 10)
+        assert ysp.sent[sent:] == [STATUS_QUERY]
+        scheduler.check_health(now + 15)
+        assert not scheduler.online
+
+        ysp.connected = True
+        scheduler.check_health(now + 25)
+        assert scheduler.online
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return sent
+
+    sent = asyncio.run(run())
+    assert ysp.sent[sent:] == [STATUS_QUERY, STATUS_QUERY, "power_on"]
+    assert breaker.opened == 1
+
+
+class NoStatusYsp(ReportingYsp):
+    """Soundbar library without the status query"""
+
+    def __getattr__(self, name: str):
+        if name == STATUS_QUERY:
+            raise AttributeError(name)
+        return super().__getattr__(name)
+
+
+def test_probe_without_power():
+    """breaker opened before any power command still probes and recovers"""
+    for ysp, probe in ((ReportingYsp(), STATUS_QUERY), (NoStatusYsp(), "power_off")):
+        breaker = CircuitBreaker("soundbar", threshold=1)
+        scheduler = YspScheduler(ysp, min_interval=0, breaker=breaker)
+
+        async def run(scheduler=scheduler, ysp=ysp):
+            task = asyncio.create_task(scheduler.run())
+            await asyncio.sleep(0)
+            ysp.connected = False
+            scheduler.set_input_tv()
+            await asyncio.sleep(0.01)
+            now = time.monotonic() + 10
+            scheduler.check_health(now)
+            assert not scheduler.online
+
+            ysp.connected = True
+            scheduler.check_health(now + 10)
+            assert scheduler.online
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(run())
+        assert ysp.sent == ["set_input_tv", probe]